@@ -0,0 +1,58 @@
+# Per-request latency of the /classify prediction: refit on every request vs trained model registry.
+# Graphviz/matplotlib rendering is left out, only the classification cost is measured.
+# Usage (from the repository root): python -m src.benchmarks.bench_classify [requests]
+import sys
+import time
+
+import pandas as pd
+
+from src.staticWeb import model
+
+sample = {
+    "cliente": 7,
+    "fecha_apertura": 1744675200.0,
+    "fecha_cierre": 1744934400.0,
+    "es_mantenimiento": 0,
+    "tipo_incidencia": 3,
+}
+
+
+def features():
+    # The sample with the columns the models were trained on (derived ones included), as /classify does
+    return model.to_matrix(pd.DataFrame([sample]))[model.FEATURES]
+
+
+def refit_every_request(model_name):
+    # Old behaviour of predict_model: load the JSON, process it and fit the model again
+    x_train, x_test, y_train, y_test = model.process(model.load_data())
+    clf = model.trainers[model_name](x_train, y_train)
+    return clf.predict(features())[0]
+
+
+def registry(model_name):
+    clf = model.get_model(model_name)["model"]
+    return clf.predict(features())[0]
+
+
+def measure(func, model_name, requests):
+    times = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        func(model_name)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[min(len(times) - 1, int(len(times) * 0.99))]
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"{'model':<12}{'mode':<12}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+    for model_name in model.trainers:
+        model.get_model(model_name)  # first request trains (or loads from disk)
+        for label, func in (("refit", refit_every_request), ("registry", registry)):
+            p50, p99 = measure(func, model_name, requests)
+            print(f"{model_name:<12}{label:<12}{p50 * 1000:>12.3f}{p99 * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
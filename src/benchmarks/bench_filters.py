@@ -0,0 +1,58 @@
+# Latency of the filtered dashboard rankings (date window, province, critical / maintenance only)
+# against a latency budget, with their EXPLAIN QUERY PLAN.
+# Usage (from the repository root):
+#   python -m src.benchmarks.bench_filters [--sizes 1000000 10000000] [--budget-ms 250]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from src.benchmarks.bench_queries import build_database, measure
+from src.staticWeb import queries
+
+rankings = {
+    "clients": (queries.FILTERED_CLIENTS_SQL, 10),
+    "incidents": (queries.FILTERED_INCIDENTS_SQL, 5),
+    "employees": (queries.FILTERED_EMPLOYEES_SQL, 10),
+}
+# Synthetic tickets open between 2020-01-01 and 2025-06 (see synthetic.py)
+filter_sets = {
+    "last_month": {"date_from": "2025-05-01", "date_to": "2025-05-31"},
+    "quarter_critical": {"date_from": "2025-01-01", "date_to": "2025-03-31", "critical_only": True},
+    "month_maintenance": {"date_from": "2024-11-01", "date_to": "2024-11-30", "maintenance_only": True},
+    "month_province": {"date_from": "2025-02-01", "date_to": "2025-02-28", "province": "Madrid"},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=250, help="maximum median latency of every query")
+    parser.add_argument("--directory", help="where to build the databases (default: temporary directory)")
+    args = parser.parse_args()
+
+    over_budget = []
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        for n_tickets in args.sizes:
+            start = time.perf_counter()
+            con = build_database(os.path.join(directory, f"bench_{n_tickets}.db"), n_tickets)
+            print(f"\n== {n_tickets:,} tickets (built in {time.perf_counter() - start:.1f} s)")
+            for filter_name, filters in filter_sets.items():
+                where, params = queries.ticket_filters(queries.normalize_filters(**filters))
+                for name, (sql, limit) in rankings.items():
+                    result = measure(con, sql.format(where=where), (*params, limit), args.repeat)
+                    print(f"{filter_name:<20}{name:<12}{result['median_ms']:>10.2f} ms")
+                    for step in result["plan"]:
+                        print(f"{'':<8}{step}")
+                    if result["median_ms"] > args.budget_ms:
+                        over_budget.append(f"{n_tickets}/{filter_name}/{name}: {result['median_ms']:.0f} ms")
+            con.close()
+    if over_budget:
+        sys.exit(f"Over the {args.budget_ms} ms budget: " + ", ".join(over_budget))
+    print(f"\nAll queries within {args.budget_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Compiled inference (compiled.py) against sklearn's predict for the "tree" and "forest" models:
+# latency of one row and throughput of a batch. That the results are identical is tested in
+# tests/test_compiled.py.
+# Usage (from the repository root):
+#   python -m src.benchmarks.bench_inference [--rows 2000] [--batch 10000]
+#   python -m src.benchmarks.bench_inference --synthetic 200000     (models fitted on synthetic tickets)
+import argparse
+import statistics
+import time
+from datetime import date
+
+import pandas as pd
+
+from src.benchmarks.synthetic import generate_tickets
+from src.staticWeb import model
+from src.staticWeb.compiled import compile_model
+
+MODELS = ("tree", "forest")
+
+
+def synthetic(n_tickets, seed):
+    # Synthetic tickets with a learnable label (long, non-maintenance tickets of some types are critical)
+    tickets = list(generate_tickets(n_tickets, seed, 500, 50))
+    for ticket in tickets:
+        days = (date.fromisoformat(ticket["fecha_cierre"]) - date.fromisoformat(ticket["fecha_apertura"])).days
+        ticket["es_critico"] = days >= 8 and not ticket["es_mantenimiento"] and ticket["tipo_incidencia"] in (1, 2, 4)
+    frame = pd.DataFrame.from_records(tickets)
+    return model.to_matrix(frame)[model.FEATURES], frame["es_critico"].astype(int)
+
+
+def fitted(model_name, n_synthetic):
+    # (sklearn model, test rows as a DataFrame)
+    if not n_synthetic:
+        entry = model.get_model(model_name)
+        return entry["model"], entry["x_test"]
+    x_train, y_train = synthetic(n_synthetic, seed=1)
+    x_test, _ = synthetic(max(1000, n_synthetic // 5), seed=2)
+    return model.trainers[model_name](x_train, y_train), x_test
+
+
+def timings(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return statistics.median(times), times[min(len(times) - 1, int(len(times) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2000, help="single-row predictions timed")
+    parser.add_argument("--batch", type=int, default=10000, help="rows of the batch timed")
+    parser.add_argument("--synthetic", type=int, default=0, help="fit on this many synthetic tickets")
+    args = parser.parse_args()
+
+    print(f"{'model':<8}{'nodes':>8}{'depth':>7}{'row sklearn µs':>16}{'row compiled µs':>17}"
+          f"{'batch sklearn ms':>18}{'batch compiled ms':>19}")
+    for model_name in MODELS:
+        clf, x_test = fitted(model_name, args.synthetic)
+        compiled = compile_model(clf)
+
+        one = x_test[:1]
+        row = one.to_numpy()[0]
+        sklearn_row, _ = timings(lambda: clf.predict(one), max(1, args.rows // 10))
+        compiled_row, _ = timings(lambda: compiled.predict_row(row), args.rows)
+        batch_frame = x_test.sample(args.batch, replace=True, random_state=0)
+        batch = batch_frame.to_numpy()
+        sklearn_batch, _ = timings(lambda: clf.predict(batch_frame), 5)
+        compiled_batch, _ = timings(lambda: compiled.predict(batch), 5)
+        print(f"{model_name:<8}{compiled.node_count:>8}{compiled.depth:>7}{sklearn_row * 1e6:>16.1f}"
+              f"{compiled_row * 1e6:>17.1f}{sklearn_batch * 1000:>18.2f}{compiled_batch * 1000:>19.2f}")
+
+
+if __name__ == "__main__":
+    main()
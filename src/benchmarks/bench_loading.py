@@ -0,0 +1,90 @@
+# Load stage throughput: one execute per row (previous loader) vs executemany batches.
+# Usage (from the repository root): python -m src.benchmarks.bench_loading [tickets] [baseline tickets]
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from src.benchmarks.synthetic import generate_data, generate_tickets
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "etl"))
+import loading  # noqa: E402
+
+schema = Path(__file__).resolve().parents[1] / "database" / "schema.sql"
+
+
+def new_database(directory, name):
+    path = os.path.join(directory, name)
+    con = sqlite3.connect(path)
+    con.executescript(schema.read_text())
+    con.commit()
+    return con
+
+
+def row_by_row(cur, tickets):
+    # Previous loader: one execute per ticket and contact, lastrowid to link the contacts
+    rows = 0
+    for ticket in tickets:
+        cur.execute("INSERT OR IGNORE INTO TICKET (CLIENTE_ID, FECHA_APERTURA, FECHA_CIERRE, ES_MANTENIMIENTO, "
+                    "SATISFACCION, INCIDENCIA_ID, ES_CRITICO) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (ticket["cliente"], ticket["fecha_apertura"], ticket["fecha_cierre"], ticket["es_mantenimiento"],
+                     ticket["satisfaccion_cliente"], ticket["tipo_incidencia"], ticket["es_critico"]))
+        ident = cur.lastrowid
+        rows += 1
+        for contact in ticket["contactos_con_empleados"]:
+            cur.execute("INSERT OR IGNORE INTO CONTACTO (TICKET_ID, EMPLEADO_ID, FECHA, TIEMPO) VALUES (?, ?, ?, ?)",
+                        (ident, contact["id_emp"], contact["fecha"], contact["tiempo"]))
+            rows += 1
+    return rows
+
+
+def batches(cur, tickets):
+    rows = 0
+    next_id = loading.next_ticket_id(cur)
+    for batch in loading.batched(tickets, loading.BATCH_SIZE):
+        next_id, inserted = loading.insert_tickets(cur, batch, next_id)
+        rows += inserted
+    return rows
+
+
+def timed(iterable, spent):
+    # Accumulates in spent[0] the time taken to generate the synthetic tickets, which is not load time
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            spent[0] += time.perf_counter() - start
+        yield item
+
+
+def main():
+    n_tickets = int(sys.argv[1]) if len(sys.argv) > 1 else 3_000_000
+    n_baseline = int(sys.argv[2]) if len(sys.argv) > 2 else min(n_tickets, 200_000)
+    dimensions = generate_data(0, n_clients=1000, n_employees=50, n_incidents=5)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for label, insert, count in (("row-by-row", row_by_row, n_baseline), ("executemany", batches, n_tickets)):
+            con = new_database(directory, f"{label}.db")
+            generating = [0.0]
+            tickets = timed(generate_tickets(count, seed=1, n_clients=1000, n_employees=50), generating)
+
+            def load(cur):
+                rows = loading.insert_clients(cur, dimensions["clientes"])
+                rows += loading.insert_employees(cur, dimensions["empleados"])
+                rows += loading.insert_incidents(cur, dimensions["tipos_incidentes"])
+                return rows + insert(cur, tickets)
+
+            rows, elapsed = loading.bulk_load(con, load)
+            elapsed -= generating[0]
+            con.close()
+            print(f"{label:<12}{count:>12,} tickets{rows:>14,} rows{elapsed:>9.1f} s{rows / elapsed:>14,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
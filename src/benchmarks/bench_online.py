@@ -0,0 +1,105 @@
+# Incremental updates of the online models (online.py) against full retraining on all the tickets,
+# after every batch of new tickets: update time and accuracy on a fixed hold-out set.
+# The synthetic tickets get a learnable label (long, non-maintenance tickets of some types are critical).
+# Usage (from the repository root):
+#   python -m src.benchmarks.bench_online [--initial 100000] [--batches 5] [--batch-size 20000]
+import argparse
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from src.benchmarks.synthetic import generate_data, generate_tickets
+from src.staticWeb import online
+from src.staticWeb.model import FEATURES, to_matrix
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "etl"))
+import loading  # noqa: E402
+
+schema = Path(__file__).resolve().parents[1] / "database" / "schema.sql"
+N_CLIENTS = 500
+N_EMPLOYEES = 50
+# Full retraining from scratch on every ticket loaded so far: the same linear model trained with fit
+# (epochs until convergence, not the single pass of partial_fit) and a forest fitted in one call
+full_trainers = {
+    "sgd": lambda x, y: make_pipeline(StandardScaler(),
+                                      SGDClassifier(loss="log_loss", alpha=1e-4, random_state=0)).fit(x, y),
+    "forest_online": lambda x, y: online.GrowingForest(trees_per_update=10).partial_fit(x, y),
+}
+
+
+def labelled_tickets(n_tickets, seed):
+    rng = random.Random(seed + 1000)
+    for ticket in generate_tickets(n_tickets, seed, N_CLIENTS, N_EMPLOYEES):
+        days = (date.fromisoformat(ticket["fecha_cierre"]) - date.fromisoformat(ticket["fecha_apertura"])).days
+        rule = days >= 8 and not ticket["es_mantenimiento"] and ticket["tipo_incidencia"] in (1, 2, 4)
+        # 5 % label noise
+        ticket["es_critico"] = rule != (rng.random() < 0.05)
+        yield ticket
+
+
+def load(con, tickets):
+    def insert(cur):
+        next_id = loading.next_ticket_id(cur)
+        next_id, rows = loading.insert_tickets(cur, list(tickets), next_id)
+        return rows
+    loading.bulk_load(con, insert)
+
+
+def hold_out(n_tickets):
+    frame = pd.DataFrame.from_records(list(labelled_tickets(n_tickets, seed=99)))
+    return to_matrix(frame)[FEATURES], frame["es_critico"].astype(int).to_numpy()
+
+
+def all_tickets(con):
+    frame = pd.read_sql_query(online.NEW_TICKETS_SQL, con, params=(0, -1))
+    return to_matrix(frame)[FEATURES], frame["es_critico"].astype(int).to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--initial", type=int, default=100_000)
+    parser.add_argument("--batches", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=20_000)
+    args = parser.parse_args()
+
+    x_test, y_test = hold_out(20_000)
+    with tempfile.TemporaryDirectory() as directory:
+        con = sqlite3.connect(f"{directory}/bench_online.db")
+        con.executescript(schema.read_text())
+        dimensions = generate_data(0, n_clients=N_CLIENTS, n_employees=N_EMPLOYEES)
+        loading.bulk_load(con, lambda cur: loading.insert_data({**dimensions, "tickets_emitidos": []}, cur))
+        snapshots = Path(directory) / "snapshots"
+
+        print(f"{'step':<6}{'tickets':>10}{'model':>15}{'incremental s':>15}{'acc':>7}{'full s':>10}{'acc':>7}")
+        for step in range(args.batches + 1):
+            size = args.initial if step == 0 else args.batch_size
+            load(con, labelled_tickets(size, seed=step))
+            total = con.execute("SELECT COUNT(*) FROM TICKET").fetchone()[0]
+            for name, full in full_trainers.items():
+                start = time.perf_counter()
+                entry = online.update(name, con, directory=snapshots)
+                incremental_time = time.perf_counter() - start
+                incremental_acc = np.mean(entry["model"].predict(x_test) == y_test)
+
+                start = time.perf_counter()
+                x_train, y_train = all_tickets(con)
+                model = full(x_train, y_train)
+                full_time = time.perf_counter() - start
+                full_acc = np.mean(model.predict(x_test) == y_test)
+                print(f"{step:<6}{total:>10,}{name:>15}{incremental_time:>15.3f}{incremental_acc:>7.3f}"
+                      f"{full_time:>10.3f}{full_acc:>7.3f}")
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# Feature extraction of model.process: per-ticket loop (previous version) vs columnar pipeline.
+# Usage (from the repository root): python -m src.benchmarks.bench_process [tickets]
+import sys
+import time
+
+import pandas as pd
+
+from src.benchmarks.synthetic import generate_data
+from src.staticWeb.model import extract_columns
+
+
+def loop_process(data):
+    # Previous implementation: two pd.to_datetime calls per ticket and a list of dicts
+    processed = []
+    for ticket in data.get("tickets_emitidos", []):
+        processed.append({
+            "cliente_id": ticket.get("cliente"),
+            "fecha_apertura": pd.to_datetime(ticket.get("fecha_apertura")).timestamp(),
+            "fecha_cierre": pd.to_datetime(ticket.get("fecha_cierre")).timestamp(),
+            "es_mantenimiento": int(ticket.get("es_mantenimiento")),
+            "tipo_incidencia": ticket.get("tipo_incidencia"),
+            "es_critico": int(ticket.get("es_critico"))
+        })
+    return pd.DataFrame(processed)
+
+
+def main():
+    n_tickets = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    start = time.perf_counter()
+    data = generate_data(n_tickets, seed=42)
+    print(f"Generated {n_tickets} tickets in {time.perf_counter() - start:.1f} s")
+
+    results = {}
+    for label, func in (("loop", loop_process), ("columnar", extract_columns)):
+        start = time.perf_counter()
+        df = func(data)
+        results[label] = time.perf_counter() - start
+        print(f"{label:<10}{results[label]:>10.2f} s{n_tickets / results[label]:>14,.0f} tickets/s  {df.shape}")
+    print(f"speedup: {results['loop'] / results['columnar']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
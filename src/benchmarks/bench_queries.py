@@ -0,0 +1,144 @@
+# EXPLAIN QUERY PLAN and latency of the dashboard queries: GROUP BY over TICKET and CONTACTO (the queries before the
+# summary tables) against the reads of the RESUMEN_* tables that the dashboards run.
+# Usage (from the repository root):
+#   python -m src.benchmarks.bench_queries [--sizes 10000 1000000 10000000] [--output results.json]
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from src.benchmarks.synthetic import generate_data, generate_tickets
+from src.staticWeb import queries
+from src.staticWeb.reports import pdf_reports
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "etl"))
+import loading  # noqa: E402
+
+schema = Path(__file__).resolve().parents[1] / "database" / "schema.sql"
+
+GROUP_BY_CLIENTS_SQL = """
+        SELECT C.NOMBRE AS CLIENT, COUNT(*) AS INCIDENT_COUNT
+        FROM TICKET T
+        JOIN CLIENTE C ON T.CLIENTE_ID = C.ID_CLIENTE
+        GROUP BY C.NOMBRE
+        ORDER BY INCIDENT_COUNT DESC
+        LIMIT ?
+        """
+
+GROUP_BY_INCIDENTS_SQL = """
+        SELECT I.NOMBRE AS INCIDENT_TYPE,
+        AVG(JULIANDAY(T.FECHA_CIERRE) - JULIANDAY(T.FECHA_APERTURA)) AS AVG_RESOLUTION_TIME
+        FROM TICKET T
+        JOIN INCIDENTE I ON T.INCIDENCIA_ID = I.ID_INCIDENTE
+        GROUP BY I.NOMBRE
+        ORDER BY AVG_RESOLUTION_TIME DESC
+        LIMIT ?
+        """
+
+GROUP_BY_EMPLOYEES_SQL = """
+         SELECT E.NOMBRE AS EMPLOYEE, SUM(C.TIEMPO) AS TOTAL_TIME
+         FROM CONTACTO C
+         JOIN EMPLEADO E ON C.EMPLEADO_ID = E.ID_EMPLEADO
+         GROUP BY E.NOMBRE
+         ORDER BY TOTAL_TIME DESC
+         LIMIT ?
+         """
+
+GROUP_BY_CLIENT_METRICS_SQL = """
+        SELECT c.ID_CLIENTE,
+               c.NOMBRE,
+               COUNT(t.rowid) AS total_incidencias,
+               ROUND(AVG(julianday(t.FECHA_CIERRE) - julianday(t.FECHA_APERTURA)), 2) AS tiempo_medio_dias,
+               ROUND(AVG(t.SATISFACCION), 2) AS satisfaccion_media
+        FROM CLIENTE c
+        JOIN TICKET t ON c.ID_CLIENTE = t.CLIENTE_ID
+        GROUP BY c.ID_CLIENTE
+        ORDER BY total_incidencias DESC
+        LIMIT ?
+        """
+
+# name: (GROUP BY query, summary table query, parameters)
+dashboard_queries = {
+    "top_clients_most_incidents": (GROUP_BY_CLIENTS_SQL, queries.TOP_CLIENTS_SQL, (10,)),
+    "top_incidents_type_by_resolution_time": (GROUP_BY_INCIDENTS_SQL, queries.TOP_INCIDENTS_SQL, (5,)),
+    "top_employees_by_resolution_time": (GROUP_BY_EMPLOYEES_SQL, queries.TOP_EMPLOYEES_SQL, (10,)),
+    "fetch_client_metrics": (GROUP_BY_CLIENT_METRICS_SQL, pdf_reports.CLIENT_METRICS_SQL, (10,)),
+}
+
+
+def build_database(path, n_tickets):
+    # Clients and employees grow with the number of tickets, incident types are fixed
+    n_clients = max(10, n_tickets // 100)
+    n_employees = max(15, n_tickets // 1000)
+    con = sqlite3.connect(path)
+    con.executescript(schema.read_text())
+    dimensions = generate_data(0, n_clients=n_clients, n_employees=n_employees)
+    tickets = generate_tickets(n_tickets, seed=3, n_clients=n_clients, n_employees=n_employees)
+
+    def load(cur):
+        rows = loading.insert_clients(cur, dimensions["clientes"])
+        rows += loading.insert_employees(cur, dimensions["empleados"])
+        rows += loading.insert_incidents(cur, dimensions["tipos_incidentes"])
+        next_id = loading.next_ticket_id(cur)
+        for batch in loading.batched(tickets, loading.BATCH_SIZE):
+            next_id, inserted = loading.insert_tickets(cur, batch, next_id)
+            rows += inserted
+        return rows
+
+    loading.bulk_load(con, load)
+    con.isolation_level = ""
+    con.execute("ANALYZE")
+    con.commit()
+    return con
+
+
+def measure(con, sql, params, repeat):
+    plan = [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    con.execute(sql, params).fetchall()  # warm page cache
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        con.execute(sql, params).fetchall()
+        times.append(time.perf_counter() - start)
+    return {"plan": plan, "median_ms": statistics.median(times) * 1000, "min_ms": min(times) * 1000}
+
+
+def run_size(directory, n_tickets, repeat):
+    start = time.perf_counter()
+    path = os.path.join(directory, f"bench_{n_tickets}.db")
+    con = build_database(path, n_tickets)
+    print(f"\n== {n_tickets:,} tickets (built in {time.perf_counter() - start:.1f} s)")
+    results = {}
+    for name, (group_by_sql, summary_sql, params) in dashboard_queries.items():
+        for label, sql in (("group_by", group_by_sql), ("summary", summary_sql)):
+            result = measure(con, sql, params, repeat)
+            results.setdefault(name, {})[label] = result
+            print(f"{name:<40}{label:<12}{result['median_ms']:>10.2f} ms")
+            for step in result["plan"]:
+                print(f"{'':<8}{step}")
+    con.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="JSON file for the plans and latencies")
+    parser.add_argument("--directory", help="where to build the databases (default: temporary directory)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        results = {n_tickets: run_size(directory, n_tickets, args.repeat) for n_tickets in args.sizes}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Full-population PDF report (all clients) with time and peak RSS limits, for several numbers of clients.
+# Every report is generated in a fresh process, so its peak RSS is not hidden by the database build
+# (the peak is kept for the whole life of a process); a streamed report keeps the growth flat.
+# Usage (from the repository root):
+#   python -m src.benchmarks.bench_report [--clients 10000 100000] [--max-seconds 120] [--max-rss-mb 300]
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from src.benchmarks.synthetic import generate_data, generate_tickets
+from src.staticWeb.reports import pdf_reports
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "etl"))
+import loading  # noqa: E402
+
+schema = Path(__file__).resolve().parents[1] / "database" / "schema.sql"
+root = Path(__file__).resolve().parents[2]
+
+
+def peak_rss_mb():
+    # VmHWM belongs to the process image: ru_maxrss (KiB on Linux) keeps the peak of the parent across
+    # fork and exec, so a child started after the database build would report the build's peak
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build_database(path, n_clients, tickets_per_client):
+    con = sqlite3.connect(path)
+    con.executescript(schema.read_text())
+    dimensions = generate_data(0, n_clients=n_clients, n_employees=50)
+    tickets = generate_tickets(n_clients * tickets_per_client, seed=5, n_clients=n_clients, n_employees=50)
+
+    def load(cur):
+        rows = loading.insert_clients(cur, dimensions["clientes"])
+        rows += loading.insert_employees(cur, dimensions["empleados"])
+        rows += loading.insert_incidents(cur, dimensions["tipos_incidentes"])
+        next_id = loading.next_ticket_id(cur)
+        for batch in loading.batched(tickets, loading.BATCH_SIZE):
+            next_id, inserted = loading.insert_tickets(cur, batch, next_id)
+            rows += inserted
+        return rows
+
+    loading.bulk_load(con, load)
+    con.close()
+
+
+def generate(db_path, output):
+    # Run in the child process: peak RSS before and after the report, printed as JSON
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    pdf_reports.generate_full_report(output, con)
+    elapsed = time.perf_counter() - start
+    con.close()
+    print(json.dumps({"seconds": elapsed, "rss_before": rss_before, "rss_peak": peak_rss_mb()}))
+
+
+def measure(db_path, output):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(root), os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-m", "src.benchmarks.bench_report", "--generate", db_path, output],
+                            cwd=root, env=env, capture_output=True, text=True)
+    if result.returncode:
+        sys.exit(f"report generation failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--tickets-per-client", type=int, default=3)
+    parser.add_argument("--max-seconds", type=float, default=120)
+    parser.add_argument("--max-rss-mb", type=float, default=300, help="limit for the growth of the peak RSS")
+    parser.add_argument("--directory", help="where to build the databases (default: temporary directory)")
+    parser.add_argument("--generate", nargs=2, metavar=("DB", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.generate:
+        generate(*args.generate)
+        return
+
+    results = []
+    for n_clients in args.clients:
+        with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+            db_path = os.path.join(directory, "bench_report.db")
+            start = time.perf_counter()
+            build_database(db_path, n_clients, args.tickets_per_client)
+            print(f"database with {n_clients:,} clients built in {time.perf_counter() - start:.1f} s")
+            output = os.path.join(directory, "informe_completo.pdf")
+            result = measure(db_path, output)
+            result["clients"] = n_clients
+            result["growth"] = result["rss_peak"] - result["rss_before"]
+            result["size_mb"] = os.path.getsize(output) / 2 ** 20
+            results.append(result)
+
+    print(f"\n{'clients':>10}{'report s':>10}{'RSS before MB':>15}{'peak RSS MB':>13}{'growth MB':>11}{'PDF MB':>8}")
+    for r in results:
+        print(f"{r['clients']:>10,}{r['seconds']:>10.1f}{r['rss_before']:>15.0f}{r['rss_peak']:>13.0f}"
+              f"{r['growth']:>11.0f}{r['size_mb']:>8.1f}")
+    if len(results) > 1:
+        first, last = results[0], results[-1]
+        print(f"{last['clients'] / first['clients']:.0f}x the clients: peak RSS growth "
+              f"{last['growth'] - first['growth']:+.0f} MB, time x{last['seconds'] / max(first['seconds'], 1e-9):.1f}")
+
+    failures = []
+    for r in results:
+        if r["seconds"] > args.max_seconds:
+            failures.append(f"{r['clients']:,} clients: time {r['seconds']:.1f} s > {args.max_seconds} s")
+        if r["growth"] > args.max_rss_mb:
+            failures.append(f"{r['clients']:,} clients: peak RSS +{r['growth']:.0f} MB > {args.max_rss_mb} MB")
+    if failures:
+        sys.exit("FAIL: " + ", ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Requests/s of the login and dashboard routes through the Flask test client,
+# with the connection pools and with one new connection per query (POOL_SIZE = 0).
+# Usage (from the repository root): python -m src.benchmarks.bench_routes [requests per thread] [threads]
+import sys
+import threading
+import time
+import uuid
+
+from src.database import database
+from src.staticWeb.web import app
+
+username = f"bench-{uuid.uuid4().hex[:8]}"
+password = "bench"
+dashboard_form = {"top_x_clientes": "10", "top_x_incidents": "5", "top_x_employees": "10",
+                  "show_employees_times": "on"}
+
+
+def login(client):
+    return client.post("/login", data={"username": username, "password": password})
+
+
+def dashboard(client):
+    return client.post("/", data=dashboard_form)
+
+
+def worker(route, requests, errors):
+    client = app.test_client()
+    if route is dashboard:
+        login(client)
+    for _ in range(requests):
+        if route(client).status_code >= 400:
+            errors.append(1)
+
+
+def measure(route, requests, threads):
+    errors = []
+    pool = [threading.Thread(target=worker, args=(route, requests, errors)) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return requests * threads / elapsed, len(errors)
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    database.create_user(username, password)
+    for pool_size in (0, database.POOL_SIZE):
+        for pool in (database.write_pool, database.read_pool):
+            pool.close()
+            pool.size = pool_size
+        label = "pooled" if pool_size else "no pool"
+        for route in (login, dashboard):
+            rate, errors = measure(route, requests, threads)
+            print(f"{label:<10}{route.__name__:<12}{rate:>10.1f} req/s  ({errors} errors)")
+
+
+if __name__ == "__main__":
+    main()
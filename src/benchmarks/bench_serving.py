@@ -0,0 +1,120 @@
+# Throughput of the development server (app.run, one process) against gunicorn with preloaded workers
+# (src/serve.py) on the same routes, driven by concurrent keep-alive clients.
+# Usage (from the repository root):
+#   python -m src.benchmarks.bench_serving [--threads 16] [--seconds 10] [--workers 4] [--routes /login /metrics]
+import argparse
+import http.client
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[2]
+DEV_SERVER = "from src.staticWeb.web import app; app.run(host='127.0.0.1', port={port}, threaded=True)"
+STARTUP_TIMEOUT = 120
+# /metrics needs a logged-in user or this token
+METRICS_TOKEN = secrets.token_hex(16)
+
+
+def start(command, port):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(root), os.environ.get("PYTHONPATH")])),
+               WEB_RELOAD_INTERVAL="0", METRICS_TOKEN=METRICS_TOKEN)
+    process = subprocess.Popen(command, cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{' '.join(command)} exited:\n{process.stderr.read().decode()[-2000:]}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/login")
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    sys.exit(f"{' '.join(command)} did not answer on port {port}")
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def drive(port, routes, threads, seconds):
+    # Requests per second and failed requests, every client keeps its connection open
+    counts = [0] * threads
+    errors = [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def client(index):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        i = 0
+        while time.monotonic() < deadline:
+            try:
+                connection.request("GET", routes[i % len(routes)],
+                                   headers={"Authorization": f"Bearer {METRICS_TOKEN}"})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    errors[index] += 1
+                else:
+                    counts[index] += 1
+            except (OSError, http.client.HTTPException):
+                errors[index] += 1
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            i += 1
+        connection.close()
+
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(threads)]
+    start_time = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start_time
+    return sum(counts) / elapsed, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="gunicorn worker processes")
+    parser.add_argument("--worker-threads", type=int, default=4, help="threads per gunicorn worker")
+    parser.add_argument("--routes", nargs="+", default=["/login", "/metrics"])
+    parser.add_argument("--port", type=int, default=8701)
+    args = parser.parse_args()
+
+    servers = {
+        "app.run (threaded)": [sys.executable, "-c", DEV_SERVER.format(port=args.port)],
+        f"gunicorn {args.workers}x{args.worker_threads}": [
+            sys.executable, "-m", "src.serve", "--bind", f"127.0.0.1:{args.port + 1}",
+            "--workers", str(args.workers), "--threads", str(args.worker_threads)],
+    }
+    results = {}
+    for port, (name, command) in enumerate(servers.items(), args.port):
+        process = start(command, port)
+        try:
+            results[name] = drive(port, args.routes, args.threads, args.seconds)
+        finally:
+            stop(process)
+
+    print(f"{args.threads} clients, {args.seconds:g} s, routes {' '.join(args.routes)}\n")
+    print(f"{'server':<24}{'req/s':>10}{'errors':>8}")
+    for name, (rate, errors) in results.items():
+        print(f"{name:<24}{rate:>10.0f}{errors:>8}")
+    baseline = next(iter(results.values()))[0]
+    for name, (rate, _) in list(results.items())[1:]:
+        print(f"\n{name}: {rate / baseline:.1f}x the development server")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Import time of the web app (python -X importtime), fails when it goes over the threshold
+# or when a heavy dependency is imported at startup again.
+# Usage (from the repository root):
+#   python -m src.benchmarks.bench_startup [--max-ms 800] [--runs 5] [--top 15]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[2]
+# Only imported on first use of the routes that need them (see WARMUP_MODULES in web.py)
+HEAVY = ("pandas", "numpy", "sklearn", "matplotlib", "graphviz", "reportlab", "sphinx", "scipy")
+
+
+def import_times(module):
+    # {module: (self µs, cumulative µs)} from -X importtime, and the wall time of the interpreter
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(root), os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=root, env=env,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        sys.exit(result.stderr[-2000:])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="src.staticWeb.web")
+    parser.add_argument("--max-ms", type=float, default=800, help="threshold for the median import time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    times = runs[-1][0]
+    import_ms = statistics.median(run[0][args.module][1] for run in runs) / 1000
+    wall_ms = statistics.median(run[1] for run in runs) * 1000
+    print(f"import {args.module}: {import_ms:.0f} ms (interpreter start + import: {wall_ms:.0f} ms)\n")
+    print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    for name, (self_us, cumulative_us) in sorted(times.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f}{self_us / 1000:>10.1f}  {name}")
+
+    failures = []
+    heavy = sorted(name for name in times if name.split(".")[0] in HEAVY and "." not in name)
+    if heavy:
+        failures.append(f"heavy modules imported at startup: {', '.join(heavy)}")
+    if import_ms > args.max_ms:
+        failures.append(f"import time {import_ms:.0f} ms > {args.max_ms} ms")
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+    print(f"\nOK: no heavy modules at startup, under {args.max_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Live rankings (streaming.py) against exact counts and against the full-scan GROUP BY query:
+# ingest rate, latency of a top-k read, recall and relative error of the top k, and the time of a
+# checkpoint to SQLite and of the restore, and the bounds of Space-Saving summaries merged like the
+# pending batches of the workers. Clients and employees are drawn from skewed (Zipf-like)
+# distributions, with many more clients than Space-Saving counters (on a uniform stream there are no heavy
+# hitters and the top k is not guaranteed). Runs against a temporary database.
+# Usage (from the repository root):
+#   python -m src.benchmarks.bench_streaming [--tickets 200000] [--clients 20000] [--top 10]
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from src.benchmarks.synthetic import generate_tickets
+from src.database import database
+from src.staticWeb import streaming
+
+schema = Path(__file__).resolve().parents[1] / "database" / "schema.sql"
+BATCH = 100
+SCAN_SQL = "SELECT CLIENTE_ID, COUNT(*) AS N FROM TICKET GROUP BY CLIENTE_ID ORDER BY N DESC LIMIT ?"
+
+
+def skewed_tickets(n_tickets, n_clients, n_employees, seed=0):
+    # Client i (and employee 100 + i) is drawn with probability ~ 1 / i
+    rng = random.Random(seed)
+    clients = rng.choices(range(1, n_clients + 1), [1 / rank for rank in range(1, n_clients + 1)], k=n_tickets)
+    employee_weights = [1 / rank for rank in range(1, n_employees + 1)]
+    for client, ticket in zip(clients, generate_tickets(n_tickets, seed, n_clients, n_employees)):
+        ticket["cliente"] = str(client)
+        for contact in ticket["contactos_con_empleados"]:
+            contact["id_emp"] = str(100 + rng.choices(range(1, n_employees + 1), employee_weights)[0])
+        yield ticket
+
+
+def accuracy(rows, exact, k):
+    # (recall of the exact top k, largest relative error of the reported values)
+    true_top = {key for key, _ in exact.most_common(k)}
+    recall = len(true_top & {row["key"] for row in rows}) / max(1, len(true_top))
+    error = max((abs(row["value"] - exact[row["key"]]) / exact[row["key"]] for row in rows if exact[row["key"]]),
+                default=0.0)
+    return recall, error
+
+
+def merge_check(batches=200, batch_size=50, capacity=20, n_keys=1000, seed=0):
+    # Summaries of small batches merged into one, as the checkpoints merge the pending events of every
+    # worker: count - error <= true <= count for every counter, and every key above total / capacity kept
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, n_keys + 1)]
+    merged = streaming.SpaceSaving(capacity)
+    exact = Counter()
+    for _ in range(batches):
+        pending = streaming.SpaceSaving(capacity)
+        for key in rng.choices(range(1, n_keys + 1), weights, k=batch_size):
+            pending.add(key)
+            exact[key] += 1
+        merged.merge(pending)
+    errors = [f"key {key}: {count - error} <= {exact[key]} <= {count} does not hold"
+              for key, (count, error) in merged.counters.items() if not count - error <= exact[key] <= count]
+    heavy = {key for key, count in exact.items() if count > merged.total / capacity}
+    missing = heavy - merged.counters.keys()
+    if missing:
+        errors.append(f"heavy keys missing after the merges: {sorted(missing)}")
+    return errors, len(heavy)
+
+
+def timed(function, repeat=200):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tickets", type=int, default=200000)
+    parser.add_argument("--clients", type=int, default=20000)
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.DB_PATH = os.path.join(directory, "streaming.db")
+        con = sqlite3.connect(database.DB_PATH)
+        con.executescript(schema.read_text())
+
+        tickets = list(skewed_tickets(args.tickets, args.clients, args.employees))
+        exact = {"clients": Counter(), "incidents": Counter(), "employees": Counter()}
+        for ticket in tickets:
+            exact["clients"][int(ticket["cliente"])] += 1
+            exact["incidents"][int(ticket["tipo_incidencia"])] += 1
+            for contact in ticket["contactos_con_empleados"]:
+                exact["employees"][int(contact["id_emp"])] += float(contact["tiempo"])
+
+        start = time.perf_counter()
+        for i in range(0, len(tickets), BATCH):
+            streaming.ingest(tickets[i:i + BATCH])
+        ingest = time.perf_counter() - start
+        events = sum(stream.events for stream in streaming._streams()[0].values())
+        print(f"{args.tickets} tickets, {events} events ingested in {ingest:.2f} s "
+              f"({events / ingest:,.0f} events/s, batches of {BATCH})\n")
+
+        view = streaming._streams()[0]
+        print(f"{'ranking':<11}{'keys':>8}{'top-k µs':>10}{'recall':>8}{'max rel. error':>16}")
+        failures = []
+        for name in streaming.ENTITIES:
+            seconds, rows = timed(lambda: view[name].top(args.top))
+            recall, error = accuracy(rows, exact[name], args.top)
+            print(f"{name:<11}{len(exact[name]):>8}{seconds * 1e6:>10.1f}{recall:>8.2f}{error:>16.4f}")
+            if recall < 0.9:
+                failures.append(f"{name}: recall {recall:.2f}")
+
+        # The same ranking from TICKET, as the dashboard would compute it after an ETL run
+        con.executemany("INSERT INTO TICKET (CLIENTE_ID, INCIDENCIA_ID) VALUES (?, ?)",
+                        ((int(t["cliente"]), int(t["tipo_incidencia"])) for t in tickets))
+        con.commit()
+        scan, _ = timed(lambda: con.execute(SCAN_SQL, (args.top,)).fetchall(), 5)
+        live, _ = timed(lambda: streaming.top("clients", args.top), 200)
+        print(f"\nclients top {args.top}: full scan {scan * 1000:.1f} ms, live ranking with names {live * 1e6:.0f} µs")
+
+        start = time.perf_counter()
+        streaming.checkpoint()
+        saved = time.perf_counter() - start
+        before = streaming.rankings(args.top)
+        # A new process: the state is read back from the checkpoint
+        streaming._state["pid"] = None
+        start = time.perf_counter()
+        after = streaming.rankings(args.top)
+        restored = time.perf_counter() - start
+        size = con.execute("SELECT SUM(LENGTH(CONTADORES) + LENGTH(SKETCH)) FROM STREAM_SKETCH").fetchone()[0]
+        print(f"checkpoint {saved * 1000:.1f} ms, restore {restored * 1000:.1f} ms, {size / 1024:.0f} KiB in SQLite")
+        if before != after:
+            failures.append("rankings differ after the restore")
+        con.close()
+        for pool in (database.write_pool, database.read_pool):
+            pool.close()
+        # Nothing left for the exit checkpoint, the temporary database is gone
+        streaming._state["pid"] = None
+
+    errors, heavy = merge_check()
+    print(f"merge of 200 pending summaries (capacity 20): {heavy} heavy keys, "
+          f"{'bounds hold' if not errors else 'FAILED'}")
+    failures.extend(errors)
+
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
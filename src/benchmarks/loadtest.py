@@ -0,0 +1,108 @@
+# End-to-end load test of the Flask app through the test client: p50/p99 latency and throughput per route.
+# By default the app runs against a temporary database loaded from a synthetic file (see synthetic.py).
+# Usage (from the repository root):
+#   python -m src.benchmarks.loadtest [--tickets 100000] [--threads 8] [--requests 200] [--routes login dashboard]
+#   python -m src.benchmarks.loadtest --database src/database/data.db      (existing database)
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from src.benchmarks.synthetic import write_json
+from src.database import database
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "etl"))
+import loading  # noqa: E402
+from transformation import stream_transform  # noqa: E402
+
+schema = Path(__file__).resolve().parents[1] / "database" / "schema.sql"
+username = f"load-{uuid.uuid4().hex[:8]}"
+password = "load"
+dashboard_form = {"top_x_clientes": "10", "top_x_incidents": "5", "top_x_employees": "10",
+                  "show_employees_times": "on"}
+classify_form = {"cliente": "3", "fecha_apertura": "2025-03-01", "fecha_cierre": "2025-03-05",
+                 "es_mantenimiento": "1", "tipo_incidencia": "2", "model": "forest"}
+
+
+def build_database(directory, n_tickets):
+    # Synthetic JSON -> streaming ETL -> temporary SQLite database
+    source = os.path.join(directory, "synthetic.json")
+    write_json(source, n_tickets)
+    path = os.path.join(directory, "loadtest.db")
+    con = sqlite3.connect(path)
+    con.executescript(schema.read_text())
+    rows, elapsed = loading.bulk_load(con, lambda cur: loading.insert_stream(cur, stream_transform(source)))
+    con.close()
+    print(f"{n_tickets:,} tickets loaded ({rows:,} rows in {elapsed:.1f} s)")
+    return path
+
+
+routes = {
+    "login": lambda client: client.post("/login", data={"username": username, "password": password}),
+    "dashboard": lambda client: client.post("/", data=dashboard_form),
+    "dashboard_get": lambda client: client.get("/"),
+    "classify": lambda client: client.post("/classify", data=classify_form),
+    "report_pdf": lambda client: client.get("/report/pdf"),
+}
+
+
+def worker(app, route, requests, latencies, errors):
+    client = app.test_client()
+    routes["login"](client)
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = route(client)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors.append(response.status_code)
+
+
+def run(app, name, requests, threads):
+    latencies = []
+    errors = []
+    pool = [threading.Thread(target=worker, args=(app, routes[name], requests, latencies, errors))
+            for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    cuts = statistics.quantiles(latencies, n=100)
+    return {"p50_ms": cuts[49] * 1000, "p99_ms": cuts[98] * 1000,
+            "throughput": len(latencies) / elapsed, "errors": len(errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--database", help="use this database instead of building a synthetic one")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per thread and route")
+    parser.add_argument("--routes", nargs="+", default=list(routes), choices=list(routes))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The pools open their connections lazily, DB_PATH only has to be set before the first request
+        database.DB_PATH = os.path.abspath(args.database or build_database(directory, args.tickets))
+        from src.staticWeb.web import app
+        database.create_user(username, password)
+        print(f"{'route':<16}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+        for name in args.routes:
+            # One warm-up request per route: model training, first report, page cache
+            routes[name](app.test_client())
+            result = run(app, name, args.requests, args.threads)
+            print(f"{name:<16}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+                  f"{result['throughput']:>10.1f}{result['errors']:>8}")
+        for pool in (database.write_pool, database.read_pool):
+            pool.close()
+
+
+if __name__ == "__main__":
+    main()
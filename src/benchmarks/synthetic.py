@@ -0,0 +1,109 @@
+# Deterministic synthetic data with the same schema as data/data_clasified.json
+# Usage (from the repository root), writes the file without keeping the tickets in memory:
+#   python -m src.benchmarks.synthetic out.json --tickets 10000000 [--clients N] [--employees N] [--seed 0]
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+
+START = date(2020, 1, 1)
+PROVINCES = ["Madrid", "Barcelona", "Valencia", "Sevilla", "Murcia", "Bilbao", "Zaragoza", "Málaga"]
+INCIDENT_TYPES = [
+    "Infecciones por código malicioso",
+    "Intrusiones o intentos de intrusión",
+    "Fraude",
+    "Contenido abusivo",
+    "Disponibilidad",
+]
+
+
+def generate_ticket(rng, n_clients, n_employees, n_incidents):
+    opened = START + timedelta(days=rng.randrange(2000))
+    days_open = rng.randrange(15)
+    contacts = []
+    for _ in range(rng.choice((1, 1, 1, 2, 2, 3))):
+        contacts.append({
+            "id_emp": str(101 + rng.randrange(n_employees)),
+            "fecha": (opened + timedelta(days=rng.randint(0, days_open))).isoformat(),
+            "tiempo": round(rng.uniform(0.5, 5.0), 1),
+        })
+    return {
+        "cliente": str(1 + rng.randrange(n_clients)),
+        "fecha_apertura": opened.isoformat(),
+        "fecha_cierre": (opened + timedelta(days=days_open)).isoformat(),
+        "es_mantenimiento": rng.random() < 0.5,
+        "satisfaccion_cliente": rng.randint(1, 10),
+        "tipo_incidencia": 1 + rng.randrange(n_incidents),
+        "es_critico": rng.random() < 0.3,
+        "contactos_con_empleados": contacts,
+    }
+
+
+def generate_tickets(n_tickets, seed=0, n_clients=10, n_employees=15, n_incidents=5):
+    rng = random.Random(seed)
+    for _ in range(n_tickets):
+        yield generate_ticket(rng, n_clients, n_employees, n_incidents)
+
+
+def generate_dimensions(seed=0, n_clients=10, n_employees=15, n_incidents=5):
+    rng = random.Random(seed)
+    return {
+        "clientes": [{"id_cli": str(i + 1), "nombre": f" Cliente {i + 1} S.L. ",
+                      "telefono": str(600000000 + i), "provincia": rng.choice(PROVINCES)}
+                     for i in range(n_clients)],
+        "empleados": [{"id_emp": str(101 + i), "nombre": f"Empleado {101 + i}", "nivel": 1 + i % 4,
+                       "fecha_contrato": (START - timedelta(days=30 * i)).isoformat()}
+                      for i in range(n_employees)],
+        "tipos_incidentes": [{"id_inci": str(i + 1), "nombre": INCIDENT_TYPES[i % len(INCIDENT_TYPES)]}
+                             for i in range(n_incidents)],
+    }
+
+
+def generate_data(n_tickets, seed=0, n_clients=10, n_employees=15, n_incidents=5):
+    data = {"tickets_emitidos": list(generate_tickets(n_tickets, seed, n_clients, n_employees, n_incidents))}
+    data.update(generate_dimensions(seed, n_clients, n_employees, n_incidents))
+    return data
+
+
+def default_sizes(n_tickets):
+    # Clients and employees grow with the number of tickets, as in a real dataset
+    return max(10, n_tickets // 100), max(15, n_tickets // 1000)
+
+
+def write_json(path, n_tickets, seed=0, n_clients=None, n_employees=None, n_incidents=5):
+    # Same layout as data_clasified.json (tickets first), one ticket serialized at a time
+    default_clients, default_employees = default_sizes(n_tickets)
+    n_clients = n_clients or default_clients
+    n_employees = n_employees or default_employees
+    with open(path, "w", encoding="utf-8") as file:
+        file.write('{\n  "tickets_emitidos": [')
+        for i, ticket in enumerate(generate_tickets(n_tickets, seed, n_clients, n_employees, n_incidents)):
+            file.write(",\n    " if i else "\n    ")
+            file.write(json.dumps(ticket, ensure_ascii=False))
+        file.write("\n  ]")
+        for key, records in generate_dimensions(seed, n_clients, n_employees, n_incidents).items():
+            file.write(f',\n  "{key}": ')
+            file.write(json.dumps(records, ensure_ascii=False, indent=4))
+        file.write("\n}\n")
+    return n_clients, n_employees
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic dataset with the schema of data_clasified.json")
+    parser.add_argument("output")
+    parser.add_argument("--tickets", type=int, default=1_000_000)
+    parser.add_argument("--clients", type=int, help="default: tickets / 100")
+    parser.add_argument("--employees", type=int, help="default: tickets / 1000")
+    parser.add_argument("--incidents", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    n_clients, n_employees = write_json(args.output, args.tickets, args.seed, args.clients, args.employees,
+                                        args.incidents)
+    print(f"{args.tickets:,} tickets, {n_clients:,} clients, {n_employees:,} employees "
+          f"written to {args.output} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
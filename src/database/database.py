@@ -1,12 +1,28 @@
 import sqlite3
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash, check_password_hash
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'data.db')
 
+# Conexiones abiertas que se guardan en cada pool (0 = abrir y cerrar una conexión por uso)
+POOL_SIZE = 8
+# Sentencias preparadas que sqlite3 reutiliza por conexión
+CACHED_STATEMENTS = 256
+
+# Funciones f(sql, segundos) llamadas tras cada sentencia de las conexiones de los pools (métricas)
+statement_hooks = []
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
 def init_db():
-    """Crea la tabla USUARIO si no existe."""
+    """Crea la tabla USUARIO si no existe y las tablas resumen de los dashboards si faltan."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute("""
@@ -16,37 +32,156 @@ def init_db():
         PASSWORD_HASH TEXT NOT NULL
     );
     """)
+    # WAL: las lecturas de los dashboards no bloquean las escrituras (y al revés)
+    cursor.execute("PRAGMA journal_mode = WAL")
+    # Una base cargada antes de las tablas RESUMEN_*: se crean y se calculan a partir de TICKET y CONTACTO
+    tickets = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'TICKET'").fetchone()
+    if tickets:
+        from src.etl import summaries
+        if summaries.ensure_tables(cursor):
+            summaries.rebuild(cursor)
     conn.commit()
     conn.close()
 
-def get_db():
-    init_db()      # <— Asegúrate de ejecutar esto antes de devolver la conexión
-    conn = sqlite3.connect(DB_PATH)
+
+def ensure_db():
+    # Inicialización del esquema una sola vez por proceso
+    global _initialized
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                init_db()
+                _initialized = True
+
+
+def report_statement(sql, start):
+    elapsed = time.perf_counter() - start
+    for hook in statement_hooks:
+        hook(sql, elapsed)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor que mide cada sentencia (pandas usa cursor().execute)."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            report_statement(sql, start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            report_statement(sql, start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Conexión cuyos cursores miden el tiempo de las sentencias."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=CACHED_STATEMENTS, timeout=10,
+                           factory=TimedConnection)
+    conn.execute("PRAGMA synchronous = NORMAL")
     conn.row_factory = sqlite3.Row
     return conn
 
+
+def connect_read_only():
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False,
+                           cached_statements=CACHED_STATEMENTS, factory=TimedConnection)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class ConnectionPool:
+    """Pool de conexiones reutilizables, cada conexión la usa un solo hilo a la vez."""
+
+    def __init__(self, factory, size=POOL_SIZE):
+        self.factory = factory
+        self.size = size
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue()
+
+    def acquire(self):
+        # Un proceso hijo (fork) no reutiliza las conexiones del padre
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle = queue.LifoQueue()
+        ensure_db()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.factory()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self.pid == os.getpid() and self.idle.qsize() < self.size:
+            self.idle.put(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+write_pool = ConnectionPool(connect)
+read_pool = ConnectionPool(connect_read_only)
+
+
+def get_db():
+    # with get_db() as db: ... (la conexión vuelve al pool al salir)
+    return write_pool.connection()
+
+
+def get_read_db():
+    # Conexión de solo lectura para los dashboards e informes
+    return read_pool.connection()
+
 # --- Funciones de Usuario ---
 
 def create_user(username, password):
     pw_hash = generate_password_hash(password)
-    db = get_db()
-    try:
-        db.execute(
-            "INSERT INTO USUARIO (USERNAME, PASSWORD_HASH) VALUES (?, ?)",
-            (username, pw_hash)
-        )
-        db.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False  # usuario ya existe
+    with get_db() as db:
+        try:
+            db.execute(
+                "INSERT INTO USUARIO (USERNAME, PASSWORD_HASH) VALUES (?, ?)",
+                (username, pw_hash)
+            )
+            db.commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False  # usuario ya existe
 
 
 def authenticate_user(username, password):
-    db = get_db()
-    row = db.execute(
-        "SELECT ID_USUARIO, USERNAME, PASSWORD_HASH FROM USUARIO WHERE USERNAME = ?",
-        (username,)
-    ).fetchone()
+    with get_db() as db:
+        row = db.execute(
+            "SELECT ID_USUARIO, USERNAME, PASSWORD_HASH FROM USUARIO WHERE USERNAME = ?",
+            (username,)
+        ).fetchone()
     if row and check_password_hash(row['PASSWORD_HASH'], password):
         return {'id': row['ID_USUARIO'], 'username': row['USERNAME']}
-    return None
\ No newline at end of file
+    return None
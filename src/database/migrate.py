@@ -0,0 +1,63 @@
+# Aplica los índices definidos en schema.sql (y borra los obsoletos) y las tablas resumen a una base de datos ya
+# creada, sin borrar datos.
+# Uso (desde la raíz del repositorio): python -m src.database.migrate [ruta de la base de datos]
+import os
+import re
+import sqlite3
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'data.db')
+SCHEMA_PATH = os.path.join(BASE_DIR, 'schema.sql')
+# Índices de las consultas que ahora leen las tablas resumen: ninguna consulta los usa y cada carga los mantiene
+OBSOLETE_INDEXES = ['IDX_TICKET_CLIENTE', 'IDX_TICKET_INCIDENCIA', 'IDX_CONTACTO_EMPLEADO']
+
+sys.path.insert(0, os.path.join(BASE_DIR, '..', 'etl'))
+import summaries  # noqa: E402
+
+
+def index_statements():
+    # Sentencias CREATE INDEX de schema.sql (sin comentarios)
+    with open(SCHEMA_PATH, encoding='utf-8') as file:
+        schema = re.sub(r'--[^\n]*', '', file.read())
+    return [sql.strip() for sql in schema.split(';')
+            if re.match(r'\s*CREATE\s+(UNIQUE\s+)?INDEX', sql, re.IGNORECASE)]
+
+
+def apply_indexes(conn):
+    # Devuelve los índices creados o ya existentes y los que no se pueden crear (columnas que faltan)
+    applied, skipped = [], []
+    for sql in index_statements():
+        name = re.search(r'INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', sql, re.IGNORECASE).group(1)
+        try:
+            conn.execute(sql)
+            applied.append(name)
+        except sqlite3.OperationalError as e:
+            skipped.append((name, str(e)))
+    for name in OBSOLETE_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+    # Estadísticas para que el planificador elija los índices nuevos
+    conn.execute('ANALYZE')
+    conn.commit()
+    return applied, skipped
+
+
+def apply_summaries(conn):
+    # Crea las tablas resumen y las calcula con los tickets existentes si no estaban
+    cursor = conn.cursor()
+    created = summaries.ensure_tables(cursor)
+    if created:
+        summaries.rebuild(cursor)
+    conn.commit()
+    return created
+
+
+if __name__ == '__main__':
+    connection = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    if apply_summaries(connection):
+        print('Tablas resumen creadas')
+    done, failed = apply_indexes(connection)
+    connection.close()
+    print('Índices aplicados:', ', '.join(done))
+    for index, error in failed:
+        print(f'No se ha podido crear {index}: {error}')
@@ -7,6 +7,8 @@ CREATE TABLE CLIENTE (
     TELEFONO         VARCHAR(25),
     PROVINCIA       VARCHAR(25)
 );
+-- clients of a province (filtered rankings)
+CREATE INDEX IF NOT EXISTS IDX_CLIENTE_PROVINCIA ON CLIENTE(PROVINCIA, ID_CLIENTE);
 
 DROP TABLE IF EXISTS EMPLEADO;
 CREATE TABLE EMPLEADO (
@@ -31,10 +33,20 @@ CREATE TABLE TICKET(
     SATISFACCION       INT CHECK (SATISFACCION BETWEEN 1 AND 10),
     INCIDENCIA_ID      INT,
     ES_CRITICO         CHECK (ES_CRITICO IN (0,1)),
+    CLAVE              VARCHAR(100),        -- natural key (cliente|fecha_apertura|tipo_incidencia|occurrence)
+    HUELLA             VARCHAR(40),         -- hash of the source record, detects changed tickets
     FOREIGN KEY (CLIENTE_ID) REFERENCES CLIENTE(ID_CLIENTE) ON DELETE CASCADE,
     FOREIGN KEY (INCIDENCIA_ID) REFERENCES INCIDENTE(ID_INCIDENTE) ON DELETE CASCADE
 );
 
+CREATE UNIQUE INDEX IF NOT EXISTS IDX_TICKET_CLAVE ON TICKET(CLAVE);
+-- the unfiltered rankings and the client metrics read the RESUMEN_* tables (src/etl/summaries.py), TICKET only
+-- has indexes for the queries that still read it:
+-- filtered rankings (date window, critical / maintenance only): date first, the columns of the rankings covered
+CREATE INDEX IF NOT EXISTS IDX_TICKET_FECHA ON TICKET(FECHA_APERTURA, CLIENTE_ID, INCIDENCIA_ID, FECHA_CIERRE, ES_CRITICO, ES_MANTENIMIENTO);
+CREATE INDEX IF NOT EXISTS IDX_TICKET_CRITICO ON TICKET(FECHA_APERTURA, CLIENTE_ID, INCIDENCIA_ID, FECHA_CIERRE) WHERE ES_CRITICO = 1;
+CREATE INDEX IF NOT EXISTS IDX_TICKET_MANTENIMIENTO ON TICKET(FECHA_APERTURA, CLIENTE_ID, INCIDENCIA_ID, FECHA_CIERRE) WHERE ES_MANTENIMIENTO = 1;
+
 
 -- contacts with employees
 DROP TABLE IF EXISTS CONTACTO;
@@ -47,3 +59,85 @@ CREATE TABLE CONTACTO (
     FOREIGN KEY (TICKET_ID) REFERENCES TICKET(ID_TICKET) ON DELETE CASCADE,
     FOREIGN KEY (EMPLEADO_ID) REFERENCES EMPLEADO(ID_EMPLEADO) ON DELETE CASCADE
 );
+
+-- contacts of a ticket (incremental loads), covering for the filtered employee ranking
+CREATE INDEX IF NOT EXISTS IDX_CONTACTO_TICKET ON CONTACTO(TICKET_ID, EMPLEADO_ID, TIEMPO);
+
+-- watermarks of the incremental loads, one row per source file (ENTIDAD '*' = whole file)
+DROP TABLE IF EXISTS ETL_WATERMARK;
+CREATE TABLE ETL_WATERMARK (
+    ORIGEN              TEXT,
+    ENTIDAD             TEXT,
+    HUELLA              VARCHAR(64),
+    REGISTROS           INT,
+    FECHA_MAX           DATE,
+    TAMANO              INT,
+    MTIME               INT,
+    ACTUALIZADO         TIMESTAMP,
+    PRIMARY KEY (ORIGEN, ENTIDAD)
+);
+
+-- summary tables of the dashboards, maintained by the ETL loaders (src/etl/summaries.py)
+DROP TABLE IF EXISTS RESUMEN_CLIENTE;
+CREATE TABLE RESUMEN_CLIENTE (
+    CLIENTE_ID          INT PRIMARY KEY,
+    NUM_TICKETS         INT DEFAULT 0,
+    NUM_TIEMPO          INT DEFAULT 0,      -- tickets with both dates
+    TIEMPO_TOTAL        FLOAT DEFAULT 0,    -- days
+    NUM_SATISFACCION    INT DEFAULT 0,
+    SATISFACCION_TOTAL  FLOAT DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS IDX_RESUMEN_CLIENTE_TICKETS ON RESUMEN_CLIENTE(NUM_TICKETS);
+
+DROP TABLE IF EXISTS RESUMEN_INCIDENTE;
+CREATE TABLE RESUMEN_INCIDENTE (
+    INCIDENCIA_ID       INT PRIMARY KEY,
+    NUM_TICKETS         INT DEFAULT 0,
+    NUM_TIEMPO          INT DEFAULT 0,
+    TIEMPO_TOTAL        FLOAT DEFAULT 0,
+    NUM_SATISFACCION    INT DEFAULT 0,
+    SATISFACCION_TOTAL  FLOAT DEFAULT 0
+);
+
+DROP TABLE IF EXISTS RESUMEN_EMPLEADO;
+CREATE TABLE RESUMEN_EMPLEADO (
+    EMPLEADO_ID         INT PRIMARY KEY,
+    NUM_CONTACTOS       INT DEFAULT 0,
+    TIEMPO_TOTAL        FLOAT DEFAULT 0,    -- hours of contact
+    NUM_SATISFACCION    INT DEFAULT 0,
+    SATISFACCION_TOTAL  FLOAT DEFAULT 0
+);
+
+-- version of the data, incremented by the ETL on every commit (invalidates the caches of the web app)
+DROP TABLE IF EXISTS VERSION_DATOS;
+CREATE TABLE VERSION_DATOS (
+    ID                  INTEGER PRIMARY KEY CHECK (ID = 1),
+    VERSION             INT
+);
+INSERT INTO VERSION_DATOS (ID, VERSION) VALUES (1, 1);
+
+-- last good copy of the CVE feed, replaced by the refresher of the web app (staticWeb/cve.py)
+DROP TABLE IF EXISTS CVE;
+CREATE TABLE CVE (
+    POSICION            INT PRIMARY KEY,
+    ID_CVE              TEXT,
+    FECHA               TEXT,
+    DESCRIPCION         TEXT,
+    CWE                 TEXT,
+    SEVERIDAD           TEXT,
+    ACTUALIZADO         TIMESTAMP
+);
+
+-- live rankings (Space-Saving counters and Count-Min sketch), checkpointed by the web app (staticWeb/streaming.py)
+DROP TABLE IF EXISTS STREAM_SKETCH;
+CREATE TABLE STREAM_SKETCH (
+    NOMBRE              TEXT PRIMARY KEY,   -- clients, incidents, employees
+    CAPACIDAD           INT,
+    ANCHO               INT,
+    PROFUNDIDAD         INT,
+    EVENTOS             INT,
+    TOTAL               FLOAT,
+    CONTADORES          TEXT,               -- JSON [[id, count, error], ...]
+    SKETCH              BLOB,               -- PROFUNDIDAD rows of ANCHO float64 counters
+    ACTUALIZADO         TIMESTAMP
+);
@@ -0,0 +1,185 @@
+# Columnar copy of TICKET and CONTACTO for analytics, partitioned by opening month (MES=YYYY-MM).
+#   python columnar.py [database] [--format parquet|arrow] [--output DIR]
+# "arrow" writes uncompressed Arrow IPC files that are memory-mapped on read (zero-copy),
+# "parquet" writes smaller compressed files that are decoded on read.
+import argparse
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+STORE = Path(__file__).resolve().parents[1] / "database" / "columnar"
+FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+# Rows read from SQLite per record batch
+FETCH_ROWS = 100_000
+
+TICKET_SCHEMA = pa.schema([
+    ("ID_TICKET", pa.int64()),
+    ("CLIENTE_ID", pa.int64()),
+    ("FECHA_APERTURA", pa.date32()),
+    ("FECHA_CIERRE", pa.date32()),
+    ("ES_MANTENIMIENTO", pa.int8()),
+    ("SATISFACCION", pa.int8()),
+    ("INCIDENCIA_ID", pa.int64()),
+    ("ES_CRITICO", pa.int8()),
+    ("MES", pa.string()),
+])
+CONTACT_SCHEMA = pa.schema([
+    ("ID_CONTACTO", pa.int64()),
+    ("TICKET_ID", pa.int64()),
+    ("EMPLEADO_ID", pa.int64()),
+    ("FECHA", pa.date32()),
+    ("TIEMPO", pa.float64()),
+    ("MES", pa.string()),
+])
+# Contacts are stored in the partition of their ticket, so a month filter selects both sides
+EXPORTS = {
+    "TICKET": (TICKET_SCHEMA, """
+        SELECT ID_TICKET, CLIENTE_ID, FECHA_APERTURA, FECHA_CIERRE, ES_MANTENIMIENTO, SATISFACCION,
+               INCIDENCIA_ID, ES_CRITICO, COALESCE(strftime('%Y-%m', FECHA_APERTURA), 'sin_fecha')
+        FROM TICKET"""),
+    "CONTACTO": (CONTACT_SCHEMA, """
+        SELECT c.ID_CONTACTO, c.TICKET_ID, c.EMPLEADO_ID, c.FECHA, c.TIEMPO,
+               COALESCE(strftime('%Y-%m', t.FECHA_APERTURA), 'sin_fecha')
+        FROM CONTACTO c
+        JOIN TICKET t ON t.ID_TICKET = c.TICKET_ID"""),
+}
+VERSION_FILE = "VERSION"
+
+
+def record_batches(con, sql, schema, fetch_rows=FETCH_ROWS):
+    # SQLite rows -> Arrow record batches, one block of rows in memory at a time
+    cursor = con.execute(sql)
+    while True:
+        rows = cursor.fetchmany(fetch_rows)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        arrays = []
+        for field, values in zip(schema, columns):
+            if pa.types.is_date32(field.type):
+                # Dates are stored as ISO text in SQLite (a time part is ignored); "None", empty or other
+                # text and non-text values are null, like strftime() for the MES column
+                text = pa.array([value if isinstance(value, str) else None for value in values], pa.string())
+                timestamps = pc.strptime(pc.utf8_slice_codeunits(text, 0, 10), format="%Y-%m-%d", unit="s",
+                                         error_is_null=True)
+                arrays.append(timestamps.cast(field.type, safe=False))
+            else:
+                arrays.append(pa.array(values, field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def data_version(con):
+    try:
+        row = con.execute("SELECT VERSION FROM VERSION_DATOS").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def export(con, output=STORE, file_format="parquet", fetch_rows=FETCH_ROWS):
+    # Writes the whole store into a temporary directory and swaps it in, readers never see half an export.
+    # The batches are pulled by a pyarrow thread (one at a time): con needs check_same_thread=False
+    output = Path(output)
+    tmp = output.with_name(f".{output.name}.{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    version = data_version(con)
+    rows = 0
+    for table, (schema, sql) in EXPORTS.items():
+        counted = []
+
+        def batches():
+            for batch in record_batches(con, sql, schema, fetch_rows):
+                counted.append(batch.num_rows)
+                yield batch
+
+        ds.write_dataset(batches(), tmp / table, schema=schema, format=FORMATS[file_format],
+                         partitioning=ds.partitioning(pa.schema([("MES", pa.string())]), flavor="hive"),
+                         existing_data_behavior="overwrite_or_ignore")
+        rows += sum(counted)
+    (tmp / VERSION_FILE).write_text(f"{version} {file_format}\n")
+
+    old = output.with_name(f".{output.name}.old.{os.getpid()}")
+    if output.exists():
+        os.replace(output, old)
+    os.replace(tmp, output)
+    shutil.rmtree(old, ignore_errors=True)
+    return rows
+
+
+def store_version(store=STORE):
+    # (data version, format) of the export, None if there is no store
+    try:
+        version, file_format = (Path(store) / VERSION_FILE).read_text().split()
+    except (OSError, ValueError):
+        return None
+    return int(version), file_format
+
+
+def dataset(table, store=STORE):
+    version = store_version(store)
+    if version is None:
+        raise FileNotFoundError(f"No columnar store in {store}, run columnar.py first")
+    # Memory-mapped reads: Arrow IPC columns are used in place, without copying them into the heap
+    filesystem = pafs.LocalFileSystem(use_mmap=True)
+    return ds.dataset(str(Path(store) / table), format=FORMATS[version[1]], filesystem=filesystem,
+                      partitioning=ds.partitioning(pa.schema([("MES", pa.string())]), flavor="hive"))
+
+
+def read_table(table, columns=None, months=None, store=STORE):
+    # Only the requested columns and the partitions of the requested months (e.g. ["2025-03", "2025-04"])
+    # are read, the month filter prunes whole directories
+    month_filter = ds.field("MES").isin(list(months)) if months else None
+    return dataset(table, store).to_table(columns=columns, filter=month_filter)
+
+
+def read_frame(table, columns=None, months=None, store=STORE):
+    # pandas DataFrame without an extra copy of the numeric columns (split_blocks keeps one block per column),
+    # dates as datetime64 instead of Python objects
+    return read_table(table, columns, months, store).to_pandas(split_blocks=True, self_destruct=True,
+                                                                date_as_object=False)
+
+
+def read_tickets(columns=None, months=None, store=STORE):
+    return read_frame("TICKET", columns, months, store)
+
+
+def read_contacts(columns=None, months=None, store=STORE):
+    return read_frame("CONTACTO", columns, months, store)
+
+
+def read_column(table, column, months=None, store=STORE):
+    # Single column as a NumPy array, zero-copy when it has no nulls
+    return read_table(table, [column], months, store).column(column).combine_chunks().to_numpy(
+        zero_copy_only=False)
+
+
+def months(table="TICKET", store=STORE):
+    # Available partitions
+    fragments = dataset(table, store).get_fragments()
+    return sorted({Path(fragment.path).parent.name.split("=", 1)[1] for fragment in fragments})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export TICKET and CONTACTO to a partitioned columnar store")
+    parser.add_argument("database", nargs="?", default="../database/data.db")
+    parser.add_argument("--format", choices=list(FORMATS), default="parquet")
+    parser.add_argument("--output", default=str(STORE))
+    args = parser.parse_args(argv)
+    con = sqlite3.connect(args.database, check_same_thread=False)
+    start = time.perf_counter()
+    try:
+        rows = export(con, args.output, args.format)
+    finally:
+        con.close()
+    print(f"Columnar export: {rows} rows to {args.output} ({args.format}) in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
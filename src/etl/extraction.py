@@ -2,6 +2,13 @@ import json
 
 path = "../data/data_clasified.json"
 
+# Characters read from the file each time the buffer runs out
+CHUNK_SIZE = 1 << 16
+
+decoder = json.JSONDecoder()
+WHITESPACE = " \t\r\n"
+DELIMITERS = ",:]}" + WHITESPACE
+
 
 def read_json():
     file = open(path, "r")
@@ -10,5 +17,82 @@ def read_json():
     return data
 
 
+class StreamReader:
+    # Incremental reader of a JSON text: keeps only the part of the file not parsed yet in memory
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # Next non-whitespace character, without consuming it
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON file")
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at character {self.pos}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Incomplete value: read more unless the file is over
+                if not self.fill():
+                    raise
+                continue
+            # A number cut by the end of the buffer would also parse ("1." -> 1), it is only complete
+            # when followed by a delimiter
+            if end < len(self.buffer) and self.buffer[end] in DELIMITERS or not self.fill():
+                self.pos = end
+                return obj
+
+
+def iter_records(source=path, chunk_size=CHUNK_SIZE):
+    # Yields (array name, record) for every element of the top-level arrays
+    # (tickets_emitidos, clientes, ...) without loading the whole file
+    with open(source, "r", encoding="utf-8") as file:
+        reader = StreamReader(file, chunk_size)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            if reader.peek() == "[":
+                reader.expect("[")
+                if reader.peek() == "]":
+                    reader.expect("]")
+                else:
+                    while True:
+                        yield key, reader.value()
+                        if reader.expect(",]") == "]":
+                            break
+            else:
+                reader.value()
+            if reader.expect(",}") == "}":
+                return
+
+
 if __name__ == "__main__":
     read_json()
@@ -0,0 +1,214 @@
+import hashlib
+import os
+from itertools import groupby
+from operator import itemgetter
+
+import extraction
+from loading import batched, bulk_load, fingerprint, next_ticket_id, ticket_keys, BATCH_SIZE, MAX_VARIABLES
+from transformation import stream_transform
+import summaries
+
+# Entity name of the watermark of the whole file
+FILE = "*"
+
+
+def ensure_schema(cur):
+    # Databases created before the incremental mode do not have the natural key columns
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(TICKET)")}
+    if "CLAVE" not in columns:
+        cur.execute("ALTER TABLE TICKET ADD COLUMN CLAVE VARCHAR(100)")
+    if "HUELLA" not in columns:
+        cur.execute("ALTER TABLE TICKET ADD COLUMN HUELLA VARCHAR(40)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS IDX_TICKET_CLAVE ON TICKET(CLAVE)")
+    # Keys written without the occurrence number (client|date|type, one ticket per key) are the first one
+    sample = cur.execute("SELECT CLAVE FROM TICKET WHERE CLAVE IS NOT NULL LIMIT 1").fetchone()
+    if sample and sample[0].count("|") == 2:
+        cur.execute("UPDATE TICKET SET CLAVE = CLAVE || '|1' WHERE CLAVE IS NOT NULL")
+    # Tickets loaded without a natural key get one, numbered by ID after the keys of their base already
+    # taken. HUELLA stays empty so the next incremental load rewrites them.
+    cur.execute("""
+        CREATE TEMP TABLE CLAVE_NUEVA AS
+        SELECT ID_TICKET, BASE || '|' || (N + COALESCE((
+            SELECT MAX(CAST(substr(T.CLAVE, length(BASE) + 2) AS INT)) FROM TICKET T
+            WHERE T.CLAVE > BASE || '|' AND T.CLAVE < BASE || '}'), 0)) AS CLAVE
+        FROM (SELECT ID_TICKET, CLIENTE_ID || '|' || FECHA_APERTURA || '|' || INCIDENCIA_ID AS BASE,
+                     ROW_NUMBER() OVER (PARTITION BY CLIENTE_ID, FECHA_APERTURA, INCIDENCIA_ID ORDER BY ID_TICKET) AS N
+              FROM TICKET WHERE CLAVE IS NULL)
+        WHERE BASE IS NOT NULL""")
+    cur.execute("UPDATE TICKET SET CLAVE = K.CLAVE FROM temp.CLAVE_NUEVA K WHERE TICKET.ID_TICKET = K.ID_TICKET")
+    cur.execute("DROP TABLE temp.CLAVE_NUEVA")
+    # Contacts of the changed tickets are deleted by TICKET_ID (same definition as schema.sql)
+    cur.execute("CREATE INDEX IF NOT EXISTS IDX_CONTACTO_TICKET ON CONTACTO(TICKET_ID, EMPLEADO_ID, TIEMPO)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ETL_WATERMARK (
+            ORIGEN          TEXT,
+            ENTIDAD         TEXT,
+            HUELLA          VARCHAR(64),
+            REGISTROS       INT,
+            FECHA_MAX       DATE,
+            TAMANO          INT,
+            MTIME           INT,
+            ACTUALIZADO     TIMESTAMP,
+            PRIMARY KEY (ORIGEN, ENTIDAD)
+        )""")
+    # Only the watermark of the whole file is kept, older versions also wrote one per entity
+    cur.execute("DELETE FROM ETL_WATERMARK WHERE ENTIDAD <> ?", (FILE,))
+
+
+def file_hash(source):
+    digest = hashlib.sha256()
+    with open(source, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def upsert_clients(cur, clients):
+    cur.executemany("INSERT INTO CLIENTE (ID_CLIENTE, NOMBRE, TELEFONO, PROVINCIA) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(ID_CLIENTE) DO UPDATE SET NOMBRE = excluded.NOMBRE, TELEFONO = excluded.TELEFONO, "
+                    "PROVINCIA = excluded.PROVINCIA",
+                    [(client["id_cli"], client["nombre"], client["telefono"], client["provincia"])
+                     for client in clients])
+    return len(clients)
+
+
+def upsert_employees(cur, employees):
+    cur.executemany("INSERT INTO EMPLEADO (ID_EMPLEADO, NOMBRE, NIVEL, FECHA_CONTRATO) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(ID_EMPLEADO) DO UPDATE SET NOMBRE = excluded.NOMBRE, NIVEL = excluded.NIVEL, "
+                    "FECHA_CONTRATO = excluded.FECHA_CONTRATO",
+                    [(employee["id_emp"], employee["nombre"], employee["nivel"], employee["fecha_contrato"])
+                     for employee in employees])
+    return len(employees)
+
+
+def upsert_incidents(cur, incidents):
+    cur.executemany("INSERT INTO INCIDENTE (ID_INCIDENTE, NOMBRE) VALUES (?, ?) "
+                    "ON CONFLICT(ID_INCIDENTE) DO UPDATE SET NOMBRE = excluded.NOMBRE",
+                    [(incident["id_inci"], incident["nombre"]) for incident in incidents])
+    return len(incidents)
+
+
+def existing_tickets(cur, keys):
+    # CLAVE -> (ID_TICKET, HUELLA) of the tickets already loaded
+    existing = {}
+    for part in batched(keys, MAX_VARIABLES):
+        placeholders = ", ".join("?" for _ in part)
+        cur.execute(f"SELECT CLAVE, ID_TICKET, HUELLA FROM TICKET WHERE CLAVE IN ({placeholders})", part)
+        existing.update((key, (ident, huella)) for key, ident, huella in cur.fetchall())
+    return existing
+
+
+def upsert_tickets(cur, tickets, next_id, seen):
+    # Inserts the new tickets and rewrites the changed ones, returns (next free ID, new, changed).
+    # The n-th ticket of a client, date and type in the file is the ticket with the key base|n, seen counts
+    # the bases of the previous batches of the file (one entry per base, the only state kept for the file)
+    latest = dict(zip(ticket_keys(tickets, seen), tickets))
+    existing = existing_tickets(cur, list(latest))
+    ticket_rows = []
+    replaced = []
+    new = 0
+    for key, ticket in latest.items():
+        huella = fingerprint(ticket)
+        if key not in existing:
+            ident = next_id
+            next_id += 1
+            new += 1
+        elif existing[key][1] != huella:
+            ident = existing[key][0]
+            replaced.append(ident)
+        else:
+            continue
+        ticket_rows.append((ident, ticket["cliente"], ticket["fecha_apertura"], ticket["fecha_cierre"],
+                            ticket["es_mantenimiento"], ticket["satisfaccion_cliente"], ticket["tipo_incidencia"],
+                            ticket["es_critico"], key, huella, ticket["contactos_con_empleados"]))
+
+    # The summaries lose the old values of the changed tickets and get the new ones once written
+    summaries.adjust_tickets(cur, replaced, -1)
+    cur.executemany("INSERT INTO TICKET (ID_TICKET, CLIENTE_ID, FECHA_APERTURA, FECHA_CIERRE, ES_MANTENIMIENTO, "
+                    "SATISFACCION, INCIDENCIA_ID, ES_CRITICO, CLAVE, HUELLA) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(CLAVE) DO UPDATE SET FECHA_CIERRE = excluded.FECHA_CIERRE, "
+                    "ES_MANTENIMIENTO = excluded.ES_MANTENIMIENTO, SATISFACCION = excluded.SATISFACCION, "
+                    "ES_CRITICO = excluded.ES_CRITICO, HUELLA = excluded.HUELLA",
+                    [row[:-1] for row in ticket_rows])
+    # The contacts of a changed ticket are replaced by the new ones
+    cur.executemany("DELETE FROM CONTACTO WHERE TICKET_ID = ?", [(ident,) for ident in replaced])
+    cur.executemany("INSERT INTO CONTACTO (TICKET_ID, EMPLEADO_ID, FECHA, TIEMPO) VALUES (?, ?, ?, ?)",
+                    [(row[0], contact["id_emp"], contact["fecha"], contact["tiempo"])
+                     for row in ticket_rows for contact in row[-1]])
+    summaries.adjust_tickets(cur, [row[0] for row in ticket_rows], 1)
+    return next_id, new, len(replaced)
+
+
+upserts = {
+    "clientes": upsert_clients,
+    "empleados": upsert_employees,
+    "tipos_incidentes": upsert_incidents,
+}
+
+
+def save_watermark(cur, origin, huella, size, mtime):
+    # One row per source file: the next load skips it while its size, mtime or hash do not change
+    cur.execute("INSERT OR REPLACE INTO ETL_WATERMARK (ORIGEN, ENTIDAD, HUELLA, TAMANO, MTIME, ACTUALIZADO) "
+                "VALUES (?, ?, ?, ?, ?, datetime('now'))", (origin, FILE, huella, size, mtime))
+
+
+def upsert_batch(cur, key, batch, next_id, seen):
+    # Returns (next free ID, new, changed) tickets
+    if key == "tickets_emitidos":
+        return upsert_tickets(cur, batch, next_id, seen)
+    upserts[key](cur, batch)
+    return next_id, 0, 0
+
+
+def upsert_stream(cur, records, batch_size=BATCH_SIZE):
+    # Upserts the (entity, record) pairs, returns (new, changed) tickets
+    new = changed = 0
+    next_id = next_ticket_id(cur)
+    seen = {}
+    for key, group in groupby(records, key=itemgetter(0)):
+        for batch in batched((record for _key, record in group), batch_size):
+            next_id, inserted, updated = upsert_batch(cur, key, batch, next_id, seen)
+            new += inserted
+            changed += updated
+    return new, changed
+
+
+def file_watermark(cur, source):
+    # (absolute path, os.stat, stored (HUELLA, TAMANO, MTIME) of the file or None if it was never loaded)
+    origin = os.path.abspath(source)
+    stat = os.stat(source)
+    row = cur.execute("SELECT HUELLA, TAMANO, MTIME FROM ETL_WATERMARK WHERE ORIGEN = ? AND ENTIDAD = ?",
+                      (origin, FILE)).fetchone()
+    return origin, stat, row
+
+
+def load_incremental(con, source=None, batch_size=BATCH_SIZE):
+    # Loads only new or changed records of the file, returns (new, changed) tickets
+    source = source or extraction.path
+    cur = con.cursor()
+    ensure_schema(cur)
+    con.commit()
+    origin, stat, row = file_watermark(cur, source)
+    # Same size and modification time: the file has not changed since the last load
+    if row and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+        return 0, 0
+    huella = file_hash(source)
+    if row and row[0] == huella:
+        save_watermark(cur, origin, huella, stat.st_size, stat.st_mtime_ns)
+        con.commit()
+        return 0, 0
+
+    def load(cur):
+        result = upsert_stream(cur, stream_transform(source), batch_size)
+        save_watermark(cur, origin, huella, stat.st_size, stat.st_mtime_ns)
+        return result
+
+    # The unique index on CLAVE is needed to find the loaded tickets, indexes are not deferred
+    result, _elapsed = bulk_load(con, load, defer_indexes=False)
+    return result
+
+
+if __name__ == "__main__":
+    from loading import loading_data
+
+    loading_data(incremental=True)
@@ -1,50 +1,292 @@
+import hashlib
+import json
 import sqlite3
-from transformation import transform_data
+import sys
+import time
+from itertools import groupby, islice
+from operator import itemgetter
+from pathlib import Path
+from transformation import stream_transform
+import summaries
 
 database = "../database/data.db"
 
+# Tickets inserted per executemany call
+BATCH_SIZE = 50000
+# SQLite limits the number of "?" in a statement
+MAX_VARIABLES = 500
 
-def insert_data(data, cur):
-    # Insertion of clients
-    for client in data["clientes"]:
-        cur.execute("INSERT OR IGNORE INTO CLIENTE (ID_CLIENTE, NOMBRE, TELEFONO, PROVINCIA) VALUES (?, ?, ?, ?)",
-                    (client["id_cli"], client["nombre"], client["telefono"], client["provincia"]))
 
-    # Employees
-    for employee in data["empleados"]:
-        cur.execute("INSERT OR IGNORE INTO EMPLEADO (ID_EMPLEADO, NOMBRE, NIVEL, FECHA_CONTRATO) VALUES (?, ?, ?, ?)",
-                    (employee["id_emp"], employee["nombre"], employee["nivel"], employee["fecha_contrato"]))
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
-    # Types of incidents
-    for incident in data["tipos_incidentes"]:
-        cur.execute("INSERT OR IGNORE INTO INCIDENTE (ID_INCIDENTE, NOMBRE) VALUES (?, ?)",
-                    (incident["id_inci"], incident["nombre"]))
 
-    # Tickets
-    for ticket in data["tickets_emitidos"]:
-        cur.execute("INSERT OR IGNORE INTO TICKET (CLIENTE_ID, FECHA_APERTURA, FECHA_CIERRE, ES_MANTENIMIENTO, "
-                    "SATISFACCION, INCIDENCIA_ID, ES_CRITICO) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (ticket["cliente"], ticket["fecha_apertura"], ticket["fecha_cierre"], ticket["es_mantenimiento"], ticket["satisfaccion_cliente"], ticket["tipo_incidencia"], ticket["es_critico"]))
+def set_load_pragmas(cur):
+    # WAL + synchronous NORMAL: no fsync per transaction, the database is still consistent after a crash
+    cur.execute("PRAGMA journal_mode = WAL")
+    cur.execute("PRAGMA synchronous = NORMAL")
+    cur.execute("PRAGMA temp_store = MEMORY")
+    cur.execute("PRAGMA cache_size = -262144")  # 256 MB
 
-        # ident -> identifier of the ticket inserted
-        ident = cur.lastrowid
 
-        # Contacts with employees
-        for contact in ticket["contactos_con_empleados"]:
-            cur.execute("INSERT OR IGNORE INTO CONTACTO (TICKET_ID, EMPLEADO_ID, FECHA, TIEMPO) VALUES (?, ?, ?, ?)",
-                        (ident, contact["id_emp"], contact["fecha"], contact["tiempo"]))
+def drop_indexes(cur, tables=("TICKET", "CONTACTO")):
+    # The secondary indexes are built once after the load instead of being updated on every insert.
+    # Unique indexes stay: IDX_TICKET_CLAVE numbers the natural keys while the tickets are inserted.
+    # The dropped indexes are recorded in ETL_INDICES until create_indexes builds them again: a load that
+    # commits with the indexes dropped (pipeline.py) and is killed leaves them to the next load
+    placeholders = ", ".join("?" for _ in tables)
+    indexes = cur.execute(f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                          f"AND sql NOT LIKE 'CREATE UNIQUE INDEX%' AND tbl_name IN ({placeholders})",
+                          tables).fetchall()
+    for name, _sql in indexes:
+        cur.execute(f'DROP INDEX "{name}"')
+    cur.execute("CREATE TABLE IF NOT EXISTS ETL_INDICES (NOMBRE TEXT PRIMARY KEY, SQL TEXT)")
+    cur.executemany("INSERT OR REPLACE INTO ETL_INDICES (NOMBRE, SQL) VALUES (?, ?)", indexes)
+    # Also the ones left dropped by a load that did not finish, built with the others
+    return cur.execute("SELECT NOMBRE, SQL FROM ETL_INDICES").fetchall()
 
 
-def loading_data():
-    data_transformed = transform_data()
-    con = sqlite3.connect(database)
+def create_indexes(cur, indexes):
+    # (name, sql) pairs returned by drop_indexes, an index created meanwhile (migrate.py) is kept
+    for name, sql in indexes:
+        if not cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone():
+            cur.execute(sql)
+        cur.execute("DELETE FROM ETL_INDICES WHERE NOMBRE = ?", (name,))
+
+
+def restore_indexes(cur):
+    # Loads that keep the indexes: the ones left dropped by a load that did not finish
+    cur.execute("CREATE TABLE IF NOT EXISTS ETL_INDICES (NOMBRE TEXT PRIMARY KEY, SQL TEXT)")
+    create_indexes(cur, cur.execute("SELECT NOMBRE, SQL FROM ETL_INDICES").fetchall())
+
+
+def bump_data_version(cur):
+    # Tells the web app (result caches, reports) that the data changed, in the same transaction as the data
+    cur.execute("CREATE TABLE IF NOT EXISTS VERSION_DATOS (ID INTEGER PRIMARY KEY CHECK (ID = 1), VERSION INT)")
+    cur.execute("INSERT INTO VERSION_DATOS (ID, VERSION) VALUES (1, 1) "
+                "ON CONFLICT(ID) DO UPDATE SET VERSION = VERSION + 1")
+
+
+def next_ticket_id(cur):
+    # IDs are assigned here so the contacts of a batch can be inserted without lastrowid
+    cur.execute("SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'TICKET'), 0), "
+                "COALESCE((SELECT MAX(ID_TICKET) FROM TICKET), 0))")
+    return cur.fetchone()[0] + 1
+
+
+def insert_clients(cur, clients):
+    cur.executemany("INSERT OR IGNORE INTO CLIENTE (ID_CLIENTE, NOMBRE, TELEFONO, PROVINCIA) VALUES (?, ?, ?, ?)",
+                    [(client["id_cli"], client["nombre"], client["telefono"], client["provincia"])
+                     for client in clients])
+    return len(clients)
+
+
+def insert_employees(cur, employees):
+    cur.executemany("INSERT OR IGNORE INTO EMPLEADO (ID_EMPLEADO, NOMBRE, NIVEL, FECHA_CONTRATO) VALUES (?, ?, ?, ?)",
+                    [(employee["id_emp"], employee["nombre"], employee["nivel"], employee["fecha_contrato"])
+                     for employee in employees])
+    return len(employees)
+
+
+def insert_incidents(cur, incidents):
+    cur.executemany("INSERT OR IGNORE INTO INCIDENTE (ID_INCIDENTE, NOMBRE) VALUES (?, ?)",
+                    [(incident["id_inci"], incident["nombre"]) for incident in incidents])
+    return len(incidents)
+
+
+def fingerprint(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def ticket_base(ticket):
+    # Client, opening date and type of incident: a client can open several tickets of the same type in a day
+    return f"{ticket['cliente']}|{ticket['fecha_apertura']}|{ticket['tipo_incidencia']}"
+
+
+def ticket_keys(tickets, seen):
+    # Natural keys of a batch: base|n for the n-th ticket of the base, seen holds the count of every base
+    # in the previous batches of the source (or the occurrences already loaded)
+    keys = []
+    for ticket in tickets:
+        base = ticket_base(ticket)
+        seen[base] = seen.get(base, 0) + 1
+        keys.append(f"{base}|{seen[base]}")
+    return keys
+
+
+def taken_keys(cur, keys):
+    # Keys of the list already in TICKET
+    taken = set()
+    for part in batched(keys, MAX_VARIABLES):
+        placeholders = ", ".join("?" for _ in part)
+        taken.update(key for (key,) in cur.execute(f"SELECT CLAVE FROM TICKET WHERE CLAVE IN ({placeholders})",
+                                                   part))
+    return taken
+
+
+def last_occurrence(cur, base):
+    # Highest n of the keys base|n loaded (range of the unique index, '}' follows '|')
+    return max((int(key.rsplit("|", 1)[1]) for (key,) in
+                cur.execute("SELECT CLAVE FROM TICKET WHERE CLAVE > ? AND CLAVE < ?", (base + "|", base + "}"))),
+               default=0)
+
+
+def insert_tickets(cur, tickets, first_id):
+    # Inserts a batch of tickets and their contacts, returns (next free ID, rows inserted).
+    # Full loads are append-only: every ticket is inserted, numbered after the tickets of its base already
+    # loaded (the same file loaded twice is loaded twice). Only the bases with a key taken are looked up,
+    # memory does not grow with the tickets loaded
+    keys = ticket_keys(tickets, {})
+    taken = taken_keys(cur, keys)
+    if taken:
+        seen = {base: last_occurrence(cur, base) for base in {key.rsplit("|", 1)[0] for key in taken}}
+        keys = [key if key.rsplit("|", 1)[0] not in seen else None for key in keys]
+        renumbered = iter(ticket_keys([ticket for ticket, key in zip(tickets, keys) if key is None], seen))
+        keys = [key or next(renumbered) for key in keys]
+
+    ticket_rows = []
+    for ident, (key, ticket) in enumerate(zip(keys, tickets), first_id):
+        ticket_rows.append((ident, ticket["cliente"], ticket["fecha_apertura"], ticket["fecha_cierre"],
+                            ticket["es_mantenimiento"], ticket["satisfaccion_cliente"], ticket["tipo_incidencia"],
+                            ticket["es_critico"], key, fingerprint(ticket)))
+    last_id = first_id + len(ticket_rows) - 1
+
+    last_contact = summaries.last_contact_id(cur)
+    cur.executemany("INSERT INTO TICKET (ID_TICKET, CLIENTE_ID, FECHA_APERTURA, FECHA_CIERRE, "
+                    "ES_MANTENIMIENTO, SATISFACCION, INCIDENCIA_ID, ES_CRITICO, CLAVE, HUELLA) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", ticket_rows)
+    # Contacts with employees (ticket IDs assigned above, no lastrowid)
+    contact_rows = [(ident, contact["id_emp"], contact["fecha"], contact["tiempo"])
+                    for ident, ticket in enumerate(tickets, first_id)
+                    for contact in ticket["contactos_con_empleados"]]
+    cur.executemany("INSERT OR IGNORE INTO CONTACTO (TICKET_ID, EMPLEADO_ID, FECHA, TIEMPO) VALUES (?, ?, ?, ?)",
+                    contact_rows)
+    summaries.add_range(cur, first_id, last_id, last_contact)
+    return last_id + 1, len(ticket_rows) + len(contact_rows)
+
+
+def delete_tickets(cur, first_id, last_id):
+    # Undoes insert_tickets for a range of IDs (a source file that failed halfway), summaries included
+    summaries.apply(cur, "ID_TICKET BETWEEN :first AND :last", "C.TICKET_ID BETWEEN :first AND :last",
+                    {"first": first_id, "last": last_id}, sign=-1)
+    cur.execute("DELETE FROM CONTACTO WHERE TICKET_ID BETWEEN ? AND ?", (first_id, last_id))
+    cur.execute("DELETE FROM TICKET WHERE ID_TICKET BETWEEN ? AND ?", (first_id, last_id))
+
+
+def insert_data(data, cur, batch_size=BATCH_SIZE):
+    # Returns the number of rows inserted
+    rows = insert_clients(cur, data["clientes"])
+    rows += insert_employees(cur, data["empleados"])
+    rows += insert_incidents(cur, data["tipos_incidentes"])
+
+    next_id = next_ticket_id(cur)
+    for batch in batched(data["tickets_emitidos"], batch_size):
+        next_id, inserted = insert_tickets(cur, batch, next_id)
+        rows += inserted
+    return rows
+
+
+inserters = {
+    "clientes": insert_clients,
+    "empleados": insert_employees,
+    "tipos_incidentes": insert_incidents,
+}
+
+
+def insert_stream(cur, records, batch_size=BATCH_SIZE):
+    # Inserts (entity, record) pairs as they arrive, batch_size records at a time
+    rows = 0
+    next_id = next_ticket_id(cur)
+    for key, group in groupby(records, key=itemgetter(0)):
+        for batch in batched((record for _key, record in group), batch_size):
+            if key == "tickets_emitidos":
+                next_id, inserted = insert_tickets(cur, batch, next_id)
+            else:
+                inserted = inserters[key](cur, batch)
+            rows += inserted
+    return rows
+
+
+def bulk_load(con, load, defer_indexes=True):
+    # Runs load(cur) in a single transaction with the load pragmas, returns (rows, seconds)
+    con.isolation_level = None
     cur = con.cursor()
+    set_load_pragmas(cur)
+    start = time.perf_counter()
+    cur.execute("BEGIN")
+    try:
+        # Natural key columns of older databases, and keys of the tickets loaded without them
+        from incremental import ensure_schema
+        ensure_schema(cur)
+        if summaries.ensure_tables(cur):
+            summaries.rebuild(cur)
+        if defer_indexes:
+            indexes = drop_indexes(cur)
+        else:
+            restore_indexes(cur)
+            indexes = []
+        rows = load(cur)
+        create_indexes(cur, indexes)
+        bump_data_version(cur)
+        cur.execute("COMMIT")
+    except BaseException:
+        cur.execute("ROLLBACK")
+        raise
+    return rows, time.perf_counter() - start
+
+
+def export_columnar(con, file_format):
+    # Optional output stage: columnar copy of TICKET and CONTACTO (needs pyarrow, see columnar.py)
+    from columnar import export, STORE
+    start = time.perf_counter()
+    rows = export(con, STORE, file_format)
+    print(f"Columnar export: {rows} rows ({file_format}) in {time.perf_counter() - start:.2f} s")
+
+
+def update_online_models(con):
+    # Optional stage: the incremental models learn only the tickets of this load (see staticWeb/online.py)
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+    from src.staticWeb import online
+    for name, entry in online.update_all(con).items():
+        if entry is not None:
+            print(f"Online model {name}: snapshot {entry['sequence']}, {entry['seen']} tickets learned")
+
+
+def loading_data(source=None, batch_size=BATCH_SIZE, incremental=False, columnar=None, online=False):
+    # Extract -> transform -> load in a single pass, memory does not depend on the size of the file.
+    # The connection is also read by the columnar export from a pyarrow thread
+    con = sqlite3.connect(database, check_same_thread=False)
+    try:
+        if incremental:
+            # Only new or changed records, see incremental.py
+            from incremental import load_incremental
+            start = time.perf_counter()
+            new, changed = load_incremental(con, source, batch_size)
+            print(f"Incremental load: {new} new and {changed} changed tickets "
+                  f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        else:
+            rows, elapsed = bulk_load(con, lambda cur: insert_stream(cur, stream_transform(source), batch_size))
+            print(f"Data loaded: {rows} rows in {elapsed:.2f} s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+        if columnar:
+            export_columnar(con, columnar)
+        if online:
+            update_online_models(con)
+    finally:
+        con.close()
+
 
-    insert_data(data_transformed, cur)
-    print("Data loaded")
-    con.commit()
-    con.close()
+def columnar_format(argv):
+    # --columnar (parquet) or --columnar=arrow
+    for arg in argv:
+        if arg == "--columnar":
+            return "parquet"
+        if arg.startswith("--columnar="):
+            return arg.split("=", 1)[1]
+    return None
 
 
 if __name__ == "__main__":
-    loading_data()
+    loading_data(incremental="--incremental" in sys.argv, columnar=columnar_format(sys.argv),
+                 online="--online" in sys.argv)
@@ -0,0 +1,275 @@
+# Parallel ETL of many source files: a process pool extracts and transforms the files and a single
+# writer (this process) loads the batches into SQLite, so there is only one connection writing.
+#   python pipeline.py ../data                       every *.json of the directory
+#   python pipeline.py "dumps/2025-*.json" -w 8 --incremental
+import argparse
+import concurrent.futures
+import glob
+import multiprocessing
+import os
+import queue
+import sqlite3
+import sys
+import time
+from itertools import groupby
+from operator import itemgetter
+
+import incremental
+import loading
+import summaries
+from transformation import stream_transform
+
+# Batches waiting for the writer, per worker (bounds the memory used by the queue)
+QUEUE_PER_WORKER = 4
+PROGRESS_EVERY = 2.0
+
+_queue = None
+
+
+def source_files(patterns):
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.extend(sorted(glob.glob(os.path.join(pattern, "*.json"))))
+        else:
+            files.extend(sorted(glob.glob(pattern)))
+    # Same file given twice
+    return list(dict.fromkeys(os.path.abspath(file) for file in files))
+
+
+def init_worker(batches):
+    global _queue
+    _queue = batches
+
+
+def extract_file(task):
+    # Worker: sends (source, entity, batch) to the writer and, at the end, (source, None, summary)
+    source, batch_size, stored_hash = task
+    summary = {"records": 0, "error": None, "unchanged": False}
+    try:
+        if stored_hash is not None:
+            summary["huella"] = incremental.file_hash(source)
+            if summary["huella"] == stored_hash:
+                summary["unchanged"] = True
+                return
+        for key, group in groupby(stream_transform(source), key=itemgetter(0)):
+            for batch in loading.batched((record for _key, record in group), batch_size):
+                _queue.put((source, key, batch))
+                summary["records"] += len(batch)
+    except Exception as e:
+        summary["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        _queue.put((source, None, summary))
+
+
+class Writer:
+    # Loads the batches of every file in its own transaction with the same connection
+
+    def __init__(self, con, incremental_mode):
+        self.con = con
+        self.incremental = incremental_mode
+        con.isolation_level = None
+        self.cur = con.cursor()
+        loading.set_load_pragmas(self.cur)
+        self.cur.execute("BEGIN")
+        try:
+            # Natural key columns (CLAVE, HUELLA) and their unique index, written by both modes
+            incremental.ensure_schema(self.cur)
+            if summaries.ensure_tables(self.cur):
+                summaries.rebuild(self.cur)
+            if incremental_mode:
+                loading.restore_indexes(self.cur)
+                self.indexes = []
+            else:
+                # The indexes are rebuilt once all the files are loaded (or by the next load if this one dies)
+                self.indexes = loading.drop_indexes(self.cur)
+            self.next_id = loading.next_ticket_id(self.cur)
+            self.cur.execute("COMMIT")
+        except BaseException:
+            self.cur.execute("ROLLBACK")
+            raise
+        self.rows = 0
+        self.new = self.changed = 0
+        # Full loads: ticket ID ranges committed for every file still being loaded
+        self.ranges = {}
+        # Incremental loads: tickets per natural key base seen in every file still being loaded (the batches
+        # of a file arrive in order, from a single worker)
+        self.seen = {}
+
+    def write(self, source, key, batch):
+        self.cur.execute("BEGIN")
+        try:
+            if self.incremental:
+                self.next_id, new, changed = incremental.upsert_batch(self.cur, key, batch, self.next_id,
+                                                                      self.seen.setdefault(source, {}))
+                self.new += new
+                self.changed += changed
+            elif key == "tickets_emitidos":
+                first_id = self.next_id
+                self.next_id, _rows = loading.insert_tickets(self.cur, batch, self.next_id)
+                self.ranges.setdefault(source, []).append((first_id, self.next_id - 1, len(batch)))
+            else:
+                loading.inserters[key](self.cur, batch)
+            loading.bump_data_version(self.cur)
+            self.cur.execute("COMMIT")
+        except BaseException:
+            self.cur.execute("ROLLBACK")
+            raise
+        self.rows += len(batch)
+
+    def discard_file(self, source):
+        # A file that failed halfway: the tickets (and contacts) of its committed batches are deleted so a
+        # full load never keeps part of a file. Clients, employees and incident types stay, they are shared
+        # by the files (INSERT OR IGNORE). Incremental loads keep the upserts and do not save the watermark,
+        # so the next run loads the file again
+        self.seen.pop(source, None)
+        ranges = self.ranges.pop(source, [])
+        if not ranges:
+            return
+        self.cur.execute("BEGIN")
+        try:
+            for first_id, last_id, _records in ranges:
+                loading.delete_tickets(self.cur, first_id, last_id)
+            loading.bump_data_version(self.cur)
+            self.cur.execute("COMMIT")
+        except BaseException:
+            self.cur.execute("ROLLBACK")
+            raise
+        self.rows -= sum(records for _first_id, _last_id, records in ranges)
+
+    def finish_file(self, source, summary):
+        self.ranges.pop(source, None)
+        self.seen.pop(source, None)
+        if not self.incremental or summary["error"]:
+            return
+        stat = os.stat(source)
+        self.cur.execute("BEGIN")
+        incremental.save_watermark(self.cur, source, summary["huella"], stat.st_size, stat.st_mtime_ns)
+        self.cur.execute("COMMIT")
+
+    def close(self):
+        self.cur.execute("BEGIN")
+        loading.create_indexes(self.cur, self.indexes)
+        self.cur.execute("COMMIT")
+        self.con.close()
+
+
+def pending_files(cur, files):
+    # Incremental mode: (file, stored hash) of the files that may have changed since the last load
+    pending = []
+    for source in files:
+        _origin, stat, row = incremental.file_watermark(cur, source)
+        if row and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+            continue
+        # Files never loaded get an empty hash so the worker computes it for the watermark
+        pending.append((source, row[0] if row else ""))
+    return pending
+
+
+def run(files, database, workers, batch_size, incremental_mode=False, progress=sys.stderr):
+    con = sqlite3.connect(database)
+    writer = Writer(con, incremental_mode)
+    if incremental_mode:
+        tasks = [(source, batch_size, stored) for source, stored in pending_files(writer.cur, files)]
+    else:
+        tasks = [(source, batch_size, None) for source in files]
+    skipped = len(files) - len(tasks)
+    errors = {}
+    start = last_report = time.perf_counter()
+
+    context = multiprocessing.get_context()
+    batches = context.Queue(maxsize=max(1, workers) * QUEUE_PER_WORKER)
+    # Files whose summary was received (or whose worker died), later batches of them are ignored
+    finished = set()
+    try:
+        pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker,
+                                                      initargs=(batches,))
+        try:
+            futures = {pool.submit(extract_file, task): task[0] for task in tasks}
+            while len(finished) < len(tasks):
+                try:
+                    source, key, payload = batches.get(timeout=PROGRESS_EVERY)
+                except queue.Empty:
+                    # extract_file always sends a summary: a failed future is a worker that died (killed, out
+                    # of memory) or a broken pool, its file will never be completed
+                    for future, source in futures.items():
+                        if source not in finished and future.done() and future.exception() is not None:
+                            finished.add(source)
+                            errors[source] = f"worker failed: {future.exception()!r}"
+                            writer.discard_file(source)
+                else:
+                    if source in finished:
+                        # Left in the queue by a worker that died, the file is already discarded
+                        continue
+                    if key is None:
+                        finished.add(source)
+                        if payload["error"]:
+                            errors[source] = payload["error"]
+                            writer.discard_file(source)
+                        else:
+                            skipped += payload["unchanged"]
+                            writer.finish_file(source, payload)
+                    else:
+                        writer.write(source, key, payload)
+                now = time.perf_counter()
+                if progress and now - last_report >= PROGRESS_EVERY:
+                    last_report = now
+                    print(f"[{len(finished)}/{len(tasks)} files] {writer.rows:,} records, "
+                          f"{writer.rows / (now - start):,.0f} records/s", file=progress)
+        except BaseException:
+            # The writer failed: workers blocked on the full queue would never exit, they are stopped and the
+            # files not finished are discarded
+            pool.shutdown(wait=False, cancel_futures=True)
+            for process in multiprocessing.active_children():
+                process.terminate()
+            for source in list(writer.ranges):
+                try:
+                    writer.discard_file(source)
+                except sqlite3.Error as e:
+                    print(f"ERROR {source}: partial load not discarded ({e})", file=sys.stderr)
+            raise
+        pool.shutdown()
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    if progress:
+        print(f"{len(files)} files ({skipped} unchanged), {writer.rows:,} records in {elapsed:.2f} s "
+              f"({writer.rows / max(elapsed, 1e-9):,.0f} records/s)", file=progress)
+        if incremental_mode:
+            print(f"{writer.new} new and {writer.changed} changed tickets", file=progress)
+        for source, error in errors.items():
+            print(f"ERROR {source}: {error}", file=progress)
+    return writer.rows, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel ETL of JSON ticket dumps into SQLite")
+    parser.add_argument("sources", nargs="+", help="source files, directories or glob patterns")
+    parser.add_argument("-d", "--database", default=loading.database)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-b", "--batch-size", type=int, default=loading.BATCH_SIZE)
+    parser.add_argument("--incremental", action="store_true", help="load only new or changed records")
+    parser.add_argument("--columnar", nargs="?", const="parquet", choices=["parquet", "arrow"],
+                        help="also export TICKET and CONTACTO to the columnar store (columnar.py)")
+    parser.add_argument("--online", action="store_true", help="update the incremental models with the new tickets")
+    args = parser.parse_args(argv)
+
+    files = source_files(args.sources)
+    if not files:
+        parser.error("no source files found")
+    _rows, errors = run(files, args.database, args.workers, args.batch_size, args.incremental)
+    if args.columnar or args.online:
+        con = sqlite3.connect(args.database)
+        try:
+            if args.columnar:
+                loading.export_columnar(con, args.columnar)
+            if args.online:
+                loading.update_online_models(con)
+        finally:
+            con.close()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
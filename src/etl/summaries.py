@@ -0,0 +1,124 @@
+# Summary tables of the dashboards (RESUMEN_CLIENTE, RESUMEN_INCIDENTE, RESUMEN_EMPLEADO).
+# The loaders add the contribution of every batch of tickets (and subtract it before a ticket changes),
+# so the dashboards read one row per client, incident type or employee instead of scanning TICKET.
+import sqlite3
+
+TABLES = """
+    CREATE TABLE IF NOT EXISTS RESUMEN_CLIENTE (
+        CLIENTE_ID          INT PRIMARY KEY,
+        NUM_TICKETS         INT DEFAULT 0,
+        NUM_TIEMPO          INT DEFAULT 0,
+        TIEMPO_TOTAL        FLOAT DEFAULT 0,
+        NUM_SATISFACCION    INT DEFAULT 0,
+        SATISFACCION_TOTAL  FLOAT DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS IDX_RESUMEN_CLIENTE_TICKETS ON RESUMEN_CLIENTE(NUM_TICKETS);
+    CREATE TABLE IF NOT EXISTS RESUMEN_INCIDENTE (
+        INCIDENCIA_ID       INT PRIMARY KEY,
+        NUM_TICKETS         INT DEFAULT 0,
+        NUM_TIEMPO          INT DEFAULT 0,
+        TIEMPO_TOTAL        FLOAT DEFAULT 0,
+        NUM_SATISFACCION    INT DEFAULT 0,
+        SATISFACCION_TOTAL  FLOAT DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS RESUMEN_EMPLEADO (
+        EMPLEADO_ID         INT PRIMARY KEY,
+        NUM_CONTACTOS       INT DEFAULT 0,
+        TIEMPO_TOTAL        FLOAT DEFAULT 0,
+        NUM_SATISFACCION    INT DEFAULT 0,
+        SATISFACCION_TOTAL  FLOAT DEFAULT 0
+    );
+"""
+
+# Resolution time in days, NULL when a date is missing (not counted in NUM_TIEMPO, like AVG ignores it)
+TICKET_DELTA = """
+    INSERT INTO {table} ({key}, NUM_TICKETS, NUM_TIEMPO, TIEMPO_TOTAL, NUM_SATISFACCION, SATISFACCION_TOTAL)
+    SELECT {column}, :sign * COUNT(*), :sign * COUNT(DURACION), :sign * TOTAL(DURACION),
+           :sign * COUNT(SATISFACCION), :sign * TOTAL(SATISFACCION)
+    FROM (SELECT {column}, SATISFACCION, julianday(FECHA_CIERRE) - julianday(FECHA_APERTURA) AS DURACION
+          FROM TICKET WHERE {where})
+    GROUP BY {column}
+    ON CONFLICT({key}) DO UPDATE SET
+        NUM_TICKETS = NUM_TICKETS + excluded.NUM_TICKETS,
+        NUM_TIEMPO = NUM_TIEMPO + excluded.NUM_TIEMPO,
+        TIEMPO_TOTAL = TIEMPO_TOTAL + excluded.TIEMPO_TOTAL,
+        NUM_SATISFACCION = NUM_SATISFACCION + excluded.NUM_SATISFACCION,
+        SATISFACCION_TOTAL = SATISFACCION_TOTAL + excluded.SATISFACCION_TOTAL
+"""
+
+CONTACT_DELTA = """
+    INSERT INTO RESUMEN_EMPLEADO (EMPLEADO_ID, NUM_CONTACTOS, TIEMPO_TOTAL, NUM_SATISFACCION, SATISFACCION_TOTAL)
+    SELECT C.EMPLEADO_ID, :sign * COUNT(*), :sign * TOTAL(C.TIEMPO),
+           :sign * COUNT(T.SATISFACCION), :sign * TOTAL(T.SATISFACCION)
+    FROM CONTACTO C
+    LEFT JOIN TICKET T ON T.ID_TICKET = C.TICKET_ID
+    WHERE {where}
+    GROUP BY C.EMPLEADO_ID
+    ON CONFLICT(EMPLEADO_ID) DO UPDATE SET
+        NUM_CONTACTOS = NUM_CONTACTOS + excluded.NUM_CONTACTOS,
+        TIEMPO_TOTAL = TIEMPO_TOTAL + excluded.TIEMPO_TOTAL,
+        NUM_SATISFACCION = NUM_SATISFACCION + excluded.NUM_SATISFACCION,
+        SATISFACCION_TOTAL = SATISFACCION_TOTAL + excluded.SATISFACCION_TOTAL
+"""
+
+ticket_summaries = (
+    ("RESUMEN_CLIENTE", "CLIENTE_ID", "CLIENTE_ID"),
+    ("RESUMEN_INCIDENTE", "INCIDENCIA_ID", "INCIDENCIA_ID"),
+)
+
+
+def ensure_tables(cur):
+    # Returns True if the tables did not exist: the tickets already loaded have to be added with rebuild()
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'RESUMEN_CLIENTE'").fetchone()
+    for statement in TABLES.split(";"):
+        if statement.strip():
+            cur.execute(statement)
+    return exists is None
+
+
+def apply(cur, ticket_where, contact_where, params, sign=1):
+    params = dict(params, sign=sign)
+    for table, key, column in ticket_summaries:
+        cur.execute(TICKET_DELTA.format(table=table, key=key, column=column, where=ticket_where), params)
+    cur.execute(CONTACT_DELTA.format(where=contact_where), params)
+
+
+def add_range(cur, first_ticket, last_ticket, last_contact):
+    # Bulk loads: the batch is a range of new ticket IDs and the contacts inserted after last_contact.
+    # Both filters are rowid ranges, they do not need the secondary indexes (dropped during the load).
+    apply(cur, "ID_TICKET BETWEEN :first AND :last", "C.ID_CONTACTO > :contact",
+          {"first": first_ticket, "last": last_ticket, "contact": last_contact})
+
+
+def adjust_tickets(cur, ticket_ids, sign):
+    # Incremental loads: adds (sign=1) or subtracts (sign=-1) the current rows of the given tickets
+    if not ticket_ids:
+        return
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS RESUMEN_IDS (ID INTEGER PRIMARY KEY)")
+    cur.execute("DELETE FROM temp.RESUMEN_IDS")
+    cur.executemany("INSERT OR IGNORE INTO temp.RESUMEN_IDS (ID) VALUES (?)", [(ident,) for ident in ticket_ids])
+    apply(cur, "ID_TICKET IN (SELECT ID FROM temp.RESUMEN_IDS)", "C.TICKET_ID IN (SELECT ID FROM temp.RESUMEN_IDS)",
+          {}, sign)
+
+
+def last_contact_id(cur):
+    return cur.execute("SELECT COALESCE(MAX(ID_CONTACTO), 0) FROM CONTACTO").fetchone()[0]
+
+
+def rebuild(cur):
+    # Recomputes the summaries from all the tickets (existing databases, or to remove accumulated rounding)
+    ensure_tables(cur)
+    for table in ("RESUMEN_CLIENTE", "RESUMEN_INCIDENTE", "RESUMEN_EMPLEADO"):
+        cur.execute(f"DELETE FROM {table}")
+    apply(cur, "1", "1", {})
+
+
+if __name__ == "__main__":
+    from loading import database, bump_data_version
+
+    con = sqlite3.connect(database)
+    rebuild(con.cursor())
+    bump_data_version(con.cursor())
+    con.commit()
+    con.close()
+    print("Summary tables rebuilt")
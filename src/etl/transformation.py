@@ -1,36 +1,60 @@
-from extraction import read_json
+from extraction import read_json, iter_records
+
+
+# Transforming data of clients (remove spaces, adjusting values, ...)
+def transform_client(client):
+    client["nombre"] = client["nombre"].strip()
+    client["telefono"] = client.get("telefono", "None")
+    client["provincia"] = client.get("provincia", "None")
+    return client
+
+
+def transform_employee(employee):
+    employee["nombre"] = employee["nombre"].strip()
+    employee["nivel"] = employee.get("nivel", 0)
+    # employee["fecha_contrato"] = employee.get("fecha_contrato", "None")
+    return employee
+
+
+def transform_ticket(ticket):
+    ticket["fecha_apertura"] = ticket.get("fecha_apertura", "None")
+    ticket["fecha_cierre"] = ticket.get("fecha_cierre", "None")
+    ticket["satisfaccion_cliente"] = ticket.get("satisfaccion_cliente", 1)
+    ticket["es_mantenimiento"] = int(ticket["es_mantenimiento"])
+    ticket["es_critico"] = int(ticket["es_critico"])
+    return ticket
+
+
+def transform_incident(incident):
+    incident["nombre"] = incident["nombre"].strip()
+    return incident
+
+
+transformations = {
+    "clientes": transform_client,
+    "empleados": transform_employee,
+    "tickets_emitidos": transform_ticket,
+    "tipos_incidentes": transform_incident,
+}
 
 
 def transform_data():
     data = read_json()
-    # Transforming data of clients (remove spaces, adjusting values, ...)
-    for client in data["clientes"]:
-        client["nombre"] = client["nombre"].strip()
-        client["telefono"] = client.get("telefono", "None")
-        client["provincia"] = client.get("provincia", "None")
-
-    # Employee
-    for employee in data["empleados"]:
-        employee["nombre"] = employee["nombre"].strip()
-        employee["nivel"] = employee.get("nivel", 0)
-        # employee["fecha_contrato"] = employee.get("fecha_contrato", "None")
-
-    # Ticket
-    for ticket in data["tickets_emitidos"]:
-
-        ticket["fecha_apertura"] = ticket.get("fecha_apertura", "None")
-        ticket["fecha_cierre"] = ticket.get("fecha_cierre", "None")
-        ticket["satisfaccion_cliente"] = ticket.get("satisfaccion_cliente", 1)
-        ticket["es_mantenimiento"] = int(ticket["es_mantenimiento"])
-        ticket["es_critico"] = int(ticket["es_critico"])
-
-    # Incident
-    for incident in data["tipos_incidentes"]:
-        incident["nombre"] = incident["nombre"].strip()
-
+    for key, transform in transformations.items():
+        for record in data[key]:
+            transform(record)
     return data
 
 
+def stream_transform(source=None):
+    # Transforms every record as it is read from the file, unknown arrays are skipped
+    records = iter_records(source) if source else iter_records()
+    for key, record in records:
+        transform = transformations.get(key)
+        if transform is not None:
+            yield key, transform(record)
+
+
 if __name__ == "__main__":
     clean_data = transform_data()
     print(clean_data)
@@ -1,5 +1,12 @@
+from src.staticWeb import cve, metrics, streaming
 from src.staticWeb.web import app
 
 if __name__ == '__main__':
     # Database is already created and data loaded correctly
+    # CVE feed refreshed in the background (see cve.py)
+    cve.start_refresher()
+    # Live rankings checkpointed to SQLite in the background (see streaming.py)
+    streaming.start_checkpointer()
+    if metrics.PROFILE_SAMPLING:
+        metrics.start_profiler()
     app.run()
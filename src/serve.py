@@ -0,0 +1,177 @@
+# Production entry point: gunicorn with several worker processes and threads.
+# The app and its state (libraries, trained models, dashboard results) are loaded once in the master
+# before forking, so the workers share them through copy-on-write instead of loading them each.
+# When the data (VERSION_DATOS) or the training file change, the master refreshes the state and
+# replaces the workers gracefully (SIGHUP); in-flight requests finish on the old workers.
+# Usage (from the repository root):
+#   python -m src.serve [--bind 127.0.0.1:8000] [--workers 4] [--threads 4]
+#   gunicorn -c python:src.serve src.serve:app
+# Every option can also be set with WEB_BIND, WEB_WORKERS, WEB_THREADS, WEB_TIMEOUT and WEB_RELOAD_INTERVAL.
+import argparse
+import concurrent.futures
+import gc
+import importlib
+import logging
+import os
+import signal
+import sqlite3
+import threading
+
+from src.database import database
+from src.staticWeb import cve, metrics, queries, streaming, web
+from src.staticWeb.web import app
+
+logger = logging.getLogger("src.serve")
+
+# gunicorn settings (also read by gunicorn -c python:src.serve)
+bind = os.environ.get("WEB_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_WORKERS", min(8, 2 * (os.cpu_count() or 1))))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread"
+preload_app = True
+timeout = int(os.environ.get("WEB_TIMEOUT", 60))
+graceful_timeout = 30
+# Seconds between two checks of the data and model versions (0 = no automatic reload)
+RELOAD_INTERVAL = float(os.environ.get("WEB_RELOAD_INTERVAL", 10))
+# Dashboard limits whose results are computed before forking
+PRELOAD_LIMITS = (0, 5, 10)
+RENDER_WAIT = 60
+
+
+def preload():
+    # Loads everything the workers would otherwise load on their first requests
+    for name in web.WARMUP_MODULES:
+        importlib.import_module(name)
+    from src.staticWeb import model
+    renders = []
+    for name in model.trainers:
+        entry = model.get_model(name)
+        renders.append(model.schedule_render(entry))
+    for name in model.ONLINE_MODELS:
+        try:
+            model.get_model(name)
+        except ValueError:
+            pass
+    for limit in PRELOAD_LIMITS:
+        web.table_html(queries.top_clients_most_incidents, limit, {})
+        web.table_html(queries.top_incidents_type_by_resolution_time, limit, {})
+        web.table_html(queries.top_employees_by_resolution_time, limit, {})
+    queries.provinces()
+    # The images are files, the workers only need them to exist; no render thread may be busy at fork
+    concurrent.futures.wait(renders, timeout=RENDER_WAIT)
+    # SQLite connections must not cross a fork, the pools open new ones in every worker
+    database.write_pool.close()
+    database.read_pool.close()
+    # Objects loaded so far move to the permanent generation: the collector of the workers does not
+    # touch them, so their memory pages stay shared
+    gc.collect()
+    gc.freeze()
+
+
+def state_version():
+    # (data version, model data version) read directly, the caches of the master are not used
+    try:
+        con = sqlite3.connect(f"file:{database.DB_PATH}?mode=ro", uri=True)
+        try:
+            row = con.execute("SELECT VERSION FROM VERSION_DATOS").fetchone()
+        finally:
+            con.close()
+        data = row[0] if row else 0
+    except sqlite3.Error:
+        data = 0
+    from src.staticWeb import model
+    try:
+        models = model.data_version()
+    except OSError:
+        models = None
+    return data, models
+
+
+def watch(interval=RELOAD_INTERVAL):
+    # Thread of the master: refreshes the state and replaces the workers when a version changes
+    current = state_version()
+    stop = threading.Event()
+
+    def run():
+        nonlocal current
+        while not stop.wait(interval):
+            version = state_version()
+            if version == current:
+                continue
+            logger.info("Data or model version changed %s -> %s, reloading workers", current, version)
+            try:
+                gc.unfreeze()
+                preload()
+            except Exception:
+                logger.exception("Preload failed, the workers keep the previous state")
+                continue
+            current = version
+            os.kill(os.getpid(), signal.SIGHUP)
+
+    thread = threading.Thread(target=run, name="reload-watcher", daemon=True)
+    thread.start()
+    return stop
+
+
+# gunicorn hooks
+def when_ready(server):
+    if RELOAD_INTERVAL > 0:
+        watch(RELOAD_INTERVAL)
+
+
+def post_fork(server, worker):
+    # Background threads are not inherited by the workers
+    cve.start_refresher()
+    streaming.start_checkpointer()
+    metrics.start_sharing()
+    if metrics.PROFILE_SAMPLING:
+        metrics.start_profiler()
+
+
+def on_starting(server):
+    # /metrics of any worker reports the requests of all of them
+    metrics.share()
+    preload()
+
+
+def on_exit(server):
+    metrics.unshare()
+
+
+def main(argv=None):
+    from gunicorn.app.base import BaseApplication
+
+    parser = argparse.ArgumentParser(description="Serve the web app with gunicorn (preloaded workers)")
+    parser.add_argument("--bind", default=bind)
+    parser.add_argument("--workers", type=int, default=workers)
+    parser.add_argument("--threads", type=int, default=threads)
+    parser.add_argument("--timeout", type=int, default=timeout)
+    args = parser.parse_args(argv)
+
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": worker_class,
+        "preload_app": preload_app,
+        "timeout": args.timeout,
+        "graceful_timeout": graceful_timeout,
+        "on_starting": on_starting,
+        "when_ready": when_ready,
+        "post_fork": post_fork,
+        "on_exit": on_exit,
+    }
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# Seconds an entry is valid even if the data does not change
+DEFAULT_TTL = 300
+DEFAULT_SIZE = 256
+
+_caches = {}
+
+
+class ResultCache:
+    """LRU cache with a TTL per entry and a data version: entries of an older version are misses."""
+
+    def __init__(self, name, maxsize=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires, version, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _caches[name] = self
+
+    def get(self, key, version=None):
+        # Returns (found, value)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[2]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, version=None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key, compute, version=None):
+        found, value = self.get(key, version)
+        if not found:
+            value = compute()
+            self.set(key, value, version)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def discard(self, match):
+        # Removes the entries whose key matches, e.g. every entry of a model that has been retrained
+        with self.lock:
+            keys = [key for key in self.entries if match(key)]
+            for key in keys:
+                del self.entries[key]
+            self.evictions += len(keys)
+            return len(keys)
+
+    def memory(self):
+        # Approximate bytes held by the keys and values (containers are followed, shared objects counted once)
+        with self.lock:
+            items = list(self.entries.items())
+        seen = set()
+        return sys.getsizeof(self.entries) + sum(sizeof(key, seen) + sizeof(entry, seen) for key, entry in items)
+
+    def stats(self):
+        memory = self.memory()
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "memory_bytes": memory,
+            }
+
+
+def sizeof(value, seen):
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(sizeof(item, seen) for item in value)
+    elif isinstance(value, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen) for k, v in value.items())
+    return size
+
+
+def cached(cache, version=None):
+    # Decorator: caches the result by function name and arguments, version() is the current data version
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            return cache.get_or_set(key, lambda: func(*args, **kwargs), version() if version else None)
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def all_stats():
+    return {name: cache.stats() for name, cache in _caches.items()}
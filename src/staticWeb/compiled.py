@@ -0,0 +1,206 @@
+# Compiled inference for the "tree" and "forest" models: the fitted sklearn trees are flattened into
+# NumPy node arrays (feature, threshold, children, leaf value) and evaluated without sklearn's predict
+# (input validation, feature-name checks and joblib dispatch on every call).
+# The results are the same as sklearn's, bit for bit:
+#   - inputs are rounded to float32 before the comparisons, as sklearn does (thresholds stay float64)
+#   - a single tree predicts the argmax of its raw leaf values
+#   - a forest adds the leaf probabilities of its trees in estimator order and divides by their number
+#   - leaf values are divided by their sum only where DecisionTreeClassifier.predict_proba does it
+#     (sklearn < 1.4); later versions store the class fractions and return them as they are
+import threading
+
+import numpy as np
+import sklearn
+
+
+def normalizes_leaves():
+    major, minor = (int(part) for part in sklearn.__version__.split(".")[:2])
+    return (major, minor) < (1, 4)
+
+
+class CompiledForest:
+    """All the nodes of all the trees in flat arrays. Leaves point to themselves, so every row of a batch
+    takes the same number of steps; batches run in buffers reused by every call of the same thread."""
+
+    def __init__(self, estimators, classes, average):
+        self.classes = np.asarray(classes)
+        # False: a single DecisionTreeClassifier, True: the mean of the trees of a RandomForestClassifier
+        self.average = average
+        self.normalize = normalizes_leaves()
+        self.n_trees = len(estimators)
+        self.n_classes = len(self.classes)
+        self.n_features = estimators[0].n_features_in_
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        self.depth = 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            leaf = tree.children_left == -1
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(np.where(leaf, np.inf, tree.threshold))
+            lefts.append(np.where(leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(leaf, nodes, tree.children_right) + offset)
+            value = tree.value[:, 0, :self.n_classes]
+            if average and self.normalize:
+                # Same operations as DecisionTreeClassifier.predict_proba
+                normalizer = value.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                value = value / normalizer
+            values.append(value)
+            roots.append(offset)
+            offset += tree.node_count
+            self.depth = max(self.depth, tree.max_depth)
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds).astype(np.float64)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.value = np.ascontiguousarray(np.concatenate(values), dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        # Python copies for the single-row path: indexing lists is much cheaper than NumPy scalars
+        self._feature = self.feature.tolist()
+        self._threshold = self.threshold.tolist()
+        self._left = self.left.tolist()
+        self._right = self.right.tolist()
+        self._value = self.value.tolist()
+        self._roots = self.roots.tolist()
+        self._classes = self.classes.tolist()
+        self._local = threading.local()
+
+    @property
+    def node_count(self):
+        return len(self.feature)
+
+    # --- single row ---
+
+    def _leaf_values(self, row):
+        # Leaf values for one ticket (values in FEATURES order): raw for a tree, mean for a forest.
+        # Small Python lists are still created per call (the float32-rounded row, the forest sum, the mean)
+        buffer = getattr(self._local, "row", None)
+        if buffer is None:
+            buffer = self._local.row = np.empty(self.n_features, dtype=np.float32)
+        buffer[:] = row
+        x = buffer.tolist()
+        feature, threshold, left, right, value = self._feature, self._threshold, self._left, self._right, self._value
+        total = None
+        for node in self._roots:
+            while left[node] != node:
+                node = left[node] if x[feature[node]] <= threshold[node] else right[node]
+            if not self.average:
+                return value[node]
+            if total is None:
+                total = list(value[node])
+            else:
+                for k, v in enumerate(value[node]):
+                    total[k] += v
+        return [v / self.n_trees for v in total]
+
+    def predict_row(self, row):
+        values = self._leaf_values(row)
+        # First maximum, like np.argmax
+        best = 0
+        for k in range(1, self.n_classes):
+            if values[k] > values[best]:
+                best = k
+        return self._classes[best]
+
+    def predict_proba_row(self, row):
+        values = self._leaf_values(row)
+        if self.average:
+            return values
+        if not self.normalize:
+            return list(values)
+        normalizer = sum(values) or 1.0
+        return [v / normalizer for v in values]
+
+    # --- batches ---
+
+    def _workspace(self, n_rows):
+        # Buffers of the thread, grown when a larger batch arrives and used as views afterwards
+        space = getattr(self._local, "space", None)
+        if space is None or space["rows"] < n_rows:
+            size = n_rows * self.n_trees
+            space = self._local.space = {
+                "rows": n_rows,
+                "x": np.empty(n_rows * self.n_features, dtype=np.float32),
+                "start": np.empty(size, dtype=np.intp),
+                "node": np.empty(size, dtype=np.intp),
+                "index": np.empty(size, dtype=np.intp),
+                "x_value": np.empty(size, dtype=np.float32),
+                "threshold": np.empty(size, dtype=np.float64),
+                "go_left": np.empty(size, dtype=bool),
+                "left": np.empty(size, dtype=np.intp),
+                "right": np.empty(size, dtype=np.intp),
+                "leaf": np.empty((size, self.n_classes), dtype=np.float64),
+                "proba": np.empty((n_rows, self.n_classes), dtype=np.float64),
+                "best": np.empty(n_rows, dtype=np.intp),
+            }
+        return space
+
+    def _batch_leaves(self, x):
+        # Leaf values of every (tree, row), tree by tree, and the workspace holding them
+        n_rows = len(x)
+        size = n_rows * self.n_trees
+        space = self._workspace(n_rows)
+        flat = space["x"][:n_rows * self.n_features]
+        np.copyto(flat.reshape(n_rows, self.n_features), x, casting="unsafe")
+        # Position of the first feature of the row in the flattened input
+        start = space["start"][:size].reshape(self.n_trees, n_rows)
+        start[:] = np.arange(0, n_rows * self.n_features, self.n_features)
+        start = start.reshape(-1)
+        node = space["node"][:size].reshape(self.n_trees, n_rows)
+        node[:] = self.roots[:, np.newaxis]
+        node = node.reshape(-1)
+        index, x_value, threshold = space["index"][:size], space["x_value"][:size], space["threshold"][:size]
+        go_left, left, right = space["go_left"][:size], space["left"][:size], space["right"][:size]
+        for _ in range(self.depth):
+            np.take(self.feature, node, out=index)
+            np.add(index, start, out=index)
+            np.take(flat, index, out=x_value)
+            np.take(self.threshold, node, out=threshold)
+            # float32 input against the float64 threshold, compared in float64 like sklearn
+            np.less_equal(x_value, threshold, out=go_left)
+            np.take(self.left, node, out=left)
+            np.take(self.right, node, out=right)
+            np.copyto(node, right)
+            np.copyto(node, left, where=go_left)
+        leaf = space["leaf"][:size]
+        np.take(self.value, node, axis=0, out=leaf)
+        return leaf.reshape(self.n_trees, n_rows, self.n_classes), space
+
+    def _batch_values(self, x):
+        leaves, space = self._batch_leaves(x)
+        if not self.average:
+            return leaves[0], space
+        proba = space["proba"][:leaves.shape[1]]
+        np.copyto(proba, leaves[0])
+        # One tree at a time, in estimator order: the float sums are the same as sklearn's
+        for tree in range(1, self.n_trees):
+            np.add(proba, leaves[tree], out=proba)
+        np.divide(proba, self.n_trees, out=proba)
+        return proba, space
+
+    def predict(self, x):
+        # x: 2-D array of tickets in FEATURES order, returns the classes in a new array (the steps before it
+        # use the buffers of the thread)
+        values, space = self._batch_values(np.asarray(x))
+        best = space["best"][:len(values)]
+        np.argmax(values, axis=1, out=best)
+        return self.classes.take(best)
+
+    def predict_proba(self, x):
+        values, _ = self._batch_values(np.asarray(x))
+        if self.average or not self.normalize:
+            return values.copy()
+        normalizer = values.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        return values / normalizer
+
+
+def compile_model(model):
+    # CompiledForest of a fitted DecisionTreeClassifier or RandomForestClassifier, None for other models
+    if hasattr(model, "estimators_") and hasattr(model, "classes_") and hasattr(model.estimators_[0], "tree_"):
+        return CompiledForest(model.estimators_, model.classes_, average=True)
+    if hasattr(model, "tree_") and hasattr(model, "classes_"):
+        return CompiledForest([model], model.classes_, average=False)
+    return None
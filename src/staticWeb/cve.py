@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+from src.database.database import get_db, get_read_db
+
+# The URL can be changed (e.g. a local stub server for testing) with the CVE_API_URL variable
+CVE_API_URL = os.environ.get("CVE_API_URL", "https://cve.circl.lu/api/last")
+TIMEOUT = 10
+# Seconds between two downloads of the feed
+REFRESH_INTERVAL = int(os.environ.get("CVE_REFRESH_INTERVAL", 900))
+MAX_CVES = 10
+# Seconds before retrying a failed download, and between two downloads attempted by a view while
+# nothing is stored and no refresher runs in the process
+RETRY_INTERVAL = int(os.environ.get("CVE_RETRY_INTERVAL", 60))
+
+logger = logging.getLogger(__name__)
+_refresher = {"pid": None, "thread": None}
+_refresher_lock = threading.Lock()
+_stop = threading.Event()
+_attempt = {"time": None}
+_attempt_lock = threading.Lock()
+
+
+def from_vulnerabilities(item):
+    # Payload shape with a "vulnerabilities" list (CSAF)
+    result = []
+    for vul in item["vulnerabilities"]:
+        cve_id = vul.get("cve", "Sin ID")
+        fecha = vul.get("discovery_date", "Sin fecha")
+        cwe_id = vul.get("cwe", {}).get("id", "Sin CWE")
+        cwe_nombre = vul.get("cwe", {}).get("name", "")
+        descripcion = next(
+            (note.get("text") for note in vul.get("notes", []) if note.get("category") == "description"),
+            "Sin descripción"
+        )
+        attack_complexity = (
+            vul.get("scores", [{}])[0]
+            .get("cvss_v3", {})
+            .get("attackComplexity", "Sin severidad")
+        )
+        result.append({
+            "id": cve_id,
+            "fecha": fecha,
+            "descripcion": descripcion,
+            "cwe": f"{cwe_id} {cwe_nombre}",
+            "severidad": attack_complexity
+        })
+    return result
+
+
+def from_cve_record(item):
+    # Payload shape with "cveMetadata" and "containers" (CVE JSON 5)
+    cve_id = item.get("cveMetadata", {}).get("cveId", "Sin ID")
+    fecha = item.get("cveMetadata", {}).get("datePublished", "Sin fecha")
+    descripcion = next(
+        (desc.get("value") for desc in item.get("containers", {}).get("cna", {}).get("descriptions", [])
+         if desc.get("lang") == "en"),
+        "Sin descripción"
+    )
+    cwe_id = "Sin CWE"
+    cwe_nombre = ""
+    for pt in item.get("containers", {}).get("cna", {}).get("problemTypes", []):
+        for desc in pt.get("descriptions", []):
+            if desc.get("lang") == "en":
+                cwe_id = desc.get("cweId", "Sin CWE")
+                cwe_nombre = desc.get("description", "Sin CWE-descripcion")
+                break
+    severidad = next(
+        (
+            m.get("cvssV3_1", {}).get("attackComplexity")
+            for m in item.get("containers", {}).get("cna", {}).get("metrics", [])
+            if "cvssV3_1" in m
+        ),
+        "Sin severidad"
+    )
+    return [{
+        "id": cve_id,
+        "fecha": fecha,
+        "descripcion": descripcion,
+        "cwe": f"{cwe_id} {cwe_nombre}",
+        "severidad": severidad
+    }]
+
+
+def normalize(data):
+    # Both payload shapes to a list of {"id", "fecha", "descripcion", "cwe", "severidad"}
+    vulnerabilities = []
+    for item in data:
+        if len(vulnerabilities) >= MAX_CVES:
+            break
+        if "vulnerabilities" in item:
+            vulnerabilities.extend(from_vulnerabilities(item))
+        elif "cveMetadata" in item and "containers" in item:
+            vulnerabilities.extend(from_cve_record(item))
+    return vulnerabilities[:MAX_CVES]
+
+
+def fetch(url=None, timeout=TIMEOUT):
+    request = urllib.request.Request(url or CVE_API_URL, headers={"Accept": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+
+def init_table(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS CVE (
+            POSICION    INT PRIMARY KEY,
+            ID_CVE      TEXT,
+            FECHA       TEXT,
+            DESCRIPCION TEXT,
+            CWE         TEXT,
+            SEVERIDAD   TEXT,
+            ACTUALIZADO TIMESTAMP
+        )""")
+
+
+def store(vulnerabilities):
+    # Replaces the stored copy in a single transaction, readers see the old or the new list
+    with get_db() as db:
+        init_table(db)
+        db.execute("DELETE FROM CVE")
+        db.executemany("INSERT INTO CVE (POSICION, ID_CVE, FECHA, DESCRIPCION, CWE, SEVERIDAD, ACTUALIZADO) "
+                       "VALUES (?, ?, ?, ?, ?, ?, datetime('now'))",
+                       [(i, v["id"], v["fecha"], v["descripcion"], v["cwe"], v["severidad"])
+                        for i, v in enumerate(vulnerabilities)])
+        db.commit()
+
+
+def refresh(url=None, timeout=TIMEOUT):
+    # Downloads the feed and stores it, on error the last good copy is kept. Returns True if stored
+    try:
+        vulnerabilities = normalize(fetch(url, timeout))
+    except Exception as e:
+        logger.warning("CVE feed not updated (%s), serving the last stored copy", e)
+        return False
+    if not vulnerabilities:
+        logger.warning("CVE feed returned no vulnerabilities, serving the last stored copy")
+        return False
+    store(vulnerabilities)
+    return True
+
+
+def try_refresh():
+    # Download for a view: one at a time and at most once every RETRY_INTERVAL seconds, the other
+    # requests get the empty list instead of waiting for the feed
+    if not _attempt_lock.acquire(blocking=False):
+        return False
+    try:
+        now = time.monotonic()
+        if _attempt["time"] is not None and now - _attempt["time"] < RETRY_INTERVAL:
+            return False
+        _attempt["time"] = now
+        return refresh(timeout=3)
+    finally:
+        _attempt_lock.release()
+
+
+def latest():
+    try:
+        with get_read_db() as db:
+            rows = db.execute("SELECT ID_CVE, FECHA, DESCRIPCION, CWE, SEVERIDAD FROM CVE ORDER BY POSICION").fetchall()
+    except Exception:
+        # Table not created yet: nothing downloaded so far
+        rows = []
+    if not rows and not refresher_running() and try_refresh():
+        return latest()
+    return [{"id": row[0], "fecha": row[1], "descripcion": row[2], "cwe": row[3], "severidad": row[4]}
+            for row in rows]
+
+
+def refresh_loop(interval):
+    while not _stop.is_set():
+        refreshed = refresh()
+        _stop.wait(interval if refreshed else min(interval, RETRY_INTERVAL))
+
+
+def refresher_running():
+    thread = _refresher["thread"]
+    return _refresher["pid"] == os.getpid() and thread is not None and thread.is_alive()
+
+
+def start_refresher(interval=REFRESH_INTERVAL):
+    # One refresher thread per process, started by the entry points (src/main.py, the post_fork hook of
+    # src/serve.py) and not on import: under gunicorn the app is imported by the master
+    with _refresher_lock:
+        if refresher_running():
+            return _refresher["thread"]
+        thread = threading.Thread(target=refresh_loop, args=(interval,), name="cve-refresher", daemon=True)
+        thread.start()
+        _refresher.update(pid=os.getpid(), thread=thread)
+        return thread
@@ -0,0 +1,318 @@
+import atexit
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request
+
+from src.database import database
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+HELP = {
+    "app_request_seconds": "Duration of the HTTP requests",
+    "app_stage_seconds": "Duration of the stages of a request (queries, pandas, to_html, fit, predict...)",
+    "app_sql_seconds": "Duration of the SQL statements run through the connection pools",
+    "app_model_seconds": "Duration of model training and prediction",
+}
+# Opt-in sampling profiler: PROFILE_SAMPLING=1, folded stacks of every process written to PROFILE_OUTPUT with
+# its pid before the extension (profile.1234.folded)
+PROFILE_SAMPLING = bool(os.environ.get("PROFILE_SAMPLING"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_OUTPUT = os.environ.get("PROFILE_OUTPUT", "profile.folded")
+# Several worker processes (src/serve.py): every worker writes its histograms to this directory (default: a
+# temporary directory of the server) every SHARE_INTERVAL seconds and /metrics adds up the files of all of them
+METRICS_DIR = os.environ.get("METRICS_DIR")
+SHARE_INTERVAL = float(os.environ.get("METRICS_SHARE_INTERVAL", 5))
+
+# (metric, labels) -> [bucket counts..., sum, count]
+_histograms = {}
+_lock = threading.Lock()
+_shared = {"directory": None, "temporary": False, "pid": None, "thread": None}
+_numbers = re.compile(r"\b\d+\b")
+_spaces = re.compile(r"\s+")
+
+
+def observe(metric, seconds, **labels):
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        values = _histograms.get(key)
+        if values is None:
+            values = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                values[i] += 1
+                break
+        values[-2] += seconds
+        values[-1] += 1
+
+
+@contextmanager
+def stage(name):
+    # with stage("to_html"): ... -> app_stage_seconds{stage="to_html"}, also added to the current request
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("app_stage_seconds", elapsed, stage=name)
+        stages = _request_stages()
+        if stages is not None:
+            stages[name] += elapsed
+
+
+def timed(metric, **labels):
+    # Decorator version for a whole function
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(metric, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def _request_stages():
+    try:
+        return g.setdefault("metrics_stages", Counter())
+    except RuntimeError:
+        # Outside of a request (background threads, ETL)
+        return None
+
+
+def statement_label(sql):
+    # Literals such as LIMIT 10 are folded so every statement is a single series
+    return _numbers.sub("?", _spaces.sub(" ", sql).strip())[:120]
+
+
+def record_sql(sql, seconds):
+    observe("app_sql_seconds", seconds, statement=statement_label(sql))
+    stages = _request_stages()
+    if stages is not None:
+        stages["sql"] += seconds
+
+
+def before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def after_request(response):
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or "unknown"
+        observe("app_request_seconds", elapsed, endpoint=endpoint, method=request.method,
+                status=str(response.status_code))
+        # Per-request breakdown, e.g. Server-Timing: sql;dur=3.1, to_html;dur=0.8
+        stages = g.get("metrics_stages")
+        if stages:
+            response.headers["Server-Timing"] = ", ".join(
+                f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items())
+    return response
+
+
+def init_app(app):
+    # The profiler and the shared histograms are started by the entry points (src/main.py, the post_fork
+    # hook of src/serve.py): under gunicorn the app is imported by the master
+    app.before_request(before_request)
+    app.after_request(after_request)
+    database.statement_hooks.append(record_sql)
+
+
+def reset_after_fork():
+    # A worker starts empty: the observations of the master (preload) are not counted once per worker
+    global _lock
+    _lock = threading.Lock()
+    _histograms.clear()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def share():
+    # Master, before forking: the workers write their histograms to METRICS_DIR (emptied for this server) or
+    # to a temporary directory removed by unshare()
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        for name in os.listdir(METRICS_DIR):
+            if name.startswith("metrics.") and name.endswith(".json"):
+                os.remove(os.path.join(METRICS_DIR, name))
+        _shared.update(directory=METRICS_DIR, temporary=False)
+    else:
+        _shared.update(directory=tempfile.mkdtemp(prefix="app-metrics-"), temporary=True)
+
+
+def unshare():
+    if _shared["temporary"]:
+        shutil.rmtree(_shared["directory"], ignore_errors=True)
+    _shared.update(directory=METRICS_DIR, temporary=False)
+
+
+def write_shared():
+    directory = _shared["directory"]
+    if not directory or _shared["pid"] != os.getpid():
+        return
+    with _lock:
+        items = [[metric, labels, values] for (metric, labels), values in _histograms.items()]
+    path = os.path.join(directory, f"metrics.{os.getpid()}.json")
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(items, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def share_loop(interval):
+    while True:
+        time.sleep(interval)
+        write_shared()
+
+
+def start_sharing(interval=SHARE_INTERVAL):
+    # One writer thread per worker, the last values are also written at exit. Without a directory every
+    # process only reports its own requests
+    if not _shared["directory"] or _shared["pid"] == os.getpid():
+        return
+    _shared["pid"] = os.getpid()
+    _shared["thread"] = threading.Thread(target=share_loop, args=(interval,), name="metrics-share", daemon=True)
+    _shared["thread"].start()
+
+
+atexit.register(write_shared)
+
+
+def collect():
+    # Histograms of this process and of the files of the other workers (also the ones that exited, their
+    # requests still count), at most SHARE_INTERVAL seconds old
+    with _lock:
+        totals = {key: list(values) for key, values in _histograms.items()}
+    directory = _shared["directory"]
+    if not directory:
+        return totals
+    own = f"metrics.{os.getpid()}.json"
+    for name in os.listdir(directory):
+        if name == own or not (name.startswith("metrics.") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                items = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for metric, labels, values in items:
+            key = (metric, tuple(tuple(label) for label in labels))
+            current = totals.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                current[i] += value
+    return totals
+
+
+def render():
+    # Prometheus text exposition format
+    lines = []
+    items = sorted(collect().items())
+    current = None
+    for (metric, labels), values in items:
+        if metric != current:
+            current = metric
+            lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+        label_text = ",".join(f'{name}="{escape(value)}"' for name, value in labels)
+        prefix = label_text + "," if label_text else ""
+        cumulative = 0
+        for bound, count in zip(BUCKETS, values):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{prefix}le="+Inf"}} {values[-1]}')
+        lines.append(f"{metric}_sum{{{label_text}}} {values[-2]}")
+        lines.append(f"{metric}_count{{{label_text}}} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread and aggregates them in the folded format of flamegraph.pl."""
+
+    def __init__(self, interval=PROFILE_INTERVAL, output=None, flush_every=10.0):
+        self.interval = interval
+        self.output = output or profile_output()
+        self.flush_every = flush_every
+        self.stacks = Counter()
+        # folded() runs in request threads while the profiler thread adds samples
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+
+    def sample(self):
+        own = threading.get_ident()
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stacks.append(";".join(reversed(names)))
+        with self.lock:
+            self.stacks.update(stacks)
+
+    def run(self):
+        last_flush = time.monotonic()
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+            if time.monotonic() - last_flush >= self.flush_every:
+                self.flush()
+                last_flush = time.monotonic()
+        self.flush()
+
+    def folded(self):
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def flush(self):
+        tmp = f"{self.output}.tmp"
+        with open(tmp, "w") as file:
+            file.write(self.folded())
+        os.replace(tmp, self.output)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def profile_output(pid=None):
+    # profile.folded -> profile.1234.folded, one file per process
+    root, extension = os.path.splitext(PROFILE_OUTPUT)
+    return f"{root}.{pid or os.getpid()}{extension}"
+
+
+_profiler = {}
+
+
+def start_profiler(**kwargs):
+    # One profiler per process, started by the entry points when PROFILE_SAMPLING is set
+    if os.getpid() not in _profiler:
+        _profiler[os.getpid()] = SamplingProfiler(**kwargs).start()
+    return _profiler[os.getpid()]
+
+
+def profiler():
+    return _profiler.get(os.getpid())
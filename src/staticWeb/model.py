@@ -1,51 +1,158 @@
 import json
+import hashlib
+import os
+import pickle
+import threading
 import pandas as pd
-import matplotlib.pyplot as plt
+import time
 import graphviz
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.figure import Figure
 from sklearn.model_selection import train_test_split
 from sklearn import linear_model
 from sklearn import tree
 from sklearn.ensemble import RandomForestClassifier
 from pathlib import Path
+from src.staticWeb.cache import ResultCache
+from src.staticWeb.compiled import compile_model
+from src.staticWeb.metrics import stage, observe
 
 base = Path(__file__).resolve().parent
 path_data = base / ".." / "data" / "data_clasified.json"
 image_path = base / "static"
+model_path = base / "trained"
+
+FEATURES = ['cliente_id', 'fecha_apertura', 'fecha_cierre', 'es_mantenimiento', 'tipo_incidencia', 'duracion']
+# Columns given by the user, the rest of FEATURES are derived from them
+INPUTS = ['cliente_id', 'fecha_apertura', 'fecha_cierre', 'es_mantenimiento', 'tipo_incidencia']
+# Other accepted names for the input columns
+ALIASES = {"cliente": "cliente_id"}
+BOOLEANS = {"true": 1, "false": 0, "si": 1, "sí": 1, "no": 0}
+BATCH_SIZE = 10000
+# Incremental models, updated by the ETL from the new tickets (see online.py)
+ONLINE_MODELS = ("sgd", "forest_online")
+# Training data: "json" (data_clasified.json) or "columnar" (store exported by the ETL, see etl/columnar.py)
+MODEL_SOURCE = os.environ.get("MODEL_SOURCE", "json")
 
 
 # models -> regression, tree, forest
 
+# Trained models kept in memory: model_name -> {"version", "model", "x_test", "y_test"}
+_registry = {}
+_registry_lock = threading.Lock()
+# Background rendering of the model images: model hash -> Future
+_render_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="render")
+_renders = {}
+_render_started = {}
+_render_lock = threading.Lock()
+RENDER_RETRY = 60
+# (mtime, size) of the data file -> content hash, so the file is only hashed when it changes
+_version_cache = {}
+# Predictions of /classify: (model name, model version, normalized ticket) -> class; the model hash is the
+# cache version, and the entries of a model are dropped as soon as it is retrained
+prediction_cache = ResultCache("predictions", maxsize=int(os.environ.get("PREDICTION_CACHE_SIZE", 10000)),
+                               ttl=int(os.environ.get("PREDICTION_CACHE_TTL", 3600)))
+# Hash of the online snapshot last served, to notice the ETL updates
+_online_hashes = {}
+
 
 def load_data():
-    with open(path_data) as file:
+    with stage("json_load"), open(path_data) as file:
         data = json.load(file)
     return data
 
 
-def process(data):
+def extract_columns(data):
+    # Columnar view of the tickets: dates are parsed in one vectorized call per column
     tickets = data.get("tickets_emitidos", [])
-    processed = []
-    for ticket in tickets:
-        processed.append({
-            "cliente_id": ticket.get("cliente"),
-            "fecha_apertura": pd.to_datetime(ticket.get("fecha_apertura")).timestamp(),
-            "fecha_cierre": pd.to_datetime(ticket.get("fecha_cierre")).timestamp(),
-            "es_mantenimiento": int(ticket.get("es_mantenimiento")),
-            "tipo_incidencia": ticket.get("tipo_incidencia"),
-            "es_critico": int(ticket.get("es_critico"))
+    df = pd.DataFrame.from_records(tickets, columns=[
+        "cliente", "fecha_apertura", "fecha_cierre", "es_mantenimiento", "tipo_incidencia", "es_critico",
+        "contactos_con_empleados"])
+    columns = pd.DataFrame({
+        "cliente_id": pd.to_numeric(df["cliente"], errors="coerce"),
+        "fecha_apertura": to_timestamp(df["fecha_apertura"]),
+        "fecha_cierre": to_timestamp(df["fecha_cierre"]),
+        "es_mantenimiento": df["es_mantenimiento"].astype(float),
+        "tipo_incidencia": pd.to_numeric(df["tipo_incidencia"], errors="coerce"),
+        "es_critico": df["es_critico"].astype(float),
+    })
+    add_derived(columns)
+
+    # Contacts: one row per contact, aggregated back by ticket
+    contacts = df["contactos_con_empleados"].explode().dropna()
+    times = pd.Series([contact.get("tiempo", 0) for contact in contacts], index=contacts.index, dtype=float)
+    columns["num_contactos"] = contacts.groupby(level=0).size().reindex(columns.index, fill_value=0)
+    columns["tiempo_contactos"] = times.groupby(level=0).sum().reindex(columns.index, fill_value=0.0)
+    return columns
+
+
+def add_derived(columns):
+    # Features derived from the ticket dates, also available when a new ticket is classified
+    columns["duracion"] = (columns["fecha_cierre"] - columns["fecha_apertura"]) / 86400
+
+
+def extract_store_columns():
+    # Same columns as extract_columns, read from the columnar store: only the needed columns, no JSON parsing
+    from src.etl import columnar
+    tickets = columnar.read_tickets(["ID_TICKET", "CLIENTE_ID", "FECHA_APERTURA", "FECHA_CIERRE",
+                                     "ES_MANTENIMIENTO", "INCIDENCIA_ID", "ES_CRITICO"])
+    contacts = columnar.read_contacts(["TICKET_ID", "TIEMPO"]).groupby("TICKET_ID")["TIEMPO"]
+    columns = pd.DataFrame({
+        "cliente_id": tickets["CLIENTE_ID"].astype(float),
+        "fecha_apertura": to_timestamp(tickets["FECHA_APERTURA"]),
+        "fecha_cierre": to_timestamp(tickets["FECHA_CIERRE"]),
+        "es_mantenimiento": tickets["ES_MANTENIMIENTO"].astype(float),
+        "tipo_incidencia": tickets["INCIDENCIA_ID"].astype(float),
+        "es_critico": tickets["ES_CRITICO"].astype(float),
+    })
+    add_derived(columns)
+    columns["num_contactos"] = tickets["ID_TICKET"].map(contacts.size()).fillna(0).to_numpy()
+    columns["tiempo_contactos"] = tickets["ID_TICKET"].map(contacts.sum()).fillna(0.0).to_numpy()
+    return columns
 
-        })
 
-    df = pd.DataFrame(processed)
+def process(data):
+    return split(extract_columns(data))
+
 
-    data_x = df[['cliente_id', 'fecha_apertura', 'fecha_cierre', 'es_mantenimiento', 'tipo_incidencia']]
-    data_y = df['es_critico']
+def split(columns):
+    df = columns.dropna(subset=FEATURES + ["es_critico"])
+
+    data_x = df[FEATURES]
+    data_y = df['es_critico'].astype(int)
 
     # x_train, x_test, y_train, y_test -> return value
     x_train, x_test, y_train, y_test = train_test_split(data_x, data_y, test_size=0.2)
     return x_train, x_test, y_train, y_test
 
 
+def to_timestamp(values):
+    dates = pd.to_datetime(values, errors="coerce")
+    return (dates - pd.Timestamp(0)) / pd.Timedelta(seconds=1)
+
+
+def to_matrix(frame):
+    # Validates the tickets to classify and returns them with the columns the models were trained on
+    frame = frame.rename(columns=ALIASES)
+    missing = [column for column in INPUTS if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    matrix = pd.DataFrame(index=frame.index)
+    for column in INPUTS:
+        values = frame[column]
+        if column.startswith("fecha") and not pd.api.types.is_numeric_dtype(values):
+            values = to_timestamp(values)
+        elif values.dtype == object:
+            values = pd.to_numeric(values.astype(str).str.strip().str.lower().replace(BOOLEANS), errors="coerce")
+        matrix[column] = values.astype(float)
+    add_derived(matrix)
+    invalid = matrix.isna().any(axis=1)
+    if invalid.any():
+        rows = ", ".join(str(row) for row in matrix.index[invalid][:10])
+        raise ValueError(f"Invalid or empty values in rows: {rows}")
+    return matrix
+
+
 def linear_regression(x_train, y_train):
     regr = linear_model.LinearRegression()
     regr.fit(x_train, y_train)
@@ -64,84 +171,334 @@ def random_forest(x_train, y_train):
     return clf
 
 
-def predict_model(model_name, input_data):
-    data = load_data()
-    x_train, x_test, y_train, y_test = process(data)
-    prediction = None
-    graphic = None
-    graphics = None
+trainers = {
+    "regression": linear_regression,
+    "tree": tree_decision,
+    "forest": random_forest,
+}
+
+
+def data_version():
+    # Content hash of the training data, any change in the file invalidates the trained models
+    if MODEL_SOURCE == "columnar":
+        # The store records the VERSION_DATOS it was exported from
+        from src.etl import columnar
+        version = columnar.store_version()
+        if version is None:
+            raise FileNotFoundError("MODEL_SOURCE=columnar but there is no columnar store, export it first")
+        return hashlib.sha256(f"{','.join(FEATURES)}|columnar|{version[0]}".encode()).hexdigest()[:16]
+    stat = os.stat(path_data)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if key not in _version_cache:
+        # The feature set is part of the version: models trained with other features are not reusable
+        digest = hashlib.sha256(",".join(FEATURES).encode())
+        with open(path_data, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        _version_cache.clear()
+        _version_cache[key] = digest.hexdigest()[:16]
+    return _version_cache[key]
+
+
+def model_file(model_name, version):
+    return model_path / f"{model_name}-{version}.pkl"
+
+
+def load_trained(model_name, version):
+    try:
+        with open(model_file(model_name, version), "rb") as file:
+            return pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def save_trained(entry):
+    model_path.mkdir(exist_ok=True)
+    # Older versions of the same model are no longer valid
+    for old in model_path.glob(f"{entry['name']}-*.pkl"):
+        old.unlink(missing_ok=True)
+    target = model_file(entry["name"], entry["version"])
+    tmp = target.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as file:
+        pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, target)
+
+
+def model_hash(model):
+    return hashlib.sha256(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()[:16]
+
+
+def train(model_name, version):
+    if MODEL_SOURCE == "columnar":
+        with stage("columnar_load"):
+            columns = extract_store_columns()
+    else:
+        data = load_data()
+        with stage("features"):
+            columns = extract_columns(data)
+    x_train, x_test, y_train, y_test = split(columns)
+    start = time.perf_counter()
+    model = trainers[model_name](x_train, y_train)
+    observe("app_model_seconds", time.perf_counter() - start, model=model_name, operation="fit")
+    return {
+        "name": model_name,
+        "version": version,
+        "hash": model_hash(model),
+        "model": model,
+        "x_test": x_test,
+        "y_test": y_test,
+    }
+
+
+def get_model(model_name):
+    # Returns the trained model, training it only the first time or when the data changes
+    if model_name in ONLINE_MODELS:
+        # Last snapshot written by the ETL, never trained here
+        from src.staticWeb import online
+        entry = online.latest(model_name)
+        if entry is None:
+            raise ValueError(f"The online model {model_name} has no snapshot yet, run the ETL with --online")
+        if _online_hashes.get(model_name) != entry["hash"]:
+            if model_name in _online_hashes:
+                evict_predictions(model_name)
+            _online_hashes[model_name] = entry["hash"]
+        return entry
+    if model_name not in trainers:
+        raise ValueError(f"Unknown model: {model_name}")
+    version = data_version()
+    entry = _registry.get(model_name)
+    if entry is not None and entry["version"] == version:
+        return entry
+    with _registry_lock:
+        entry = _registry.get(model_name)
+        if entry is None or entry["version"] != version:
+            entry = load_trained(model_name, version)
+            if entry is None:
+                entry = train(model_name, version)
+                save_trained(entry)
+            entry.setdefault("hash", model_hash(entry["model"]))
+            # Flat node arrays for the tree models, rebuilt on load (cheap, not stored in the pickle)
+            entry["compiled"] = compile_model(entry["model"])
+            if model_name in _registry:
+                evict_predictions(model_name)
+            _registry[model_name] = entry
+            schedule_render(entry)
+    return entry
+
+
+def evict_predictions(model_name):
+    return prediction_cache.discard(lambda key: key[0] == model_name)
+
+
+def feature_key(input_data):
+    # Normalized ticket for the prediction cache, without pandas: the same ticket written in another way
+    # (alias, "7" or 7, " Si ") gets the same key. None if it can not be normalized (to_matrix reports why)
+    values = {ALIASES.get(column, column): value for column, value in input_data.items()}
+    key = []
+    for column in INPUTS:
+        if column not in values:
+            return None
+        value = values[column]
+        if isinstance(value, str):
+            value = value.strip()
+            if column.startswith("fecha"):
+                # Date text is parsed by to_matrix, it stays text in the key
+                key.append(value)
+                continue
+            value = BOOLEANS.get(value.lower(), value)
+        try:
+            key.append(float(value))
+        except (TypeError, ValueError):
+            return None
+    return tuple(key)
+
+
+def predict_one(model_name, entry, input_data):
+    model = entry["model"]
+    x_input = to_matrix(pd.DataFrame([input_data]))
+    start = time.perf_counter()
     if model_name == "regression":
-        regr_model = linear_regression(x_train, y_train)
-        y_pred = regr_model.predict([list(input_data.values())])
+        y_pred = model.predict(x_input)
         y_prediction = y_pred[0]
         prediction = int(y_prediction >= 5)
-        graphic, graphics = plot_regression(y_test, y_pred)
-
-    elif model_name == "tree":
-        model = tree_decision(x_train, y_train)
-        prediction = model.predict([list(input_data.values())])[0]
-        graphic, graphics = tree_graph(model)
-
-    elif model_name == "forest":
-        model = random_forest(x_train, y_train)
-        prediction = model.predict([list(input_data.values())])[0]
-        graphic, graphics = export_random_forest(model)
-
-    return prediction, graphic, graphics
-
-
-def plot_regression(y_test, y_pred):
-    plt.figure()
-    plt.scatter(range(len(y_test)), y_test, color="black", label="Datos reales")
-    plt.scatter(range(len(y_pred)), y_pred, color="blue", label="Predicciones")
-    plt.title("Regresión lineal: Predicción de criticidad")
-    plt.xlabel("ID Cliente (aproximación visual)")
-    plt.ylabel("Crítico (1) / No crítico (0)")
-    plt.legend()
-    real_path = image_path / "regression.png"
-    plt.savefig(real_path)
-    plt.close()
-    return "regression.png", None
-
-
-def tree_graph(clf):
-    dot_data = tree.export_graphviz(clf, out_file=None, filled=True, rounded=True, special_characters=True,
-                                    feature_names=['cliente_id', 'fecha_apertura', 'fecha_cierre', 'es_mantenimiento',
-                                                   'tipo_incidencia'],
-                                    class_names=['No crítico', 'Crítico'])
-    graph = graphviz.Source(dot_data)
-    graph.format = 'png'
-    graph.render(filename="tree", directory=image_path, format="png", cleanup=True)
-    return "tree.png", None
+    elif entry.get("compiled") is not None:
+        prediction = entry["compiled"].predict_row(x_input[FEATURES].to_numpy()[0])
+    else:
+        prediction = model.predict(x_input)[0]
+    observe("app_model_seconds", time.perf_counter() - start, model=model_name, operation="predict")
+    return prediction
 
 
-"""def export_random_forest(clf):
-    estimator = clf.estimators_[0]
+def predict_model(model_name, input_data):
+    entry = get_model(model_name)
+    key = feature_key(input_data)
+    if key is None:
+        prediction = predict_one(model_name, entry, input_data)
+    else:
+        prediction = prediction_cache.get_or_set((model_name, entry["version"], key),
+                                                 lambda: predict_one(model_name, entry, input_data),
+                                                 entry["hash"])
+    if model_name in ONLINE_MODELS:
+        # No images for the incremental models
+        return prediction, None, None, False
+
+    # The images are never rendered here, the page shows them once the background render finishes
+    graphic, graphics, pending = model_graphics(entry)
+    return prediction, graphic, graphics, pending
+
+
+def predict_batch(model_name, frame):
+    # Scores all the tickets of the frame with a single predict call
+    entry = get_model(model_name)
+    x_input = to_matrix(frame)
+    start = time.perf_counter()
+    if entry.get("compiled") is not None:
+        y_pred = entry["compiled"].predict(x_input[FEATURES].to_numpy())
+    else:
+        y_pred = entry["model"].predict(x_input)
+    observe("app_model_seconds", time.perf_counter() - start, model=model_name, operation="predict_batch")
+    if model_name == "regression":
+        return (y_pred >= 5).astype(int)
+    return y_pred.astype(int)
+
+
+def read_ndjson(stream, batch_size=BATCH_SIZE):
+    # One JSON ticket per line, parsed while the body is read
+    records = []
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Invalid JSON on line {number}")
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {number} is not a JSON object")
+        records.append(record)
+        if len(records) == batch_size:
+            yield pd.DataFrame.from_records(records)
+            records = []
+    if records:
+        yield pd.DataFrame.from_records(records)
+
+
+def read_batches(source, input_format="json", batch_size=BATCH_SIZE):
+    # Splits a JSON array (list of tickets), an NDJSON stream or a CSV file into DataFrames of batch_size rows
+    if input_format == "csv":
+        yield from pd.read_csv(source, chunksize=batch_size)
+        return
+    if input_format == "ndjson":
+        yield from read_ndjson(source, batch_size)
+        return
+    for start in range(0, len(source), batch_size):
+        yield pd.DataFrame.from_records(source[start:start + batch_size])
+
+
+def classify_batch(model_name, source, input_format="json", batch_size=BATCH_SIZE):
+    # Yields (first row, predictions) for every batch, only one batch is held in memory at a time
+    row = 0
+    for frame in read_batches(source, input_format, batch_size):
+        frame.index = range(row, row + len(frame))
+        yield row, predict_batch(model_name, frame)
+        row += len(frame)
+
+
+def graphic_names(entry):
+    # Images are content-addressed by the model hash, every trained model has its own files
+    prefix = f"models/{entry['name']}-{entry['hash']}"
+    if entry["name"] == "forest":
+        return None, [f"{prefix}-{i + 1}.png" for i in range(len(entry["model"].estimators_))]
+    return f"{prefix}.png", None
+
+
+def render_model(entry):
+    graphic, graphics = graphic_names(entry)
+    names = graphics or [graphic]
+    if all((image_path / name).exists() for name in names):
+        return
+    (image_path / "models").mkdir(exist_ok=True)
+    with stage(f"render_{entry['name']}"):
+        draw_model(entry, graphic, graphics)
+
+
+def draw_model(entry, graphic, graphics):
+    # matplotlib for the regression, graphviz for the trees
+    if entry["name"] == "regression":
+        plot_regression(entry["y_test"], entry["model"].predict(entry["x_test"]), image_path / graphic)
+    elif entry["name"] == "tree":
+        tree_graph(entry["model"], image_path / graphic)
+    elif entry["name"] == "forest":
+        export_random_forest(entry["model"], [image_path / name for name in graphics])
+
+
+def reset_render_pool():
+    # Threads do not survive a fork (preloaded multi-worker server): every worker gets its own pool
+    global _render_pool, _render_lock
+    _render_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="render")
+    _render_lock = threading.Lock()
+    _renders.clear()
+    _render_started.clear()
+
+
+os.register_at_fork(after_in_child=reset_render_pool)
+
+
+def schedule_render(entry):
+    # Renders the images of a model version once, in the background pool
+    key = entry["hash"]
+    with _render_lock:
+        future = _renders.get(key)
+        failed = future is not None and future.done() and future.exception() is not None
+        if future is None or (failed and time.monotonic() - _render_started[key] > RENDER_RETRY):
+            _renders[key] = future = _render_pool.submit(render_model, entry)
+            _render_started[key] = time.monotonic()
+    return future
+
+
+def model_graphics(entry):
+    # Returns (graphic, graphics, pending): image names if they are already rendered
+    graphic, graphics = graphic_names(entry)
+    if all((image_path / name).exists() for name in graphics or [graphic]):
+        return graphic, graphics, False
+    future = schedule_render(entry)
+    if future.done():
+        # Rendering failed (e.g. graphviz is not installed)
+        return None, None, False
+    return None, None, True
+
+
+def save_image(save, path):
+    # Writes to a temporary file first so a half-written image is never served
+    tmp = path.with_name(f".{path.stem}.{threading.get_ident()}{path.suffix}")
+    save(tmp)
+    os.replace(tmp, path)
+
+
+def plot_regression(y_test, y_pred, path):
+    # Figure API instead of pyplot, it is safe to use from the render threads
+    fig = Figure()
+    ax = fig.subplots()
+    ax.scatter(range(len(y_test)), y_test, color="black", label="Datos reales")
+    ax.scatter(range(len(y_pred)), y_pred, color="blue", label="Predicciones")
+    ax.set_title("Regresión lineal: Predicción de criticidad")
+    ax.set_xlabel("Ticket de test")
+    ax.set_ylabel("Crítico (1) / No crítico (0)")
+    ax.legend()
+    save_image(lambda tmp: fig.savefig(tmp, format="png"), path)
+
+
+def render_tree(estimator, path):
     dot_data = tree.export_graphviz(estimator, out_file=None, filled=True, rounded=True, special_characters=True,
-                                    feature_names=['cliente_id', 'fecha_apertura', 'fecha_cierre', 'es_mantenimiento',
-                                                   'tipo_incidencia'],
+                                    feature_names=FEATURES,
                                     class_names=['No crítico', 'Crítico'])
-
     graph = graphviz.Source(dot_data)
-    graph.format = 'png'
-    output_path = image_path / "random_forest"
-    graph.render(output_path, cleanup=True)
-    return "random_forest.png"
-"""
-
-
-def export_random_forest(clf):
-    graphics = []
-    for i, estimator in enumerate(clf.estimators_):
-        dot_data = tree.export_graphviz(estimator, out_file=None, filled=True, rounded=True, special_characters=True,
-                                        feature_names=['cliente_id', 'fecha_apertura', 'fecha_cierre',
-                                                       'es_mantenimiento',
-                                                       'tipo_incidencia'],
-                                        class_names=['No crítico', 'Crítico'])
-        graph = graphviz.Source(dot_data)
-        graph.format = "png"
-        output_path = image_path / f"random_forest{i + 1}"
-        graph.render(output_path, cleanup=True)
-        graphics.append(f"random_forest{i + 1}.png")
-
-    return None, graphics
+    save_image(lambda tmp: tmp.write_bytes(graph.pipe(format="png")), path)
+
+
+def tree_graph(clf, path):
+    render_tree(clf, path)
+
+
+def export_random_forest(clf, paths):
+    for estimator, path in zip(clf.estimators_, paths):
+        render_tree(estimator, path)
@@ -0,0 +1,203 @@
+# Incremental (online) training of the criticality classifier from the tickets loaded by the ETL.
+# Every update reads only the tickets with ID_TICKET above the watermark of the last snapshot,
+# updates the model and writes a new versioned snapshot; old tickets are never read again.
+#   sgd            StandardScaler + SGDClassifier (logistic loss), updated with partial_fit
+#   forest_online  RandomForestClassifier with warm_start, every batch of new tickets adds trees fitted on it
+import copy
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+
+from src.staticWeb.metrics import observe
+from src.staticWeb.model import FEATURES, model_path, to_matrix
+
+CLASSES = np.array([0, 1])
+# Tickets read from SQLite per partial_fit call
+UPDATE_BATCH = 50000
+TREES_PER_UPDATE = 5
+KEEP_SNAPSHOTS = 5
+snapshot_path = model_path / "online"
+
+NEW_TICKETS_SQL = """
+    SELECT ID_TICKET, CLIENTE_ID AS cliente_id, FECHA_APERTURA AS fecha_apertura, FECHA_CIERRE AS fecha_cierre,
+           ES_MANTENIMIENTO AS es_mantenimiento, INCIDENCIA_ID AS tipo_incidencia, ES_CRITICO AS es_critico
+    FROM TICKET
+    WHERE ID_TICKET > ? AND ES_CRITICO IS NOT NULL
+    ORDER BY ID_TICKET
+    LIMIT ?
+"""
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+_update_lock = threading.Lock()
+
+
+class OnlineLogistic:
+    """Scaler and linear classifier updated together; the scaler statistics also grow with partial_fit."""
+
+    def __init__(self):
+        self.scaler = StandardScaler()
+        self.clf = SGDClassifier(loss="log_loss", alpha=1e-4, random_state=0)
+
+    def partial_fit(self, x, y):
+        self.scaler.partial_fit(x)
+        self.clf.partial_fit(self.scaler.transform(x), y, classes=CLASSES)
+        return self
+
+    def predict(self, x):
+        return self.clf.predict(self.scaler.transform(x))
+
+    def predict_proba(self, x):
+        return self.clf.predict_proba(self.scaler.transform(x))
+
+
+class GrowingForest:
+    """Random forest that gains TREES_PER_UPDATE trees per batch, the existing trees are kept as they are."""
+
+    def __init__(self, trees_per_update=TREES_PER_UPDATE):
+        self.trees_per_update = trees_per_update
+        self.forest = None
+        # Tickets waiting until a batch has both classes (a tree fitted on one class only predicts that class)
+        self.pending_x = []
+        self.pending_y = []
+
+    def partial_fit(self, x, y):
+        self.pending_x.append(np.asarray(x))
+        self.pending_y.append(np.asarray(y))
+        y_all = np.concatenate(self.pending_y)
+        if len(np.unique(y_all)) < len(CLASSES):
+            return self
+        x_all = np.concatenate(self.pending_x)
+        self.pending_x, self.pending_y = [], []
+        if self.forest is None:
+            self.forest = RandomForestClassifier(n_estimators=self.trees_per_update, max_depth=8, warm_start=True,
+                                                 random_state=0)
+        else:
+            self.forest.n_estimators += self.trees_per_update
+        self.forest.fit(x_all, y_all)
+        return self
+
+    @property
+    def estimators_(self):
+        return self.forest.estimators_ if self.forest is not None else []
+
+    def predict(self, x):
+        if self.forest is None:
+            raise ValueError("The online forest has not seen both classes yet")
+        # Fitted on arrays (the batches are concatenated), so it predicts on arrays too
+        return self.forest.predict(np.asarray(x))
+
+    def predict_proba(self, x):
+        return self.forest.predict_proba(np.asarray(x))
+
+
+learners = {
+    "sgd": OnlineLogistic,
+    "forest_online": GrowingForest,
+}
+
+
+def snapshot_file(model_name, sequence, directory=None):
+    return (directory or snapshot_path) / f"{model_name}-{sequence:06d}.pkl"
+
+
+def snapshots(model_name, directory=None):
+    # Snapshot files of a model, oldest first
+    return sorted((directory or snapshot_path).glob(f"{model_name}-*.pkl"))
+
+
+def load_snapshot(path):
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+
+def latest(model_name, directory=None):
+    # Last snapshot, None if the model has never been updated
+    files = snapshots(model_name, directory)
+    if not files:
+        return None
+    path = files[-1]
+    stat = path.stat()
+    key = (str(path), stat.st_mtime_ns)
+    with _snapshots_lock:
+        cached = _snapshots.get(model_name)
+        if cached is None or cached[0] != key:
+            _snapshots[model_name] = cached = (key, load_snapshot(path))
+    return cached[1]
+
+
+def save_snapshot(entry, directory=None):
+    directory = directory or snapshot_path
+    directory.mkdir(parents=True, exist_ok=True)
+    target = snapshot_file(entry["name"], entry["sequence"], directory)
+    tmp = target.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as file:
+        pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, target)
+    # Only the last KEEP_SNAPSHOTS versions are kept (rollback of a bad update)
+    for old in snapshots(entry["name"], directory)[:-KEEP_SNAPSHOTS]:
+        old.unlink(missing_ok=True)
+    return target
+
+
+def new_tickets(con, watermark, batch_size=UPDATE_BATCH):
+    # (last ID_TICKET, features, labels) of the tickets above the watermark, batch_size at a time
+    while True:
+        frame = pd.read_sql_query(NEW_TICKETS_SQL, con, params=(watermark, batch_size))
+        if frame.empty:
+            return
+        watermark = int(frame["ID_TICKET"].iloc[-1])
+        frame = frame.dropna(subset=["cliente_id", "fecha_apertura", "fecha_cierre", "es_mantenimiento",
+                                     "tipo_incidencia"])
+        if not frame.empty:
+            yield watermark, to_matrix(frame)[FEATURES], frame["es_critico"].astype(int).to_numpy()
+        else:
+            yield watermark, None, None
+
+
+def update(model_name, con, batch_size=UPDATE_BATCH, directory=None):
+    # Updates the model with the tickets loaded since its last snapshot, returns the new entry
+    # (or the current one if there are no new tickets)
+    if model_name not in learners:
+        raise ValueError(f"Unknown online model: {model_name}")
+    with _update_lock:
+        entry = latest(model_name, directory)
+        # A copy: the snapshot in memory may be serving predictions while the update runs
+        learner = copy.deepcopy(entry["model"]) if entry else learners[model_name]()
+        watermark = entry["watermark"] if entry else 0
+        seen = entry["seen"] if entry else 0
+        start = time.perf_counter()
+        updated = False
+        for watermark, x, y in new_tickets(con, watermark, batch_size):
+            if x is not None:
+                learner.partial_fit(x, y)
+                seen += len(y)
+            updated = True
+        if not updated:
+            return entry
+        observe("app_model_seconds", time.perf_counter() - start, model=model_name, operation="partial_fit")
+        sequence = entry["sequence"] + 1 if entry else 1
+        entry = {
+            "name": model_name,
+            "sequence": sequence,
+            "version": f"online-{sequence}",
+            "hash": hashlib.sha256(f"{model_name}|{sequence}|{watermark}".encode()).hexdigest()[:16],
+            "watermark": watermark,
+            "seen": seen,
+            "model": learner,
+        }
+        save_snapshot(entry, directory)
+        return entry
+
+
+def update_all(con, batch_size=UPDATE_BATCH, directory=None):
+    # ETL hook: every online model learns the tickets of the last load
+    return {name: update(name, con, batch_size, directory) for name in learners}
@@ -1,46 +1,184 @@
-import pandas as pd
 import sqlite3
-import os
+import threading
+import time
+from datetime import date
+from src.database.database import get_read_db
+from src.staticWeb.cache import ResultCache, cached
+from src.staticWeb.metrics import stage
 
-database_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'database', 'data.db')
+# DataFrames of the dashboard queries, invalidated when the ETL commits new data (VERSION_DATOS)
+query_cache = ResultCache("queries")
+# Seconds between two reads of the data version
+VERSION_CHECK_INTERVAL = 1.0
+_version = {"value": None, "checked": 0.0}
+_version_lock = threading.Lock()
 
+# The rankings read the summary tables maintained by the ETL (src/etl/summaries.py), their cost
+# depends on the number of clients, incident types and employees, not on the number of tickets.
+TOP_CLIENTS_SQL = """
+        SELECT C.NOMBRE AS CLIENT, SUM(R.NUM_TICKETS) AS INCIDENT_COUNT
+        FROM RESUMEN_CLIENTE R
+        JOIN CLIENTE C ON R.CLIENTE_ID = C.ID_CLIENTE
+        GROUP BY C.NOMBRE
+        HAVING INCIDENT_COUNT > 0
+        ORDER BY INCIDENT_COUNT DESC
+        LIMIT ?
+        """
+
+TOP_INCIDENTS_SQL = """
+        SELECT I.NOMBRE AS INCIDENT_TYPE,
+        SUM(R.TIEMPO_TOTAL) / SUM(R.NUM_TIEMPO) AS AVG_RESOLUTION_TIME
+        FROM RESUMEN_INCIDENTE R
+        JOIN INCIDENTE I ON R.INCIDENCIA_ID = I.ID_INCIDENTE
+        GROUP BY I.NOMBRE
+        HAVING SUM(R.NUM_TICKETS) > 0
+        ORDER BY AVG_RESOLUTION_TIME DESC
+        LIMIT ?
+        """
 
-def query_to_dataframe(query):
-    con = sqlite3.connect(database_path)
-    df = pd.read_sql_query(query, con)
-    con.close()
-    return df
+TOP_EMPLOYEES_SQL = """
+         SELECT E.NOMBRE AS EMPLOYEE, SUM(R.TIEMPO_TOTAL) AS TOTAL_TIME
+         FROM RESUMEN_EMPLEADO R
+         JOIN EMPLEADO E ON R.EMPLEADO_ID = E.ID_EMPLEADO
+         GROUP BY E.NOMBRE
+         HAVING SUM(R.NUM_CONTACTOS) > 0
+         ORDER BY TOTAL_TIME DESC
+         LIMIT ?
+         """
 
 
-def top_clients_most_incidents(limit):
-    return query_to_dataframe(f"""
-        SELECT C.NOMBRE AS CLIENT, COUNT(*) AS INCIDENT_COUNT
-        FROM TICKET T
+def database_version():
+    # Version of the data, incremented by the ETL loaders on every commit
+    now = time.monotonic()
+    if now - _version["checked"] >= VERSION_CHECK_INTERVAL:
+        with _version_lock:
+            if now - _version["checked"] >= VERSION_CHECK_INTERVAL:
+                try:
+                    with get_read_db() as con:
+                        row = con.execute("SELECT VERSION FROM VERSION_DATOS").fetchone()
+                    _version["value"] = row[0] if row else 0
+                except sqlite3.OperationalError:
+                    _version["value"] = 0
+                _version["checked"] = now
+    return _version["value"]
+
+
+# Filtered rankings (date window, province, critical or maintenance tickets) aggregate TICKET with bound
+# parameters; {where} only receives the fixed clauses built by ticket_filters, never values.
+# The date indexes IDX_TICKET_FECHA, IDX_TICKET_CRITICO and IDX_TICKET_MANTENIMIENTO cover them.
+FILTERED_CLIENTS_SQL = """
+        SELECT C.NOMBRE AS CLIENT, SUM(T.NUM_TICKETS) AS INCIDENT_COUNT
+        FROM (SELECT T.CLIENTE_ID, COUNT(*) AS NUM_TICKETS
+              FROM TICKET T
+              WHERE {where}
+              GROUP BY T.CLIENTE_ID) T
         JOIN CLIENTE C ON T.CLIENTE_ID = C.ID_CLIENTE
         GROUP BY C.NOMBRE
         ORDER BY INCIDENT_COUNT DESC
-        LIMIT {limit}
-        """)
+        LIMIT ?
+        """
 
-
-def top_incidents_type_by_resolution_time(limit):
-    return query_to_dataframe(f"""
+FILTERED_INCIDENTS_SQL = """
         SELECT I.NOMBRE AS INCIDENT_TYPE,
-        AVG(JULIANDAY(T.FECHA_CIERRE) - JULIANDAY(T.FECHA_APERTURA)) AS AVG_RESOLUTION_TIME
-        FROM TICKET T
+        SUM(T.TIEMPO_TOTAL) / SUM(T.NUM_TIEMPO) AS AVG_RESOLUTION_TIME
+        FROM (SELECT T.INCIDENCIA_ID,
+                     TOTAL(julianday(T.FECHA_CIERRE) - julianday(T.FECHA_APERTURA)) AS TIEMPO_TOTAL,
+                     COUNT(julianday(T.FECHA_CIERRE) - julianday(T.FECHA_APERTURA)) AS NUM_TIEMPO
+              FROM TICKET T
+              WHERE {where}
+              GROUP BY T.INCIDENCIA_ID) T
         JOIN INCIDENTE I ON T.INCIDENCIA_ID = I.ID_INCIDENTE
         GROUP BY I.NOMBRE
+        HAVING SUM(T.NUM_TIEMPO) > 0
         ORDER BY AVG_RESOLUTION_TIME DESC
-        LIMIT {limit}
-        """)
-
+        LIMIT ?
+        """
 
-def top_employees_by_resolution_time(limit):
-    return query_to_dataframe(f"""
-         SELECT E.NOMBRE AS EMPLOYEE, SUM(C.TIEMPO) AS TOTAL_TIME
-         FROM CONTACTO C
-         JOIN EMPLEADO E ON C.EMPLEADO_ID = E.ID_EMPLEADO
+FILTERED_EMPLOYEES_SQL = """
+         SELECT E.NOMBRE AS EMPLOYEE, SUM(R.TIEMPO_TOTAL) AS TOTAL_TIME
+         FROM (SELECT CO.EMPLEADO_ID, TOTAL(CO.TIEMPO) AS TIEMPO_TOTAL
+               FROM TICKET T
+               JOIN CONTACTO CO ON CO.TICKET_ID = T.ID_TICKET
+               WHERE {where}
+               GROUP BY CO.EMPLEADO_ID) R
+         JOIN EMPLEADO E ON R.EMPLEADO_ID = E.ID_EMPLEADO
          GROUP BY E.NOMBRE
          ORDER BY TOTAL_TIME DESC
-         LIMIT {limit}
-         """)
+         LIMIT ?
+         """
+
+PROVINCES_SQL = "SELECT DISTINCT PROVINCIA FROM CLIENTE WHERE PROVINCIA IS NOT NULL ORDER BY PROVINCIA"
+
+
+def normalize_filters(date_from=None, date_to=None, province=None, critical_only=False, maintenance_only=False):
+    # Only the filters in use, with canonical values: equal filters give equal cache keys
+    filters = {}
+    if date_from:
+        filters["date_from"] = date.fromisoformat(str(date_from)).isoformat()
+    if date_to:
+        filters["date_to"] = date.fromisoformat(str(date_to)).isoformat()
+    if province:
+        filters["province"] = str(province).strip()
+    if critical_only:
+        filters["critical_only"] = True
+    if maintenance_only:
+        filters["maintenance_only"] = True
+    return filters
+
+
+def ticket_filters(filters):
+    # (WHERE clause over TICKET T, parameters)
+    clauses, params = [], []
+    if "date_from" in filters:
+        clauses.append("T.FECHA_APERTURA >= ?")
+        params.append(filters["date_from"])
+    if "date_to" in filters:
+        clauses.append("T.FECHA_APERTURA <= ?")
+        params.append(filters["date_to"])
+    # Literal 1, the partial indexes are only used when the query repeats their WHERE
+    if filters.get("critical_only"):
+        clauses.append("T.ES_CRITICO = 1")
+    if filters.get("maintenance_only"):
+        clauses.append("T.ES_MANTENIMIENTO = 1")
+    if "province" in filters:
+        clauses.append("T.CLIENTE_ID IN (SELECT ID_CLIENTE FROM CLIENTE WHERE PROVINCIA = ?)")
+        params.append(filters["province"])
+    return " AND ".join(clauses) or "1", params
+
+
+def ranking(summary_sql, filtered_sql, limit, filters):
+    # Without filters the summary tables answer, with filters the indexed ticket query
+    filters = normalize_filters(**filters)
+    if not filters:
+        return query_to_dataframe(summary_sql, (int(limit),))
+    where, params = ticket_filters(filters)
+    return query_to_dataframe(filtered_sql.format(where=where), (*params, int(limit)))
+
+
+def query_to_dataframe(query, params=()):
+    # pandas is imported on the first dashboard query, not when the app starts
+    import pandas as pd
+    with get_read_db() as con, stage("pandas"):
+        return pd.read_sql_query(query, con, params=params)
+
+
+# The filters are keyword arguments, so they are part of the cache key
+@cached(query_cache, database_version)
+def top_clients_most_incidents(limit, **filters):
+    return ranking(TOP_CLIENTS_SQL, FILTERED_CLIENTS_SQL, limit, filters)
+
+
+@cached(query_cache, database_version)
+def top_incidents_type_by_resolution_time(limit, **filters):
+    return ranking(TOP_INCIDENTS_SQL, FILTERED_INCIDENTS_SQL, limit, filters)
+
+
+@cached(query_cache, database_version)
+def top_employees_by_resolution_time(limit, **filters):
+    return ranking(TOP_EMPLOYEES_SQL, FILTERED_EMPLOYEES_SQL, limit, filters)
+
+
+@cached(query_cache, database_version)
+def provinces():
+    with get_read_db() as con:
+        return [row[0] for row in con.execute(PROVINCES_SQL)]
@@ -1,40 +1,69 @@
 import os
-import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
+from pathlib import Path
 from reportlab.lib.pagesizes import landscape, A4
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import numpy as np
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR,'..', '..', 'database', 'data.db')
+from matplotlib.figure import Figure
 
+from src.database.database import get_read_db
+from src.staticWeb.queries import database_version
 
-def fetch_client_metrics(top_n=10):
-   # Query para el top N de clientes: total incidencias, tiempo medio de resolución y satisfacción media.
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
+# Informes generados, uno por (top_n, versión de los datos)
+REPORT_DIR = Path(__file__).resolve().parent / "generated"
+REPORT_WORKERS = 2
+_report_pool = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+_reports = {}
+_reports_lock = threading.Lock()
+
+# Informe completo: filas leídas por bloque, alto de fila en puntos y bins de las gráficas agregadas
+FETCH_ROWS = 1000
+PAGE_ROW_HEIGHT = 14
+CHART_BINS = 40
+
+# Top N de clientes: total incidencias, tiempo medio de resolución y satisfacción media.
+# Se lee de la tabla resumen RESUMEN_CLIENTE que mantiene el ETL.
+CLIENT_METRICS_SQL = """
         SELECT c.ID_CLIENTE,
                c.NOMBRE,
-               COUNT(t.rowid) AS total_incidencias,
-               ROUND(AVG(julianday(t.FECHA_CIERRE) - julianday(t.FECHA_APERTURA)), 2) AS tiempo_medio_dias,
-               ROUND(AVG(t.SATISFACCION), 2) AS satisfaccion_media
-        FROM CLIENTE c
-        JOIN TICKET t ON c.ID_CLIENTE = t.CLIENTE_ID
-        GROUP BY c.ID_CLIENTE
+               r.NUM_TICKETS AS total_incidencias,
+               ROUND(r.TIEMPO_TOTAL / r.NUM_TIEMPO, 2) AS tiempo_medio_dias,
+               ROUND(r.SATISFACCION_TOTAL / r.NUM_SATISFACCION, 2) AS satisfaccion_media
+        FROM RESUMEN_CLIENTE r
+        JOIN CLIENTE c ON c.ID_CLIENTE = r.CLIENTE_ID
+        WHERE r.NUM_TICKETS > 0
         ORDER BY total_incidencias DESC
         LIMIT ?
-        """, (top_n,)
-    )
-    results = cursor.fetchall()
-    conn.close()
-    return results
+        """
+
+
+# Todos los clientes con incidencias, recorre el índice IDX_RESUMEN_CLIENTE_TICKETS
+ALL_CLIENT_METRICS_SQL = CLIENT_METRICS_SQL.replace("LIMIT ?", "")
+
+
+def fetch_client_metrics(top_n=10):
+    with get_read_db() as conn:
+        return conn.execute(CLIENT_METRICS_SQL, (top_n,)).fetchall()
+
+
+def chart_png(draw, figsize=(6, 3)):
+    # API orientada a objetos de matplotlib (Figure) en vez de pyplot: cada hilo usa su propia figura
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+    draw(ax)
+    fig.tight_layout()
+    buf = BytesIO()
+    fig.savefig(buf, format='PNG')
+    buf.seek(0)
+    return buf
 
 
 def generate_charts(metrics):
@@ -44,48 +73,32 @@ def generate_charts(metrics):
     times = [row[3] for row in metrics]
     sats = [row[4] for row in metrics]
 
-    buffers = []
-
     # 1) Incidencias por cliente
-    plt.figure(figsize=(6,3))
-    plt.bar(names, totals)
-    plt.title('Incidencias por Cliente')
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    buf1 = BytesIO()
-    plt.savefig(buf1, format='PNG')
-    buf1.seek(0)
-    buffers.append(buf1)
-    plt.close()
+    def incidencias(ax):
+        ax.bar(names, totals)
+        ax.set_title('Incidencias por Cliente')
+        ax.tick_params(axis='x', labelrotation=45)
+        for label in ax.get_xticklabels():
+            label.set_horizontalalignment('right')
 
     # 2) Tiempo medio de resolución
-    plt.figure(figsize=(6,3))
-    plt.bar(names, times)
-    plt.title('Tiempo Medio de Resolución (días)')
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    buf2 = BytesIO()
-    plt.savefig(buf2, format='PNG')
-    buf2.seek(0)
-    buffers.append(buf2)
-    plt.close()
+    def tiempos(ax):
+        ax.bar(names, times)
+        ax.set_title('Tiempo Medio de Resolución (días)')
+        ax.tick_params(axis='x', labelrotation=45)
+        for label in ax.get_xticklabels():
+            label.set_horizontalalignment('right')
 
     # 3) Scatter: Tiempo medio vs Satisfacción
-    plt.figure(figsize=(6,3))
-    plt.scatter(times, sats)
-    for i, name in enumerate(names):
-        plt.annotate(name, (times[i], sats[i]), textcoords="offset points", xytext=(0,5), ha='center')
-    plt.title('Tiempo Medio vs Satisfacción (clientes)')
-    plt.xlabel('Tiempo medio (días)')
-    plt.ylabel('Satisfacción media')
-    plt.tight_layout()
-    buf3 = BytesIO()
-    plt.savefig(buf3, format='PNG')
-    buf3.seek(0)
-    buffers.append(buf3)
-    plt.close()
+    def dispersion(ax):
+        ax.scatter(times, sats)
+        for i, name in enumerate(names):
+            ax.annotate(name, (times[i], sats[i]), textcoords="offset points", xytext=(0,5), ha='center')
+        ax.set_title('Tiempo Medio vs Satisfacción (clientes)')
+        ax.set_xlabel('Tiempo medio (días)')
+        ax.set_ylabel('Satisfacción media')
 
-    return buffers
+    return [chart_png(incidencias), chart_png(tiempos), chart_png(dispersion)]
 
 
 def generate_pdf_report(output_path, top_n=10):
@@ -124,3 +137,186 @@ def generate_pdf_report(output_path, top_n=10):
             elements.append(img)
             elements.append(Spacer(1, 12))
     doc.build(elements)
+
+
+def stream_client_metrics(conn, chunk_size=FETCH_ROWS):
+    # Todos los clientes, leídos del cursor por bloques para no cargarlos en memoria
+    cursor = conn.execute(ALL_CLIENT_METRICS_SQL)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def incident_histogram(conn, bins=CHART_BINS):
+    # Histograma de incidencias por cliente calculado en SQL: solo se leen `bins` filas
+    low, high = conn.execute("SELECT MIN(NUM_TICKETS), MAX(NUM_TICKETS) FROM RESUMEN_CLIENTE "
+                             "WHERE NUM_TICKETS > 0").fetchone()
+    if low is None:
+        return [], []
+    width = max(1.0, (high - low + 1) / bins)
+    rows = conn.execute("SELECT CAST((NUM_TICKETS - ?) / ? AS INT) AS b, COUNT(*) FROM RESUMEN_CLIENTE "
+                        "WHERE NUM_TICKETS > 0 GROUP BY b ORDER BY b", (low, width)).fetchall()
+    return [low + b * width for b, _ in rows], [count for _, count in rows]
+
+
+def time_satisfaction_grid(conn, bins=CHART_BINS):
+    # Tiempo medio vs satisfacción media agregados en una rejilla de bins x bins (en vez de un punto por cliente)
+    averages = ("(TIEMPO_TOTAL / NUM_TIEMPO)", "(SATISFACCION_TOTAL / NUM_SATISFACCION)")
+    where = "WHERE NUM_TICKETS > 0 AND NUM_TIEMPO > 0 AND NUM_SATISFACCION > 0"
+    limits = conn.execute(f"SELECT MIN{averages[0]}, MAX{averages[0]}, MIN{averages[1]}, MAX{averages[1]} "
+                          f"FROM RESUMEN_CLIENTE {where}").fetchone()
+    if limits[0] is None:
+        return None
+    x_low, x_high, y_low, y_high = limits
+    x_width = (x_high - x_low) / bins or 1.0
+    y_width = (y_high - y_low) / bins or 1.0
+    grid = np.zeros((bins, bins))
+    rows = conn.execute(f"SELECT MIN(CAST(({averages[0]} - ?) / ? AS INT), ?) AS celda_x, "
+                        f"MIN(CAST(({averages[1]} - ?) / ? AS INT), ?) AS celda_y, COUNT(*) "
+                        f"FROM RESUMEN_CLIENTE {where} GROUP BY celda_x, celda_y",
+                        (x_low, x_width, bins - 1, y_low, y_width, bins - 1))
+    for bx, by, count in rows:
+        grid[by, bx] = count
+    return grid, (x_low, x_low + x_width * bins, y_low, y_low + y_width * bins)
+
+
+def generate_full_charts(conn):
+    # Gráficas agregadas: su tamaño no depende del número de clientes
+    buffers = []
+    edges, counts = incident_histogram(conn)
+    if counts:
+        def histograma(ax):
+            ax.bar(edges, counts, width=(edges[1] - edges[0]) if len(edges) > 1 else 1, align='edge')
+            ax.set_title('Clientes por número de incidencias')
+            ax.set_xlabel('Incidencias')
+            ax.set_ylabel('Clientes')
+        buffers.append(chart_png(histograma))
+
+    grid = time_satisfaction_grid(conn)
+    if grid is not None:
+        values, extent = grid
+
+        def densidad(ax):
+            image = ax.imshow(np.ma.masked_equal(values, 0), origin='lower', extent=extent,
+                              aspect='auto', cmap='viridis')
+            ax.figure.colorbar(image, ax=ax, label='Clientes')
+            ax.set_title('Tiempo Medio vs Satisfacción (clientes)')
+            ax.set_xlabel('Tiempo medio (días)')
+            ax.set_ylabel('Satisfacción media')
+        buffers.append(chart_png(densidad))
+    return buffers
+
+
+def draw_table_page(pdf, rows, page, width, height):
+    # Una página de la tabla dibujada directamente en el canvas
+    columns = [(40, "Cliente"), (330, "Incidencias"), (470, "Tiempo Medio (días)"), (640, "Satisfacción Media")]
+    y = height - 50
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.setFillColor(colors.gray)
+    pdf.rect(35, y - 5, width - 70, PAGE_ROW_HEIGHT, fill=1, stroke=0)
+    pdf.setFillColor(colors.whitesmoke)
+    for x, title in columns:
+        pdf.drawString(x, y, title)
+    pdf.setFillColor(colors.black)
+    pdf.setFont("Helvetica", 9)
+    for _id, name, total, avg_time, avg_sat in rows:
+        y -= PAGE_ROW_HEIGHT
+        for (x, _), value in zip(columns, (name, total, avg_time, avg_sat)):
+            pdf.drawString(x, y, "" if value is None else str(value))
+        pdf.line(35, y - 4, width - 35, y - 4)
+    pdf.drawRightString(width - 40, 25, f"Página {page}")
+    pdf.showPage()
+
+
+def generate_full_report(output_path, conn=None):
+    # Informe de todos los clientes. Las filas se leen del cursor por bloques y se dibujan página a página,
+    # las gráficas son agregadas: la memoria no crece con el número de clientes (salvo el PDF comprimido).
+    if conn is None:
+        with get_read_db() as conn:
+            return generate_full_report(output_path, conn)
+    width, height = landscape(A4)
+    pdf = canvas.Canvas(output_path, pagesize=(width, height), pageCompression=1)
+    pdf.setTitle("Informe: Métricas de todos los clientes")
+    pdf.setFont("Helvetica-Bold", 18)
+    pdf.drawCentredString(width / 2, height - 50, "Informe: Métricas de todos los clientes")
+    charts = generate_full_charts(conn)
+    if not charts:
+        pdf.setFont("Helvetica", 11)
+        pdf.drawString(40, height - 90, "No hay datos disponibles.")
+    for i, buf in enumerate(charts):
+        pdf.drawImage(ImageReader(buf), 40 + i * 390, height - 300, width=380, height=190)
+    pdf.showPage()
+
+    rows_per_page = int((height - 90) // PAGE_ROW_HEIGHT)
+    page = []
+    pages = 1
+    for row in stream_client_metrics(conn):
+        page.append(row)
+        if len(page) == rows_per_page:
+            pages += 1
+            draw_table_page(pdf, page, pages, width, height)
+            page = []
+    if page:
+        draw_table_page(pdf, page, pages + 1, width, height)
+    pdf.save()
+
+
+def report_name(top_n):
+    # top_n=None es el informe completo (todos los clientes)
+    return "informe_completo" if top_n is None else f"informe_top{top_n}"
+
+
+def report_path(top_n, version):
+    return REPORT_DIR / f"{report_name(top_n)}_v{version}.pdf"
+
+
+def build_report(top_n, version):
+    # Se escribe en un fichero temporal y se renombra: nunca se sirve un PDF a medias
+    path = report_path(top_n, version)
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.stem}.{threading.get_ident()}.pdf")
+    if top_n is None:
+        generate_full_report(str(tmp))
+    else:
+        generate_pdf_report(str(tmp), top_n=top_n)
+    os.replace(tmp, path)
+    # Los informes de versiones anteriores ya no se van a servir
+    for old in REPORT_DIR.glob(f"{report_name(top_n)}_v*.pdf"):
+        if old != path:
+            old.unlink(missing_ok=True)
+    return path
+
+
+def reset_report_pool():
+    # Los hilos no sobreviven a un fork (servidor con varios workers): cada worker crea su pool
+    global _report_pool, _reports_lock
+    _report_pool = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+    _reports_lock = threading.Lock()
+    _reports.clear()
+
+
+os.register_at_fork(after_in_child=reset_report_pool)
+
+
+def request_report(top_n=10):
+    # Devuelve un future con la ruta del informe; si ya existe en disco está resuelto al momento.
+    # Peticiones iguales mientras se genera comparten el mismo trabajo.
+    version = database_version()
+    key = (top_n, version)
+    with _reports_lock:
+        future = _reports.get(key)
+        if future is not None and not (future.done() and future.exception() is not None):
+            return future
+        path = report_path(top_n, version)
+        if path.exists():
+            future = Future()
+            future.set_result(path)
+        else:
+            future = _report_pool.submit(build_report, top_n, version)
+        _reports[key] = future
+        # Solo se guardan los trabajos de la versión actual
+        for old in [k for k in _reports if k[1] != version]:
+            del _reports[old]
+    return future
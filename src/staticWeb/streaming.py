@@ -0,0 +1,442 @@
+# Live rankings of the dashboard from a stream of ticket and contact events (POST /stream/ingest with the
+# X-Stream-Token header set to STREAM_TOKEN),
+# without scanning TICKET: every event updates bounded in-memory structures.
+#   clients    tickets per client
+#   incidents  tickets per incident type
+#   employees  contact hours per employee
+# Each ranking is a Space-Saving summary (the heavy hitters, at most CAPACITY keys, ranked with a heap)
+# next to a Count-Min sketch (an upper bound for any key). Memory and query time depend on CAPACITY and
+# the sketch size, not on the number of events.
+# The state is checkpointed to SQLite (STREAM_SKETCH) every CHECKPOINT_INTERVAL seconds and at exit.
+# Every process only sends the events it received since its last checkpoint; the checkpoint merges them
+# into the stored state and the process continues from the merged state, so several workers (and
+# `python -m src.staticWeb.streaming --replay`) share the same rankings.
+import argparse
+import array
+import atexit
+import heapq
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from src.database.database import get_db, get_read_db
+
+CAPACITY = int(os.environ.get("STREAM_CAPACITY", 200))
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+CHECKPOINT_INTERVAL = float(os.environ.get("STREAM_CHECKPOINT_INTERVAL", 5))
+# Hash functions (a * key + b) mod PRIME mod width, the same in every process so checkpoints can be merged
+PRIME = (1 << 61) - 1
+HASH_SEED = 20250511
+# Ranking -> (table, id column) for the names
+ENTITIES = {
+    "clients": ("CLIENTE", "ID_CLIENTE"),
+    "incidents": ("INCIDENTE", "ID_INCIDENTE"),
+    "employees": ("EMPLEADO", "ID_EMPLEADO"),
+}
+REPLAY_SQL = {
+    "clients": "SELECT CLIENTE_ID, 1 FROM TICKET WHERE CLIENTE_ID IS NOT NULL",
+    "incidents": "SELECT INCIDENCIA_ID, 1 FROM TICKET WHERE INCIDENCIA_ID IS NOT NULL",
+    "employees": "SELECT EMPLEADO_ID, TIEMPO FROM CONTACTO WHERE EMPLEADO_ID IS NOT NULL AND TIEMPO > 0",
+}
+FETCH_ROWS = 10000
+
+logger = logging.getLogger(__name__)
+
+
+class CountMinSketch:
+    """depth rows of width counters. estimate(key) never underestimates; with probability 1 - e^-depth it
+    overestimates by at most e / width of the total weight."""
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [array.array("d", bytes(8 * width)) for _ in range(depth)]
+        rng = random.Random(HASH_SEED)
+        self.hashes = [(rng.randrange(1, PRIME), rng.randrange(PRIME)) for _ in range(depth)]
+        self.total = 0.0
+
+    def add(self, key, weight=1.0):
+        for row, (a, b) in zip(self.rows, self.hashes):
+            row[(a * key + b) % PRIME % self.width] += weight
+        self.total += weight
+
+    def estimate(self, key):
+        return min(row[(a * key + b) % PRIME % self.width] for row, (a, b) in zip(self.rows, self.hashes))
+
+    def merge(self, other):
+        for row, other_row in zip(self.rows, other.rows):
+            for i, value in enumerate(other_row):
+                if value:
+                    row[i] += value
+        self.total += other.total
+
+    def to_bytes(self):
+        return b"".join(row.tobytes() for row in self.rows)
+
+    def load_bytes(self, data, total):
+        size = 8 * self.width
+        for i, row in enumerate(self.rows):
+            row[:] = array.array("d", data[i * size:(i + 1) * size])
+        self.total = total
+
+
+class SpaceSaving:
+    """At most capacity counters; a new key replaces the smallest counter (count = smallest + weight,
+    error = smallest). Every key whose weight is above total / capacity is in the summary, and
+    count - error <= true weight <= count."""
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.counters = {}  # key -> [count, error]
+        # Min-heap of (count, key); entries whose count is no longer the current one are skipped
+        self.heap = []
+        self.total = 0.0
+
+    def add(self, key, weight=1.0):
+        self.total += weight
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            counter = self.counters[key] = [weight, 0.0]
+        else:
+            smallest, minimum = self.pop_min()
+            del self.counters[smallest]
+            counter = self.counters[key] = [minimum + weight, minimum]
+        heapq.heappush(self.heap, (counter[0], key))
+        if len(self.heap) > 4 * self.capacity:
+            self.rebuild_heap()
+
+    def pop_min(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                return key, count
+
+    def rebuild_heap(self):
+        self.heap = [(counter[0], key) for key, counter in self.counters.items()]
+        heapq.heapify(self.heap)
+
+    def min_count(self):
+        # Smallest count of a full summary, 0 while there is room (an absent key was never seen)
+        if len(self.counters) < self.capacity:
+            return 0.0
+        return min(counter[0] for counter in self.counters.values())
+
+    def top(self, k):
+        # [(key, count, error)] of the k largest counters
+        return [(key, count, error) for key, (count, error) in
+                heapq.nlargest(k, self.counters.items(), key=lambda item: item[1][0])]
+
+    def merge(self, other):
+        # Counts and errors are added, the capacity largest are kept (mergeable summaries). A key missing
+        # from a full summary may have up to its smallest count there: that is added to count and error
+        self_min, other_min = self.min_count(), other.min_count()
+        counters = {}
+        for key in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(key, (self_min, self_min))
+            other_count, other_error = other.counters.get(key, (other_min, other_min))
+            counters[key] = [count + other_count, error + other_error]
+        self.counters = dict(heapq.nlargest(self.capacity, counters.items(), key=lambda item: item[1][0]))
+        self.total += other.total
+        self.rebuild_heap()
+
+
+class HeavyHitters:
+    """Space-Saving summary for the ranking and Count-Min sketch for the estimate of any key."""
+
+    def __init__(self, capacity=CAPACITY, width=CMS_WIDTH, depth=CMS_DEPTH):
+        self.summary = SpaceSaving(capacity)
+        self.sketch = CountMinSketch(width, depth)
+        self.events = 0
+
+    def add(self, key, weight=1.0):
+        self.summary.add(key, weight)
+        self.sketch.add(key, weight)
+        self.events += 1
+
+    def estimate(self, key):
+        return self.sketch.estimate(key)
+
+    def top(self, k):
+        # Both structures only overestimate, the smaller upper bound is the estimate
+        rows = [{"key": key, "value": min(count, self.sketch.estimate(key)), "lower": count - error}
+                for key, count, error in self.summary.top(k)]
+        rows.sort(key=lambda row: -row["value"])
+        return rows
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+        self.sketch.merge(other.sketch)
+        self.events += other.events
+
+
+def new_streams():
+    return {name: HeavyHitters() for name in ENTITIES}
+
+
+# State of this process: the view answers the rankings, pending holds the events not checkpointed yet
+_state = {"pid": None, "view": None, "pending": None}
+_lock = threading.Lock()
+_checkpointer = {"pid": None, "thread": None}
+_checkpointer_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def reset_after_fork():
+    # A lock held by another thread at fork time would never be released in the child
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def _streams():
+    # Loaded from the last checkpoint on first use in every process (a forked worker loads its own)
+    if _state["pid"] != os.getpid():
+        _state.update(pid=os.getpid(), view=load(), pending=new_streams())
+    return _state["view"], _state["pending"]
+
+
+def parse_ticket(ticket):
+    # (client, incident type, [(employee, hours)]) of a ticket in the format of the source JSON
+    try:
+        client = int(ticket["cliente"])
+        incident = int(ticket["tipo_incidencia"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid ticket, cliente and tipo_incidencia are required: {ticket!r}")
+    return client, incident, [parse_contact(contact) for contact in ticket.get("contactos_con_empleados") or []]
+
+
+def parse_contact(contact):
+    try:
+        employee, hours = int(contact["id_emp"]), float(contact.get("tiempo") or 0)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid contact, id_emp and tiempo are required: {contact!r}")
+    if hours < 0:
+        raise ValueError(f"Negative contact time: {contact!r}")
+    return employee, hours
+
+
+def ingest(tickets=(), contacts=()):
+    # New tickets (with their contacts) and contacts of already known tickets.
+    # Everything is validated before the first update, a bad event rejects the whole request
+    tickets = [parse_ticket(ticket) for ticket in tickets]
+    contacts = [parse_contact(contact) for contact in contacts]
+    for _, _, ticket_contacts in tickets:
+        contacts.extend(ticket_contacts)
+    with _lock:
+        for streams in _streams():
+            for client, incident, _ in tickets:
+                streams["clients"].add(client)
+                streams["incidents"].add(incident)
+            for employee, hours in contacts:
+                if hours:
+                    streams["employees"].add(employee, hours)
+    return len(tickets), len(contacts)
+
+
+def top(name, k):
+    # Live ranking with the names of the entities: [{"key", "name", "value", "lower"}]
+    with _lock:
+        rows = _streams()[0][name].top(k)
+    if rows:
+        table, column = ENTITIES[name]
+        keys = [row["key"] for row in rows]
+        try:
+            with get_read_db() as db:
+                names = dict(db.execute(f"SELECT {column}, NOMBRE FROM {table} "
+                                        f"WHERE {column} IN ({','.join('?' * len(keys))})", keys))
+        except sqlite3.Error:
+            names = {}
+        for row in rows:
+            row["name"] = names.get(row["key"], str(row["key"]))
+    return rows
+
+
+def rankings(k):
+    return {name: top(name, k) for name in ENTITIES}
+
+
+def stats():
+    with _lock:
+        view, pending = _streams()
+        return {name: {"events": view[name].events, "total": view[name].summary.total,
+                       "counters": len(view[name].summary.counters), "pending": pending[name].events}
+                for name in ENTITIES}
+
+
+# --- checkpoints ---
+
+def init_table(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS STREAM_SKETCH (
+            NOMBRE      TEXT PRIMARY KEY,
+            CAPACIDAD   INT,
+            ANCHO       INT,
+            PROFUNDIDAD INT,
+            EVENTOS     INT,
+            TOTAL       FLOAT,
+            CONTADORES  TEXT,
+            SKETCH      BLOB,
+            ACTUALIZADO TIMESTAMP
+        )""")
+
+
+def read_checkpoint(db):
+    streams = new_streams()
+    try:
+        rows = db.execute("SELECT NOMBRE, CAPACIDAD, ANCHO, PROFUNDIDAD, EVENTOS, TOTAL, CONTADORES, SKETCH "
+                          "FROM STREAM_SKETCH").fetchall()
+    except sqlite3.OperationalError:
+        # No checkpoint yet
+        return streams
+    for name, capacity, width, depth, events, total, counters, sketch in rows:
+        stream = streams.get(name)
+        if stream is None or (capacity, width, depth) != (stream.summary.capacity, CMS_WIDTH, CMS_DEPTH):
+            logger.warning("Checkpoint of %s has another configuration, starting it empty", name)
+            continue
+        stream.events = events
+        stream.summary.total = total
+        stream.summary.counters = {key: [count, error] for key, count, error in json.loads(counters)}
+        stream.summary.rebuild_heap()
+        stream.sketch.load_bytes(sketch, total)
+    return streams
+
+
+def write_checkpoint(db, streams):
+    db.executemany(
+        "INSERT OR REPLACE INTO STREAM_SKETCH (NOMBRE, CAPACIDAD, ANCHO, PROFUNDIDAD, EVENTOS, TOTAL, "
+        "CONTADORES, SKETCH, ACTUALIZADO) VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+        [(name, stream.summary.capacity, stream.sketch.width, stream.sketch.depth, stream.events,
+          stream.summary.total,
+          json.dumps([[key, count, error] for key, (count, error) in stream.summary.counters.items()]),
+          stream.sketch.to_bytes())
+         for name, stream in streams.items()])
+
+
+def load():
+    with get_read_db() as db:
+        return read_checkpoint(db)
+
+
+def publish(pending, replace=False):
+    # Merges the events of pending into the stored state (or replaces it) in one write transaction,
+    # returns the new stored state
+    with get_db() as db:
+        init_table(db)
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if replace:
+                stored = pending
+            else:
+                stored = read_checkpoint(db)
+                for name, stream in pending.items():
+                    stored[name].merge(stream)
+            write_checkpoint(db, stored)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+    return stored
+
+
+def checkpoint():
+    # Sends the pending events and continues from the merged state of every process
+    with _lock:
+        _streams()
+        pending = _state["pending"]
+        _state["pending"] = new_streams()
+    try:
+        if any(stream.events for stream in pending.values()):
+            stored = publish(pending)
+        else:
+            stored = load()
+    except Exception:
+        # Not lost: sent with the next checkpoint
+        with _lock:
+            for name, stream in _state["pending"].items():
+                pending[name].merge(stream)
+            _state["pending"] = pending
+        raise
+    with _lock:
+        # Events received while the checkpoint was written are still in pending and in the old view
+        for name, stream in _state["pending"].items():
+            stored[name].merge(stream)
+        _state["view"] = stored
+    return stored
+
+
+def checkpoint_loop(interval):
+    while not _stop.wait(interval):
+        try:
+            checkpoint()
+        except Exception as e:
+            logger.warning("Streaming checkpoint failed (%s), retrying in %s s", e, interval)
+
+
+def final_checkpoint():
+    if _state["pid"] == os.getpid() and any(stream.events for stream in _state["pending"].values()):
+        try:
+            checkpoint()
+        except Exception as e:
+            logger.warning("Final streaming checkpoint failed (%s)", e)
+
+
+def start_checkpointer(interval=CHECKPOINT_INTERVAL):
+    # One checkpoint thread per process, started by the entry points (src/main.py, the post_fork hook of
+    # src/serve.py), not on import: a preloaded gunicorn master must not run one
+    with _checkpointer_lock:
+        if _checkpointer["pid"] == os.getpid() and _checkpointer["thread"].is_alive():
+            return _checkpointer["thread"]
+        thread = threading.Thread(target=checkpoint_loop, args=(interval,), name="stream-checkpoint", daemon=True)
+        thread.start()
+        _checkpointer.update(pid=os.getpid(), thread=thread)
+        return thread
+
+
+atexit.register(final_checkpoint)
+
+
+def replay(con, fetch_rows=FETCH_ROWS):
+    # Streams built from the tickets and contacts already in the database (initial state)
+    streams = new_streams()
+    for name, sql in REPLAY_SQL.items():
+        cursor = con.execute(sql)
+        while True:
+            rows = cursor.fetchmany(fetch_rows)
+            if not rows:
+                break
+            add = streams[name].add
+            for key, weight in rows:
+                add(int(key), float(weight))
+    return streams
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Initial state of the live rankings from the database")
+    parser.add_argument("--replay", action="store_true", help="replace the checkpoint with TICKET and CONTACTO")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+    if args.replay:
+        start = time.perf_counter()
+        with get_read_db() as con:
+            streams = replay(con)
+        publish(streams, replace=True)
+        events = sum(stream.events for stream in streams.values())
+        print(f"Replayed {events} events in {time.perf_counter() - start:.2f} s")
+    for name, rows in rankings(args.top).items():
+        print(f"\n{name}")
+        for row in rows:
+            print(f"  {row['name']:<30}{row['value']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
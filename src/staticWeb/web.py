@@ -1,19 +1,92 @@
-from flask import Flask, request, render_template, send_file
-from sphinx.util import requests
-from src.staticWeb.reports.pdf_reports import generate_pdf_report
+import functools
+import importlib
+import itertools
+import os
+import secrets
+import threading
+from concurrent.futures import TimeoutError
+from pathlib import Path
+from flask import Flask, request, render_template, send_file, Response, stream_with_context
 from flask_login import login_required
 from src.staticWeb.auth import auth_bp, login_manager
-from src.staticWeb.queries import *
-from src.staticWeb.model import *
-from datetime import datetime
+from src.database.database import ensure_db
+from src.staticWeb.cache import ResultCache, all_stats
+from src.staticWeb import cve
+from src.staticWeb import streaming
+from src.staticWeb import metrics
+from src.staticWeb.metrics import stage
+from src.staticWeb.queries import (database_version, normalize_filters, provinces, top_clients_most_incidents,
+                                   top_incidents_type_by_resolution_time, top_employees_by_resolution_time)
+
+# pandas, scikit-learn, matplotlib, graphviz and ReportLab are imported by the routes that use them
+# (model.py, reports/pdf_reports.py, first dashboard query), so the app starts without them.
+# With WARMUP=1 they are imported in a background thread right after startup instead.
+WARMUP_MODULES = ["pandas", "src.staticWeb.model", "src.staticWeb.reports.pdf_reports"]
+# Generated once and kept out of the repository when SECRET_KEY is not set
+SECRET_KEY_FILE = Path(__file__).resolve().parent / ".secret_key"
+
+
+def secret_key():
+    # Every worker must use the same key, otherwise a session cookie is only valid in one process
+    key = os.environ.get("SECRET_KEY")
+    if key:
+        return key
+    try:
+        return SECRET_KEY_FILE.read_text().strip()
+    except FileNotFoundError:
+        pass
+    key = secrets.token_hex(32)
+    try:
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Created by another process in the meantime
+        return SECRET_KEY_FILE.read_text().strip()
+    with os.fdopen(fd, "w") as file:
+        file.write(key)
+    return key
 
 
 app = Flask(__name__)
-app.secret_key = 'SECRET_KEY'
+app.secret_key = secret_key()
 
 login_manager.init_app(app)
+# Request, stage, SQL and model timings (see /metrics)
+metrics.init_app(app)
 app.register_blueprint(auth_bp)
 
+# Schema (USUARIO) and WAL mode once at startup instead of on every connection
+ensure_db()
+
+
+def warm_up(modules=WARMUP_MODULES):
+    def load():
+        for name in modules:
+            importlib.import_module(name)
+    thread = threading.Thread(target=load, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+if os.environ.get("WARMUP"):
+    warm_up()
+
+# HTML tables of the dashboard, same invalidation as the query results
+html_cache = ResultCache("html")
+
+# Seconds a request waits for a PDF report before answering 202 (the job keeps running)
+REPORT_WAIT = 10
+
+
+def render_table(frame):
+    with stage("to_html"):
+        return frame.to_html(classes='table table-bordered')
+
+
+def table_html(query, limit, filters):
+    return html_cache.get_or_set((query.__name__, limit, tuple(sorted(filters.items()))),
+                                 lambda: render_table(query(limit, **filters)),
+                                 database_version())
+
 
 @app.route('/', methods=['GET', 'POST'])
 @login_required
@@ -22,138 +95,208 @@ def index():
     top_x_incidents = 0
     top_x_employees = 0
     show_employees_times = False
-    top_employees_df = None
+    top_employees_html = None
+    filters = {}
     if request.method == 'POST':
         top_x_clientes = int(request.form['top_x_clientes'])
         top_x_incidents = int(request.form['top_x_incidents'])
         top_x_employees = int(request.form['top_x_employees'])
         show_employees_times = 'show_employees_times' in request.form
+        # Optional filters of the rankings, values are bound as SQL parameters
+        try:
+            filters = normalize_filters(date_from=request.form.get('date_from'),
+                                        date_to=request.form.get('date_to'),
+                                        province=request.form.get('province'),
+                                        critical_only='critical_only' in request.form,
+                                        maintenance_only='maintenance_only' in request.form)
+        except ValueError:
+            return "Fecha no válida, use el formato AAAA-MM-DD", 400
 
-    top_clients_most_incidents_df = top_clients_most_incidents(top_x_clientes)
-    top_incidents_type_by_resolution_time_df = top_incidents_type_by_resolution_time(top_x_incidents)
+    top_clients_html = table_html(top_clients_most_incidents, top_x_clientes, filters)
+    top_incidents_html = table_html(top_incidents_type_by_resolution_time, top_x_incidents, filters)
 
     if show_employees_times:
-        top_employees_df = top_employees_by_resolution_time(top_x_employees)
+        top_employees_html = table_html(top_employees_by_resolution_time, top_x_employees, filters)
 
     return render_template("index.html",
-                           top_clients_most_incidents=top_clients_most_incidents_df.to_html(
-                               classes='table table-bordered'),
-                           top_incidents_type_by_resolution_time=top_incidents_type_by_resolution_time_df.to_html(
-                               classes='table table-bordered'),
-                           top_employees_by_time=top_employees_df.to_html(
-                               classes='table table-bordered') if top_employees_df is not None else None)
-
-
-def get_cve():
-    url = "https://cve.circl.lu/api/last"
-    response = requests.get(url)
-    data = response.json()
-
-    vulnerabilities = []
-
-    for item in data:
-        if len(vulnerabilities) >= 10:
-            break
-        if "vulnerabilities" in item:
-            for vul in item["vulnerabilities"]:
-                cve_id = vul.get("cve", "Sin ID")
-                fecha = vul.get("discovery_date", "Sin fecha")
-                cwe_id = vul.get("cwe", {}).get("id", "Sin CWE")
-                cwe_nombre = vul.get("cwe", {}).get("name", "")
-                descripcion = next(
-                    (note.get("text") for note in vul.get("notes", []) if note.get("category") == "description"),
-                    "Sin descripción"
-                )
-                attack_complexity = (
-                    vul.get("scores", [{}])[0]
-                    .get("cvss_v3", {})
-                    .get("attackComplexity", "Sin severidad")
-                )
-                vulnerabilities.append({
-                    "id": cve_id,
-                    "fecha": fecha,
-                    "descripcion": descripcion,
-                    "cwe": f"{cwe_id} {cwe_nombre}",
-                    "severidad": attack_complexity
-                })
-
-        elif "cveMetadata" in item and "containers" in item:
-            cve_id = item.get("cveMetadata", {}).get("cveId", "Sin ID")
-            fecha = item.get("cveMetadata", {}).get("datePublished", "Sin fecha")
-            descripcion = next(
-                (desc.get("value") for desc in item.get("containers", {}).get("cna", {}).get("descriptions", [])
-                 if desc.get("lang") == "en"),
-                "Sin descripción"
-            )
-            cwe_id = "Sin CWE"
-            cwe_nombre = ""
-            for pt in item.get("containers", {}).get("cna", {}).get("problemTypes", []):
-                for desc in pt.get("descriptions", []):
-                    if desc.get("lang") == "en":
-                        cwe_id = desc.get("cweId", "Sin CWE")
-                        cwe_nombre = desc.get("description", "Sin CWE-descripcion")
-                        break
-            severidad = next(
-                (
-                    m.get("cvssV3_1", {}).get("attackComplexity")
-                    for m in item.get("containers", {}).get("cna", {}).get("metrics", [])
-                    if "cvssV3_1" in m
-                ),
-                "Sin severidad"
-            )
-            vulnerabilities.append({
-                "id": cve_id,
-                "fecha": fecha,
-                "descripcion": descripcion,
-                "cwe": f"{cwe_id} {cwe_nombre}",
-                "severidad": severidad
-            })
-
-    return vulnerabilities
+                           top_x_clientes=top_x_clientes,
+                           top_x_incidents=top_x_incidents,
+                           top_x_employees=top_x_employees,
+                           show_employees_times=show_employees_times,
+                           filters=filters,
+                           provinces=provinces(),
+                           top_clients_most_incidents=top_clients_html,
+                           top_incidents_type_by_resolution_time=top_incidents_html,
+                           top_employees_by_time=top_employees_html)
+
+
+@app.route("/cache/stats")
+@login_required
+def cache_stats():
+    # Hits, misses and size of the result caches, for monitoring
+    return all_stats()
+
+
+def metrics_access(view):
+    # Scrapers send "Authorization: Bearer <METRICS_TOKEN>", browsers need a logged-in user
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = os.environ.get("METRICS_TOKEN")
+        if token and secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return view(*args, **kwargs)
+        return login_required(view)(*args, **kwargs)
+    return wrapper
+
+
+@app.route("/metrics")
+@metrics_access
+def prometheus_metrics():
+    # Prometheus text format: request, stage, SQL and model duration histograms
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/metrics/profile")
+@metrics_access
+def profile():
+    # Folded stacks of the sampling profiler (PROFILE_SAMPLING=1), input of flamegraph.pl / speedscope.
+    # Only the process that answers: under gunicorn every worker also writes its own profile.<pid>.folded
+    profiler = metrics.profiler()
+    if profiler is None:
+        return Response("Profiler disabled, start the app with PROFILE_SAMPLING=1\n", status=404,
+                        mimetype="text/plain")
+    return Response(profiler.folded(), mimetype="text/plain")
 
 
 @app.route("/last_vulnerabilities")
 @login_required
 def last_vulnerabilities():
-    cves = get_cve()
+    # Served from the local copy kept up to date by the background refresher
+    cves = cve.latest()
     return render_template("last_vulnerabilities.html", cves=cves)
 
 
+@app.route("/stream/ingest", methods=["POST"])
+def stream_ingest():
+    # Body: JSON list of tickets (format of the source JSON, with contactos_con_empleados) or
+    # {"tickets": [...], "contactos": [...]}. The X-Stream-Token header must match STREAM_TOKEN;
+    # without STREAM_TOKEN the endpoint is disabled
+    token = os.environ.get("STREAM_TOKEN")
+    if not token:
+        return {"error": "Stream ingestion disabled, set STREAM_TOKEN"}, 503
+    if not secrets.compare_digest(request.headers.get("X-Stream-Token", ""), token):
+        return {"error": "Invalid stream token"}, 403
+    body = request.get_json(silent=True)
+    if isinstance(body, list):
+        body = {"tickets": body}
+    if not isinstance(body, dict):
+        return {"error": "Expected a JSON list of tickets or an object with tickets and contactos"}, 400
+    try:
+        tickets, contacts = streaming.ingest(body.get("tickets") or body.get("tickets_emitidos") or [],
+                                             body.get("contactos") or [])
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return {"tickets": tickets, "contactos": contacts}
+
+
+@app.route("/stream/rankings")
+@login_required
+def live_rankings():
+    # Rankings of the ingested events, read from the in-memory summaries (no query over TICKET)
+    top_n = max(1, min(request.args.get("top_n", 10, type=int), 100))
+    rankings = streaming.rankings(top_n)
+    if request.args.get("format") == "json":
+        return {"rankings": rankings, "stats": streaming.stats()}
+    return render_template("stream.html", rankings=rankings, stats=streaming.stats(), top_n=top_n)
+
+
 @app.route('/report/pdf')
 @login_required
 def report_pdf():
-    from io import BytesIO
-    buf = BytesIO()
-    generate_pdf_report(buf, top_n=5)
-    buf.seek(0)
-    return send_file(
-        buf,
-        mimetype='application/pdf',
-        # attachment_filename='reporte.pdf',
-        as_attachment=False
-    )
+    # The report is generated by the job pool and cached on disk per (top_n, data version)
+    from src.staticWeb.reports.pdf_reports import request_report
+    # Bounded: every value is a separate report job and file on disk
+    top_n = max(1, min(request.args.get("top_n", 5, type=int), 100))
+    if request.args.get("all"):
+        # Full report: every client, paginated tables and aggregated charts
+        top_n = None
+    future = request_report(top_n)
+    try:
+        path = future.result(timeout=REPORT_WAIT)
+    except TimeoutError:
+        # Still being generated: the browser retries, the job is shared between requests
+        response = Response("El informe se está generando, la página se recargará automáticamente.",
+                            status=202, mimetype="text/plain")
+        response.headers["Retry-After"] = "2"
+        response.headers["Refresh"] = "2"
+        return response
+    return send_file(path, mimetype='application/pdf', as_attachment=False, conditional=True)
 
 
 @app.route("/classify", methods=["GET", "POST"])
 def classify():
+    from src.staticWeb.model import predict_model
     result = None
     graphic = None
     graphics = None
+    pending = False
     if request.method == "POST":
-        fecha_apertura = request.form.get("fecha_apertura")
-        fecha_cierre = request.form.get("fecha_cierre")
-        fecha_apertura = int(datetime.strptime(fecha_apertura, "%Y-%m-%d").strftime("%Y%m%d"))
-        fecha_cierre = int(datetime.strptime(fecha_cierre, "%Y-%m-%d").strftime("%Y%m%d"))
+        # Dates are converted to timestamps by the model, the same way as the training data
         data = {
             "cliente": int(request.form["cliente"]),
-            "fecha_apertura": fecha_apertura,
-            "fecha_cierre": fecha_cierre,
+            "fecha_apertura": request.form["fecha_apertura"],
+            "fecha_cierre": request.form["fecha_cierre"],
             "es_mantenimiento": int(request.form["es_mantenimiento"]),
             "tipo_incidencia": int(request.form["tipo_incidencia"])
         }
 
         model = request.form["model"]
-        prediction, graphic, graphics = predict_model(model, data)
+        prediction, graphic, graphics, pending = predict_model(model, data)
         result = "CRÍTICO" if prediction == 1 else "NO CRÍTICO"
 
-    return render_template("classify.html", result=result, graphic=graphic, graphics=graphics)
+    return render_template("classify.html", result=result, graphic=graphic, graphics=graphics, pending=pending)
+
+
+@app.route("/classify/batch", methods=["POST"])
+def classify_batch_route():
+    # Body: JSON array of tickets, NDJSON (one ticket per line, application/x-ndjson) or CSV (raw body or
+    # "file" upload). Response: CSV row,prediction
+    from src.staticWeb.model import BATCH_SIZE, classify_batch
+    model = request.args.get("model", "forest")
+    # Bounded like top_n: memory grows with the batch, 0 would never flush an NDJSON batch
+    batch_size = max(1, min(request.args.get("batch_size", BATCH_SIZE, type=int), 100_000))
+    if request.is_json:
+        source, input_format = request.get_json(silent=True), "json"
+        if not isinstance(source, list):
+            return {"error": "A JSON array of tickets is expected"}, 400
+    elif request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        # Read line by line, large inputs are not held in memory
+        source, input_format = request.stream, "ndjson"
+    else:
+        source, input_format = request.files.get("file", request.stream), "csv"
+
+    batches = classify_batch(model, source, input_format, batch_size)
+    try:
+        if input_format == "json":
+            # The array is already in memory: every batch is scored before answering, any error is a 400
+            batches = iter(list(batches))
+        # The first batch is validated before answering so errors can still return a 400
+        first = next(batches, None)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    def generate():
+        yield "row,prediction\n"
+        if first is None:
+            return
+        try:
+            for start, predictions in itertools.chain([first], batches):
+                yield "".join(f"{start + i},{int(p)}\n" for i, p in enumerate(predictions))
+        except ValueError as e:
+            # The 200 is already sent: a later invalid batch ends the CSV with an explicit error row
+            message = str(e).replace('"', '""')
+            yield f'error,"{message}"\n'
+        except Exception:
+            app.logger.exception("Batch classification failed")
+            yield 'error,"Internal error, the predictions above are incomplete"\n'
+
+    return Response(stream_with_context(generate()), mimetype="text/csv")
@@ -0,0 +1,91 @@
+# Compiled inference (src/staticWeb/compiled.py) against sklearn on tiny models fitted on synthetic data:
+# predictions and probabilities must be identical, bit for bit.
+# Usage (from the repository root):
+#   python -m pytest -q tests
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LinearRegression
+from sklearn.tree import DecisionTreeClassifier
+
+from src.staticWeb.compiled import compile_model
+
+
+def synthetic(n_rows=300, n_features=6, n_classes=2, seed=0):
+    # Float64 values that are not exact in float32, labels from a threshold on two features plus noise
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(n_rows, n_features)) * 1000 + rng.random(size=(n_rows, n_features)) / 3
+    score = x[:, 0] + 0.5 * x[:, 1] + rng.normal(scale=300, size=n_rows)
+    y = np.digitize(score, np.quantile(score, np.linspace(0, 1, n_classes + 1)[1:-1]))
+    return x, y
+
+
+def check(clf, x):
+    compiled = compile_model(clf)
+    np.testing.assert_array_equal(compiled.predict(x), clf.predict(x))
+    np.testing.assert_array_equal(compiled.predict_proba(x), clf.predict_proba(x))
+    assert [compiled.predict_row(row) for row in x] == clf.predict(x).tolist()
+    np.testing.assert_array_equal(np.array([compiled.predict_proba_row(row) for row in x]), clf.predict_proba(x))
+    return compiled
+
+
+@pytest.mark.parametrize("n_classes", [2, 3])
+def test_tree(n_classes):
+    x, y = synthetic(n_classes=n_classes)
+    clf = DecisionTreeClassifier(max_depth=6, random_state=0).fit(x, y)
+    x_test, _ = synthetic(n_classes=n_classes, seed=1)
+    compiled = check(clf, x_test)
+    assert compiled.node_count == clf.tree_.node_count
+    assert compiled.depth == clf.get_depth()
+
+
+@pytest.mark.parametrize("n_classes", [2, 3])
+def test_forest(n_classes):
+    x, y = synthetic(n_classes=n_classes)
+    clf = RandomForestClassifier(n_estimators=7, max_depth=5, random_state=0).fit(x, y)
+    x_test, _ = synthetic(n_classes=n_classes, seed=1)
+    check(clf, x_test)
+
+
+def test_string_classes():
+    x, y = synthetic()
+    labels = np.array(["no", "si"])[y]
+    x_test, _ = synthetic(seed=1)
+    check(DecisionTreeClassifier(max_depth=4, random_state=0).fit(x, labels), x_test)
+    check(RandomForestClassifier(n_estimators=3, max_depth=4, random_state=0).fit(x, labels), x_test)
+
+
+def test_ties_take_the_first_class():
+    # Identical rows with different labels: the leaves hold as many samples of each class
+    x = np.repeat([[0.0, 1.0], [2.0, 3.0]], 2, axis=0)
+    y = np.array([0, 1, 1, 0])
+    tree = DecisionTreeClassifier(random_state=0).fit(x, y)
+    forest = RandomForestClassifier(n_estimators=4, bootstrap=False, random_state=0).fit(x, y)
+    for clf in (tree, forest):
+        compiled = check(clf, x)
+        assert compiled.predict_proba_row(x[0]) == [0.5, 0.5]
+        assert compiled.predict_row(x[0]) == 0
+
+
+def test_one_class():
+    x, _ = synthetic(n_rows=50)
+    y = np.ones(len(x), dtype=int)
+    for clf in (DecisionTreeClassifier().fit(x, y), RandomForestClassifier(n_estimators=3, random_state=0).fit(x, y)):
+        compiled = check(clf, x)
+        assert compiled.depth == 0
+        assert compiled.predict_proba(x).shape == (len(x), 1)
+        assert compiled.predict_row(x[0]) == 1
+
+
+def test_batches_of_different_sizes_reuse_the_workspace():
+    x, y = synthetic()
+    clf = RandomForestClassifier(n_estimators=5, max_depth=5, random_state=0).fit(x, y)
+    compiled = compile_model(clf)
+    for size in (len(x), 1, 17, len(x)):
+        np.testing.assert_array_equal(compiled.predict_proba(x[:size]), clf.predict_proba(x[:size]))
+    np.testing.assert_array_equal(compiled.predict(x[:0]), clf.predict(x[:1])[:0])
+
+
+def test_other_models_are_not_compiled():
+    x, y = synthetic()
+    assert compile_model(LinearRegression().fit(x, y)) is None
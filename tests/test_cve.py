@@ -0,0 +1,134 @@
+# CVE feed (src/staticWeb/cve.py) against a stub server on localhost and a temporary database.
+# Usage (from the repository root):
+#   python -m pytest -q tests
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.database import database
+from src.staticWeb import cve
+
+CSAF = [{
+    "vulnerabilities": [{
+        "cve": "CVE-2024-0001",
+        "discovery_date": "2024-01-02",
+        "cwe": {"id": "CWE-79", "name": "Cross-site Scripting"},
+        "notes": [{"category": "summary", "text": "Resumen"},
+                  {"category": "description", "text": "XSS in the search form"}],
+        "scores": [{"cvss_v3": {"attackComplexity": "LOW"}}],
+    }],
+}]
+
+CVE_RECORD = [{
+    "cveMetadata": {"cveId": "CVE-2024-0002", "datePublished": "2024-01-03"},
+    "containers": {"cna": {
+        "descriptions": [{"lang": "es", "value": "Desbordamiento"}, {"lang": "en", "value": "Buffer overflow"}],
+        "problemTypes": [{"descriptions": [{"lang": "en", "cweId": "CWE-120", "description": "Classic overflow"}]}],
+        "metrics": [{"other": {}}, {"cvssV3_1": {"attackComplexity": "HIGH"}}],
+    }},
+}]
+
+
+class Feed(BaseHTTPRequestHandler):
+    # Answers with the server's status and payload
+    def do_GET(self):
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(self.server.payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Feed)
+    httpd.status, httpd.payload = 200, b"[]"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}/api/last"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def temporary_db(tmp_path, monkeypatch):
+    for pool in (database.write_pool, database.read_pool):
+        pool.close()
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "data.db"))
+    monkeypatch.setattr(database, "_initialized", False)
+    monkeypatch.setitem(cve._attempt, "time", None)
+    yield
+    for pool in (database.write_pool, database.read_pool):
+        pool.close()
+
+
+def serve(server, payload, status=200):
+    server.payload = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    server.status = status
+
+
+def test_normalize_csaf():
+    assert cve.normalize(CSAF) == [{
+        "id": "CVE-2024-0001",
+        "fecha": "2024-01-02",
+        "descripcion": "XSS in the search form",
+        "cwe": "CWE-79 Cross-site Scripting",
+        "severidad": "LOW",
+    }]
+
+
+def test_normalize_cve_record():
+    assert cve.normalize(CVE_RECORD) == [{
+        "id": "CVE-2024-0002",
+        "fecha": "2024-01-03",
+        "descripcion": "Buffer overflow",
+        "cwe": "CWE-120 Classic overflow",
+        "severidad": "HIGH",
+    }]
+
+
+def test_normalize_defaults_and_limit():
+    assert cve.normalize([{"vulnerabilities": [{}]}, {"other": 1}]) == [{
+        "id": "Sin ID",
+        "fecha": "Sin fecha",
+        "descripcion": "Sin descripción",
+        "cwe": "Sin CWE ",
+        "severidad": "Sin severidad",
+    }]
+    many = [{"vulnerabilities": [{"cve": f"CVE-{i}"} for i in range(cve.MAX_CVES + 5)]}]
+    assert len(cve.normalize(many)) == cve.MAX_CVES
+
+
+@pytest.mark.parametrize("payload, cve_id", [(CSAF, "CVE-2024-0001"), (CVE_RECORD, "CVE-2024-0002")])
+def test_refresh_stores_both_shapes(server, payload, cve_id):
+    serve(server, payload)
+    assert cve.refresh(server.url)
+    assert [v["id"] for v in cve.latest()] == [cve_id]
+
+
+@pytest.mark.parametrize("payload, status", [(b"", 500), (b"not json", 200), ([], 200)])
+def test_failed_refresh_keeps_last_copy(server, payload, status):
+    serve(server, CSAF + CVE_RECORD)
+    assert cve.refresh(server.url)
+    stored = cve.latest()
+    assert [v["id"] for v in stored] == ["CVE-2024-0001", "CVE-2024-0002"]
+
+    serve(server, payload, status)
+    assert not cve.refresh(server.url)
+    assert cve.latest() == stored
+
+
+def test_latest_retries_at_most_once_per_interval(server, monkeypatch):
+    monkeypatch.setattr(cve, "CVE_API_URL", server.url)
+    serve(server, b"", 503)
+    assert cve.latest() == []
+    # The feed is back, but the last attempt was less than RETRY_INTERVAL ago
+    serve(server, CSAF)
+    assert cve.latest() == []
+    monkeypatch.setitem(cve._attempt, "time", cve._attempt["time"] - cve.RETRY_INTERVAL)
+    assert [v["id"] for v in cve.latest()] == ["CVE-2024-0001"]